@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor
+from http import HTTPStatus
+from typing import Any, Callable, Optional
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+# === Константы конфигурации ===
+# ANALYSIS_WORKERS=0 отключает пул: задачи выполняются прямо в обработчике
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", os.cpu_count() or 1))
+ANALYSIS_QUEUE_DEPTH = int(os.getenv("ANALYSIS_QUEUE_DEPTH", "32"))
+ANALYSIS_TIMEOUT = float(os.getenv("ANALYSIS_TIMEOUT", "60"))
+
+
+class AnalysisUnavailable(HTTPException):
+    """Пул анализа перегружен или задача не уложилась в отведённое время."""
+    def __init__(self, detail: str):
+        super().__init__(
+            status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+            detail=detail,
+            headers={"Retry-After": "5"}
+        )
+
+
+class AnalysisPool:
+    """
+    Пул процессов для CPU-ёмкого анализа текста (токенизация, код Хаффмана).
+    - workers: количество процессов
+    - queue_depth: сколько задач может ждать свободного процесса
+    - timeout: предельное время ожидания результата одной задачи, секунды
+    """
+    def __init__(self, workers: int, queue_depth: int, timeout: float):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.timeout = timeout
+        self.in_flight = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def capacity(self) -> int:
+        return self.workers + self.queue_depth
+
+    def start(self) -> None:
+        if self.workers > 0 and self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+            logger.info(f"Пул анализа запущен: {self.workers} процессов, очередь {self.queue_depth}")
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """
+        Выполняет func(*args) в пуле процессов.
+        При заполненной очереди сразу отвечает 503, не дожидаясь освобождения процессов.
+        """
+        if self._executor is None:
+            return func(*args)
+
+        if self.in_flight >= self.capacity:
+            raise AnalysisUnavailable("Сервер перегружен, повторите запрос позже")
+
+        loop = asyncio.get_running_loop()
+        try:
+            task = self._executor.submit(func, *args)
+        except BrokenExecutor:
+            self._restart()
+            raise AnalysisUnavailable("Ошибка обработки документа, повторите запрос позже")
+
+        # Слот освобождается, только когда процесс действительно закончил задачу:
+        # после таймаута или отмены запроса он продолжает её выполнять
+        self.in_flight += 1
+        task.add_done_callback(lambda _: self._release(loop))
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(task), self.timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Задача анализа {func.__name__} превысила {self.timeout} с")
+            raise AnalysisUnavailable("Превышено время обработки документа")
+        except BrokenExecutor:
+            self._restart()
+            raise AnalysisUnavailable("Ошибка обработки документа, повторите запрос позже")
+
+    def _release(self, loop: asyncio.AbstractEventLoop) -> None:
+        # Колбэк future вызывается из служебного потока пула — счётчик меняем в цикле событий
+        try:
+            loop.call_soon_threadsafe(self._decrement)
+        except RuntimeError:
+            # Цикл событий уже закрыт (остановка приложения)
+            pass
+
+    def _decrement(self) -> None:
+        self.in_flight -= 1
+
+    def _restart(self) -> None:
+        # Процесс пула аварийно завершился — пересоздаём пул для следующих задач
+        logger.exception("Пул анализа повреждён, перезапуск")
+        self.shutdown()
+        self.start()
+
+analysis_pool = AnalysisPool(ANALYSIS_WORKERS, ANALYSIS_QUEUE_DEPTH, ANALYSIS_TIMEOUT)
@@ -3,10 +3,10 @@ from datetime import datetime, timedelta, timezone
 
 from passlib.context import CryptContext
 from jose import jwt
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
 from app.models.user import User, UserCreate
-from app.database import async_session
 
 # === Константы конфигурации ===
 SECRET_KEY = os.getenv("SECRET_KEY", "super-secret")
@@ -40,25 +40,23 @@ def decode_token(token: str) -> dict:
     return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
 
 
-async def register_user(user_data: UserCreate) -> User:
+async def register_user(db: AsyncSession, user_data: UserCreate) -> User:
     """Создаёт нового пользователя."""
-    async with async_session() as session:
-        user = User(
-            username=user_data.username,
-            hashed_password=hash_password(user_data.password)
-        )
-        session.add(user)
-        await session.commit()
-        await session.refresh(user)
-        return user
-
-
-async def authenticate_user(username: str, password: str) -> User | None:
+    user = User(
+        username=user_data.username,
+        hashed_password=hash_password(user_data.password)
+    )
+    db.add(user)
+    await db.commit()
+    await db.refresh(user)
+    return user
+
+
+async def authenticate_user(db: AsyncSession, username: str, password: str) -> User | None:
     """Проверяет логин и пароль пользователя."""
-    async with async_session() as session:
-        result = await session.execute(select(User).where(User.username == username))
-        user = result.scalar_one_or_none()
+    result = await db.execute(select(User).where(User.username == username))
+    user = result.scalar_one_or_none()
 
-        if not user or not verify_password(password, user.hashed_password):
-            return None
-        return user
+    if not user or not verify_password(password, user.hashed_password):
+        return None
+    return user
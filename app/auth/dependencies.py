@@ -3,6 +3,7 @@ from jose import jwt, JWTError
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.auth.auth_services import SECRET_KEY, ALGORITHM
+from app.auth.user_cache import user_cache
 from app.database import get_db
 from app.models.user import User
 
@@ -24,7 +25,7 @@ async def get_current_user(
         user_id = payload.get("sub")
         if not user_id:
             raise HTTPException(status_code=401, detail="Недопустимый токен")
-        user = await db.get(User, int(user_id))
+        user = await load_user(db, int(user_id))
         if not user:
             raise HTTPException(status_code=401, detail="Пользователь не найден")
         return user
@@ -49,11 +50,25 @@ async def get_current_user_optional(
         user_id = payload.get("sub")
         if not user_id:
             return None
-        return await db.get(User, int(user_id))
+        return await load_user(db, int(user_id))
     except Exception:
         return None
 
 
+async def load_user(db: AsyncSession, user_id: int) -> User | None:
+    """
+    Возвращает пользователя из кэша, а при промахе — из БД.
+    Сессия не берёт соединение из пула, пока к ней не обратились,
+    поэтому при попадании в кэш запрос к БД не выполняется вовсе.
+    """
+    user = user_cache.get(user_id)
+    if user is None:
+        user = await db.get(User, user_id)
+        if user:
+            user_cache.put(user)
+    return user
+
+
 def extract_token_from_request(request: Request) -> str | None:
     """
     Извлекает токен из заголовка Authorization или из cookie.
@@ -1,11 +1,15 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
+from sqlalchemy import select, delete, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import selectinload
 
 from app.models.user import User
-from app.models.collection import Collection
+from app.models.collection import Collection, CollectionDocument
 from app.models.document import FileUpload, WordStat
 from app.schemas import CollectionCreate
+from app import metrics
+from app.crud import term_index_crud
+from app.crud.document_crud import get_row_count
 
 # Создание новой коллекции
 async def create_collection(db: AsyncSession, user: User, collection_data: CollectionCreate) -> Collection:
@@ -17,113 +21,176 @@ async def create_collection(db: AsyncSession, user: User, collection_data: Colle
     db.add(new_collection)
     await db.commit()
     await db.refresh(new_collection)
+    metrics.collections_created.inc()
     return new_collection
 
-# Получение всех коллекций пользователя с загрузкой документов
+# Получение всех коллекций пользователя с метаданными документов (без содержимого)
 async def get_user_collections(db: AsyncSession, user: User):
     result = await db.execute(
         select(Collection)
-        .options(selectinload(Collection.files))
+        .options(
+            selectinload(Collection.files).load_only(
+                FileUpload.id, FileUpload.user_id, FileUpload.filename,
+                FileUpload.unique_words, FileUpload.created_at
+            )
+        )
         .where(Collection.user_id == user.id)
     )
     return result.scalars().all()
 
-# Получение коллекций с названиями вложенных документов
+# Получение коллекций с названиями вложенных документов одним запросом-проекцией
 async def get_user_collections_with_ids(db: AsyncSession, user: User):
     result = await db.execute(
-        select(Collection)
+        select(Collection.id, Collection.name, FileUpload.filename)
+        .outerjoin(CollectionDocument, CollectionDocument.collection_id == Collection.id)
+        .outerjoin(FileUpload, FileUpload.id == CollectionDocument.document_id)
         .where(Collection.user_id == user.id)
-        .options(selectinload(Collection.files))
+        .order_by(Collection.id, CollectionDocument.id)
     )
-    collections = result.scalars().all()
-    return [
-        {
-            "collection_id": c.id,
-            "collection_name": c.name,
-            "documents_name": [f.filename for f in c.files]
-        }
-        for c in collections
-    ]
-
-# Получение одной коллекции по ID
+    collections: dict[int, dict] = {}
+    for collection_id, collection_name, filename in result:
+        collection = collections.setdefault(collection_id, {
+            "collection_id": collection_id,
+            "collection_name": collection_name,
+            "documents_name": []
+        })
+        if filename is not None:
+            collection["documents_name"].append(filename)
+    return list(collections.values())
+
+# Получение одной коллекции по ID (без документов)
 async def get_collection_by_id(db: AsyncSession, collection_id: int, user: User) -> Collection | None:
     result = await db.execute(
-        select(Collection)
-        .options(selectinload(Collection.files))
-        .where(Collection.id == collection_id, Collection.user_id == user.id)
+        select(Collection).where(Collection.id == collection_id, Collection.user_id == user.id)
     )
     return result.scalar_one_or_none()
 
+# Получение id документов коллекции из промежуточной таблицы
+async def get_collection_file_ids(db: AsyncSession, collection_id: int) -> list[int]:
+    result = await db.scalars(
+        select(CollectionDocument.document_id)
+        .where(CollectionDocument.collection_id == collection_id)
+        .order_by(CollectionDocument.id)
+    )
+    return list(result)
+
+# Получение id коллекции, если она принадлежит пользователю
+async def get_user_collection_id(db: AsyncSession, collection_id: int, user: User) -> int | None:
+    return await db.scalar(
+        select(Collection.id).where(Collection.id == collection_id, Collection.user_id == user.id)
+    )
+
+# Связь документа с коллекцией напрямую в промежуточной таблице; повторная связь игнорируется.
+# Возвращает True, если связь добавлена
+async def link_file_to_collection(db: AsyncSession, collection_id: int, file_id: int) -> bool:
+    result = await db.execute(
+        pg_insert(CollectionDocument)
+        .values(collection_id=collection_id, document_id=file_id)
+        .on_conflict_do_nothing(index_elements=[CollectionDocument.collection_id, CollectionDocument.document_id])
+        .returning(CollectionDocument.id)
+    )
+    return result.scalar() is not None
+
 # Добавление документа в коллекцию
-async def add_file_to_collection(db: AsyncSession, collection_id: int, file_id: int, user: User):
-    collection = await get_collection_by_id(db, collection_id, user)
-    if not collection:
+async def add_file_to_collection(db: AsyncSession, collection_id: int, file_id: int, user: User) -> int | None:
+    target_id = await get_user_collection_id(db, collection_id, user)
+    if target_id is None:
         collection = Collection(name=f"Коллекция {collection_id}", user_id=user.id)
         db.add(collection)
+        await db.flush()
+        target_id = collection.id
         await db.commit()
-        await db.refresh(collection)
+        metrics.collections_created.inc()
 
-    file = await db.get(FileUpload, file_id)
-    if not file or file.user_id != user.id:
+    # Проверка владельца без загрузки содержимого документа
+    owner_id = await db.scalar(select(FileUpload.user_id).where(FileUpload.id == file_id))
+    if owner_id != user.id:
         return None
 
-    if file not in collection.files:
-        collection.files.append(file)
+    if await link_file_to_collection(db, target_id, file_id):
+        await term_index_crud.bump_corpus_version(db, user.id)
         await db.commit()
-        await db.refresh(collection)
 
-    return collection
+    return target_id
 
 # Удаление документа из коллекции
-async def remove_file_from_collection(db: AsyncSession, collection_id: int, file_id: int, user: User):
-    collection = await get_collection_by_id(db, collection_id, user)
-    if not collection:
+async def remove_file_from_collection(db: AsyncSession, collection_id: int, file_id: int, user: User) -> int | None:
+    if await get_user_collection_id(db, collection_id, user) is None:
         return None
-    file = await db.get(FileUpload, file_id)
-    if file and file in collection.files:
-        collection.files.remove(file)
+    result = await db.execute(
+        delete(CollectionDocument)
+        .where(CollectionDocument.collection_id == collection_id, CollectionDocument.document_id == file_id)
+        .returning(CollectionDocument.id)
+    )
+    if result.first() is not None:
+        await term_index_crud.bump_corpus_version(db, user.id)
         await db.commit()
-    return collection
+    return collection_id
 
 # Получение TF-статистики по коллекции
 async def get_collection_word_stat(db: AsyncSession, collection_id: int, user: User) -> list[dict]:
-    collection = await get_collection_by_id(db, collection_id, user)
-    if not collection or not collection.files:
+    if await get_user_collection_id(db, collection_id, user) is None:
+        return []
+    file_ids = await get_collection_file_ids(db, collection_id)
+    if not file_ids:
         return []
 
-    file_ids = [file.id for file in collection.files]
-    result = await db.execute(
-        select(WordStat.word, func.sum(WordStat.tf).label("sum_tf"))
-        .where(WordStat.file_id.in_(file_ids))
-        .group_by(WordStat.word)
-    )
-    return [{"word": row.word, "tf": row.sum_tf} for row in result]
+    # Суммируем TF по полным векторам документов (id слова -> сумма TF)
+    vectors = await term_index_crud.get_term_vectors(db, file_ids)
+    sum_tf_by_id: dict[int, float] = {}
+    for vector in vectors:
+        term_ids, counts = term_index_crud.unpack_term_vector(vector)
+        for term_id, count in zip(term_ids, counts):
+            sum_tf_by_id[term_id] = sum_tf_by_id.get(term_id, 0.0) + count / vector.total_words
 
-# Получение или создание дефолтной коллекции
-async def get_or_create_default_collection(db: AsyncSession, user: User) -> Collection:
-    result = await db.execute(
-        select(Collection).where(Collection.name == "default", Collection.user_id == user.id)
+    words = await term_index_crud.get_words_by_ids(db, sum_tf_by_id.keys())
+    sum_tf = {words[term_id]: tf for term_id, tf in sum_tf_by_id.items()}
+
+    # Документы, загруженные до появления векторов, учитываются по сохранённым WordStat
+    legacy_ids = set(file_ids) - {vector.file_id for vector in vectors}
+    if legacy_ids:
+        result = await db.execute(
+            select(WordStat.word, func.sum(WordStat.tf).label("sum_tf"))
+            .where(WordStat.file_id.in_(legacy_ids))
+            .group_by(WordStat.word)
+        )
+        for row in result:
+            sum_tf[row.word] = sum_tf.get(row.word, 0.0) + row.sum_tf
+
+    return [{"word": word, "tf": tf} for word, tf in sum_tf.items()]
+
+# Получение id дефолтной коллекции, при отсутствии она создаётся (без загрузки её документов)
+async def get_or_create_default_collection_id(db: AsyncSession, user: User) -> int:
+    collection_id = await db.scalar(
+        select(Collection.id)
+        .where(Collection.name == "default", Collection.user_id == user.id)
+        .order_by(Collection.id)
+        .limit(1)
     )
-    collection = result.scalar_one_or_none()
-    if not collection:
+    if collection_id is None:
         collection = Collection(name="default", user_id=user.id)
         db.add(collection)
-    return collection
+        await db.flush()
+        collection_id = collection.id
+        metrics.collections_created.inc()
+    return collection_id
 
 # Добавление файла в дефолтную коллекцию
 async def add_file_to_default_collection(db: AsyncSession, file: FileUpload, user: User) -> None:
-    result = await db.execute(
-        select(Collection)
-        .options(selectinload(Collection.files))
-        .where(Collection.name == "default", Collection.user_id == user.id)
+    collection_id = await get_or_create_default_collection_id(db, user)
+    await link_file_to_collection(db, collection_id, file.id)
+
+# Добавление пачки новых файлов в дефолтную коллекцию одним INSERT
+async def add_files_to_default_collection(db: AsyncSession, file_ids: list[int], user: User) -> None:
+    collection_id = await get_or_create_default_collection_id(db, user)
+    insert_links = pg_insert(CollectionDocument).on_conflict_do_nothing(
+        index_elements=[CollectionDocument.collection_id, CollectionDocument.document_id]
+    )
+    await db.execute(
+        insert_links,
+        [{"collection_id": collection_id, "document_id": file_id} for file_id in file_ids]
     )
-    collection = result.scalar_one_or_none()
-    if not collection:
-        collection = await get_or_create_default_collection(db, user)
-    if all(f.id != file.id for f in collection.files):
-        collection.files.append(file)
 
-# Подсчёт количества коллекций
+# Количество коллекций (без сканирования таблицы)
 async def count_collections(db: AsyncSession) -> int:
-    result = await db.execute(select(func.count()).select_from(Collection))
-    return result.scalar_one()
+    return await get_row_count(db, Collection.__tablename__)
@@ -1,8 +1,11 @@
 from typing import List, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, delete, func
+from sqlalchemy import select, update, delete, func, text, Float
+from sqlalchemy.orm import load_only, undefer
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
-from app.models.document import FileUpload, WordStat
+from app.crud.term_index_crud import _array
+from app.models.document import FileUpload, WordStat, HuffmanCache
 from app.schemas import FileUploadCreate, WordStatCreate
 import logging
 
@@ -18,11 +21,34 @@ async def create_file_upload(db: AsyncSession, user_id: int, file_data: FileUplo
     await db.refresh(new_file)
     return new_file
 
-# Получение всех файлов пользователя
+# Получение всех файлов пользователя (только метаданные, без содержимого)
 async def get_user_files(db: AsyncSession, user_id: int) -> List[FileUpload]:
-    result = await db.execute(select(FileUpload).where(FileUpload.user_id == user_id))
+    result = await db.execute(
+        select(FileUpload)
+        .options(load_only(
+            FileUpload.id, FileUpload.filename, FileUpload.unique_words, FileUpload.encoding, FileUpload.created_at
+        ))
+        .where(FileUpload.user_id == user_id)
+        .order_by(FileUpload.id)
+    )
     return result.scalars().all()
 
+# Получение файла пользователя; содержимое загружается только по запросу
+async def get_user_file(db: AsyncSession, file_id: int, user_id: int, with_content: bool = False) -> Optional[FileUpload]:
+    query = select(FileUpload).where(FileUpload.id == file_id, FileUpload.user_id == user_id)
+    if with_content:
+        query = query.options(undefer(FileUpload.content))
+    result = await db.execute(query)
+    return result.scalar_one_or_none()
+
+# Получение id всех файлов пользователя
+async def get_user_file_ids(db: AsyncSession, user_id: int) -> List[int]:
+    return (await db.scalars(select(FileUpload.id).where(FileUpload.user_id == user_id))).all()
+
+# Получение только текста файла
+async def get_file_content(db: AsyncSession, file_id: int) -> Optional[str]:
+    return await db.scalar(select(FileUpload.content).where(FileUpload.id == file_id))
+
 # Удаление файла пользователя
 async def delete_file_upload(db: AsyncSession, file_id: int, user_id: int) -> Optional[FileUpload]:
     result = await db.execute(
@@ -35,10 +61,30 @@ async def delete_file_upload(db: AsyncSession, file_id: int, user_id: int) -> Op
         logger.info(f"Удалён файл ID={file_id} пользователем ID={user_id}")
     return file
 
-# Подсчёт всех документов
+# Получение сохранённого кода Хаффмана документа
+async def get_huffman_cache(db: AsyncSession, file_id: int) -> Optional[HuffmanCache]:
+    return await db.get(HuffmanCache, file_id)
+
+# Сохранение кода Хаффмана документа (параллельный запрос мог сохранить его раньше)
+async def save_huffman_cache(db: AsyncSession, file_id: int, content_hash: str, encoded: bytes) -> None:
+    await db.execute(
+        pg_insert(HuffmanCache)
+        .values(file_id=file_id, content_hash=content_hash, encoded=encoded)
+        .on_conflict_do_nothing(index_elements=[HuffmanCache.file_id])
+    )
+    await db.commit()
+
+# Точное число строк таблицы из счётчика table_row_counts (поддерживается триггерами, миграция 7)
+async def get_row_count(db: AsyncSession, table_name: str) -> int:
+    row_count = await db.scalar(
+        text("SELECT sum(row_count) FROM table_row_counts WHERE table_name = :table_name"),
+        {"table_name": table_name}
+    )
+    return int(row_count or 0)
+
+# Количество документов (без сканирования таблицы)
 async def count_documents(db: AsyncSession) -> int:
-    result = await db.execute(select(func.count()).select_from(FileUpload))
-    return result.scalar_one()
+    return await get_row_count(db, FileUpload.__tablename__)
 
 # === СТАТИСТИКА ===
 
@@ -55,6 +101,25 @@ async def get_word_stat_for_file(db: AsyncSession, file_id: int) -> List[WordSta
     result = await db.execute(select(WordStat).where(WordStat.file_id == file_id))
     return result.scalars().all()
 
+# Запись IDF слов во всю статистику пользователя: слова и значения соединяются с word_stat через unnest.
+# Строки, где значение не изменилось, не перезаписываются
+async def update_word_stat_idf(db: AsyncSession, user_id: int, words: List[str], idf: List[float]) -> int:
+    terms = (
+        func.unnest(_array(words), _array(idf, Float))
+        .table_valued("word", "idf")
+        .render_derived(name="terms")
+    )
+    result = await db.execute(
+        update(WordStat)
+        .where(
+            WordStat.user_id == user_id,
+            WordStat.word == terms.c.word,
+            WordStat.idf.is_distinct_from(terms.c.idf)
+        )
+        .values(idf=terms.c.idf)
+    )
+    return result.rowcount
+
 # Удаление статистики по файлу
 async def delete_word_stat_for_file(db: AsyncSession, file_id: int) -> None:
     await db.execute(delete(WordStat).where(WordStat.file_id == file_id))
@@ -0,0 +1,94 @@
+from datetime import timedelta
+from typing import List, Optional
+
+from sqlalchemy import select, update, func, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.job import UploadJob, JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED
+
+# Создание задачи обработки загрузки
+async def create_upload_job(db: AsyncSession, user_id: int, filename: str, payload_ref: str, tokenizer: str) -> UploadJob:
+    job = UploadJob(
+        user_id=user_id, filename=filename, payload_ref=payload_ref, tokenizer=tokenizer, status=JOB_QUEUED, progress=0.0
+    )
+    db.add(job)
+    await db.commit()
+    await db.refresh(job)
+    return job
+
+# Получение задачи пользователя
+async def get_user_job(db: AsyncSession, job_id: int, user_id: int) -> Optional[UploadJob]:
+    result = await db.execute(
+        select(UploadJob).where(UploadJob.id == job_id, UploadJob.user_id == user_id)
+    )
+    return result.scalar_one_or_none()
+
+# Захват задач воркером: FOR UPDATE SKIP LOCKED не даёт двум воркерам взять одну задачу.
+# Задачи, не обновлявшиеся в running дольше stale_after (воркер упал), берутся повторно.
+# Захваченные задачи получают общую метку token, по ней воркер обновляет и завершает их.
+# Возвращает пары (id задачи, номер попытки)
+async def claim_upload_jobs(db: AsyncSession, limit: int, stale_after: timedelta, token: str) -> List[tuple[int, int]]:
+    result = await db.execute(
+        select(UploadJob.id)
+        .where(or_(
+            UploadJob.status == JOB_QUEUED,
+            (UploadJob.status == JOB_RUNNING) & (UploadJob.updated_at < func.now() - stale_after)
+        ))
+        .order_by(UploadJob.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    job_ids = result.scalars().all()
+    jobs = []
+    if job_ids:
+        result = await db.execute(
+            update(UploadJob)
+            .where(UploadJob.id.in_(job_ids))
+            .values(status=JOB_RUNNING, progress=0.0, attempts=UploadJob.attempts + 1, claim_token=token)
+            .returning(UploadJob.id, UploadJob.attempts)
+        )
+        jobs = sorted(tuple(row) for row in result)
+    await db.commit()
+    return jobs
+
+def _claimed(job_id: int, token: str):
+    # Задача всё ещё выполняется этим захватом
+    return (UploadJob.id == job_id) & (UploadJob.status == JOB_RUNNING) & (UploadJob.claim_token == token)
+
+# Отметка, что воркер жив: обновляет updated_at, чтобы задачу не сочли зависшей.
+# Возвращает False, если задачу уже перехватил другой воркер
+async def touch_job(db: AsyncSession, job_id: int, token: str) -> bool:
+    result = await db.execute(update(UploadJob).where(_claimed(job_id, token)).values(updated_at=func.now()))
+    await db.commit()
+    return result.rowcount > 0
+
+# Обновление прогресса задачи
+async def set_job_progress(db: AsyncSession, job_id: int, token: str, progress: float) -> None:
+    await db.execute(update(UploadJob).where(_claimed(job_id, token)).values(progress=progress))
+    await db.commit()
+
+# Возврат задачи в очередь
+async def requeue_job(db: AsyncSession, job_id: int, token: str) -> None:
+    await db.execute(
+        update(UploadJob).where(_claimed(job_id, token)).values(status=JOB_QUEUED, progress=0.0, claim_token=None)
+    )
+    await db.commit()
+
+# Успешное завершение задачи (фиксируется вместе с созданным документом).
+# Возвращает False, если задачу перехватил другой воркер: тогда транзакцию нужно откатить
+async def mark_job_done(db: AsyncSession, job_id: int, token: str, document_id: int) -> bool:
+    result = await db.execute(
+        update(UploadJob)
+        .where(_claimed(job_id, token))
+        .values(status=JOB_DONE, progress=1.0, document_id=document_id, payload=None)
+    )
+    return result.rowcount > 0
+
+# Завершение задачи с ошибкой
+async def mark_job_failed(db: AsyncSession, job_id: int, token: str, error: str) -> None:
+    await db.execute(
+        update(UploadJob)
+        .where(_claimed(job_id, token))
+        .values(status=JOB_FAILED, error=error, payload=None)
+    )
+    await db.commit()
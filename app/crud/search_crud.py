@@ -0,0 +1,151 @@
+from typing import Iterable
+
+from sqlalchemy import select, insert, update, delete, tuple_, any_, Integer
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.crud.term_index_crud import _array
+from app.models.document import FileUpload
+from app.models.term_index import SearchPosting, SearchIndexStat, SearchRebuildRequest
+
+# Строк в одном INSERT при перестроении индекса
+INSERT_BATCH_SIZE = 5000
+
+# Получение состояния поискового индекса пользователя (None, если индекс не построен)
+async def get_index_stat(db: AsyncSession, user_id: int, for_update: bool = False) -> SearchIndexStat | None:
+    query = select(SearchIndexStat).where(SearchIndexStat.user_id == user_id)
+    if for_update:
+        query = query.with_for_update()
+    return await db.scalar(query)
+
+# Создание пустого индекса пользователя
+async def create_index_stat(db: AsyncSession, user_id: int) -> SearchIndexStat:
+    stat = SearchIndexStat(user_id=user_id, doc_count=0, total_words=0, deleted_docs=0, generation=0)
+    db.add(stat)
+    await db.flush()
+    return stat
+
+# Последние блоки слов: номер, количество документов и id последнего документа
+async def get_tail_blocks(db: AsyncSession, user_id: int, term_ids: Iterable[int]) -> dict[int, tuple[int, int, int]]:
+    result = await db.execute(
+        select(SearchPosting.term_id, SearchPosting.block, SearchPosting.doc_count, SearchPosting.last_doc_id)
+        .where(SearchPosting.user_id == user_id, SearchPosting.term_id == any_(_array(term_ids, Integer)))
+        .distinct(SearchPosting.term_id)
+        .order_by(SearchPosting.term_id, SearchPosting.block.desc())
+    )
+    return {row.term_id: (row.block, row.doc_count, row.last_doc_id) for row in result}
+
+# Дописывание вхождений: новые блоки вставляются, в существующие байты добавляются в конец
+async def append_postings(db: AsyncSession, user_id: int, rows: list[dict]) -> None:
+    if not rows:
+        return
+    upsert = pg_insert(SearchPosting)
+    await db.execute(
+        upsert.on_conflict_do_update(
+            index_elements=[SearchPosting.user_id, SearchPosting.term_id, SearchPosting.block],
+            set_={
+                "doc_count": SearchPosting.doc_count + upsert.excluded.doc_count,
+                "last_doc_id": upsert.excluded.last_doc_id,
+                "doc_ids": SearchPosting.doc_ids.op("||")(upsert.excluded.doc_ids),
+                "counts": SearchPosting.counts.op("||")(upsert.excluded.counts),
+                "norms": SearchPosting.norms.op("||")(upsert.excluded.norms),
+            }
+        ),
+        [{"user_id": user_id, **row} for row in rows]
+    )
+
+# Учёт новых документов в счётчиках индекса
+async def add_documents(db: AsyncSession, user_id: int, doc_count: int, total_words: int) -> None:
+    await db.execute(
+        update(SearchIndexStat)
+        .where(SearchIndexStat.user_id == user_id)
+        .values(
+            doc_count=SearchIndexStat.doc_count + doc_count,
+            total_words=SearchIndexStat.total_words + total_words
+        )
+    )
+
+# Учёт удалённого документа: его вхождения остаются в блоках до перестроения
+async def mark_document_deleted(db: AsyncSession, user_id: int, total_words: int) -> None:
+    await db.execute(
+        update(SearchIndexStat)
+        .where(SearchIndexStat.user_id == user_id)
+        .values(
+            doc_count=SearchIndexStat.doc_count - 1,
+            total_words=SearchIndexStat.total_words - total_words,
+            deleted_docs=SearchIndexStat.deleted_docs + 1
+        )
+    )
+
+# Полная замена индекса пользователя
+async def replace_index(db: AsyncSession, user_id: int, rows: list[dict], doc_count: int, total_words: int) -> SearchIndexStat:
+    await db.execute(delete(SearchPosting).where(SearchPosting.user_id == user_id))
+    for offset in range(0, len(rows), INSERT_BATCH_SIZE):
+        await db.execute(
+            insert(SearchPosting),
+            [{"user_id": user_id, **row} for row in rows[offset:offset + INSERT_BATCH_SIZE]]
+        )
+    counter = pg_insert(SearchIndexStat).values(
+        user_id=user_id, doc_count=doc_count, total_words=total_words, deleted_docs=0, generation=0
+    )
+    return await db.scalar(
+        counter.on_conflict_do_update(
+            index_elements=[SearchIndexStat.user_id],
+            set_={
+                "doc_count": counter.excluded.doc_count,
+                "total_words": counter.excluded.total_words,
+                "deleted_docs": 0,
+                "generation": SearchIndexStat.generation + 1,
+            }
+        ).returning(SearchIndexStat),
+        execution_options={"populate_existing": True}
+    )
+
+# Состав блоков для слов запроса (без данных): по нему проверяется кэш декодированных блоков
+async def get_block_versions(db: AsyncSession, user_id: int, term_ids: Iterable[int]) -> list[tuple[int, int, int]]:
+    result = await db.execute(
+        select(SearchPosting.term_id, SearchPosting.block, SearchPosting.doc_count)
+        .where(SearchPosting.user_id == user_id, SearchPosting.term_id == any_(_array(term_ids, Integer)))
+    )
+    return [(row.term_id, row.block, row.doc_count) for row in result]
+
+# Получение данных блоков по парам (id слова, номер блока)
+async def get_blocks(db: AsyncSession, user_id: int, keys: list[tuple[int, int]]):
+    result = await db.execute(
+        select(
+            SearchPosting.term_id, SearchPosting.block, SearchPosting.doc_count,
+            SearchPosting.doc_ids, SearchPosting.counts, SearchPosting.norms
+        )
+        .where(SearchPosting.user_id == user_id, tuple_(SearchPosting.term_id, SearchPosting.block).in_(keys))
+    )
+    return result.all()
+
+# Названия найденных документов; удалённые документы в результат не попадают
+async def get_document_names(db: AsyncSession, user_id: int, file_ids: Iterable[int]) -> dict[int, str]:
+    result = await db.execute(
+        select(FileUpload.id, FileUpload.filename)
+        .where(FileUpload.user_id == user_id, FileUpload.id == any_(_array(file_ids, Integer)))
+    )
+    return {row.id: row.filename for row in result}
+
+# Запрос на перестроение индекса пользователя; повторный запрос не дублируется
+async def request_rebuild(db: AsyncSession, user_id: int) -> None:
+    await db.execute(
+        pg_insert(SearchRebuildRequest)
+        .values(user_id=user_id)
+        .on_conflict_do_nothing(index_elements=[SearchRebuildRequest.user_id])
+    )
+
+# Захват самого старого запроса на перестроение: SKIP LOCKED не даёт двум воркерам взять один запрос,
+# блокировка строки держится до commit перестроенного индекса
+async def claim_rebuild_request(db: AsyncSession) -> int | None:
+    return await db.scalar(
+        select(SearchRebuildRequest.user_id)
+        .order_by(SearchRebuildRequest.requested_at)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    )
+
+# Удаление выполненного запроса на перестроение
+async def delete_rebuild_request(db: AsyncSession, user_id: int) -> None:
+    await db.execute(delete(SearchRebuildRequest).where(SearchRebuildRequest.user_id == user_id))
@@ -0,0 +1,294 @@
+from array import array
+from typing import Iterable, Mapping
+
+from sqlalchemy import select, insert, update, delete, exists, func, literal, any_, and_, cast, String, Integer, Float
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.document import FileUpload
+from app.models.term_index import UserTermDF, UserCorpusStat, Vocabulary, DocumentTermVector
+
+
+def _array(values: Iterable, item_type=String):
+    """Передаёт список одним параметром-массивом вместо длинного IN (...)."""
+    return literal(list(values), type_=ARRAY(item_type))
+
+# Получение счётчика документов пользователя (None, если индекс ещё не построен)
+async def get_document_count(db: AsyncSession, user_id: int) -> int | None:
+    return await db.scalar(select(UserCorpusStat.doc_count).where(UserCorpusStat.user_id == user_id))
+
+# Получение версии корпуса пользователя (None, если индекс ещё не построен)
+async def get_corpus_version(db: AsyncSession, user_id: int) -> int | None:
+    return await db.scalar(select(UserCorpusStat.version).where(UserCorpusStat.user_id == user_id))
+
+# Блокировка счётчиков корпуса до конца транзакции: загрузки и удаления документов пользователя ждут
+async def lock_corpus(db: AsyncSession, user_id: int) -> None:
+    await db.execute(
+        select(UserCorpusStat.user_id).where(UserCorpusStat.user_id == user_id).with_for_update()
+    )
+
+# Отметка об изменении корпуса или коллекций пользователя
+async def bump_corpus_version(db: AsyncSession, user_id: int) -> None:
+    await db.execute(
+        update(UserCorpusStat)
+        .where(UserCorpusStat.user_id == user_id)
+        .values(version=UserCorpusStat.version + 1)
+    )
+
+# Пользователи, у которых корпус менялся после последнего пересчёта сохранённых IDF
+async def get_stale_idf_users(db: AsyncSession, user_id: int | None = None, force: bool = False):
+    query = (
+        select(UserCorpusStat.user_id, UserCorpusStat.doc_count, UserCorpusStat.version)
+        .order_by(UserCorpusStat.user_id)
+    )
+    if user_id is not None:
+        query = query.where(UserCorpusStat.user_id == user_id)
+    if not force:
+        query = query.where(UserCorpusStat.idf_version.is_distinct_from(UserCorpusStat.version))
+    return (await db.execute(query)).all()
+
+# Отметка о пересчёте сохранённых IDF для версии корпуса
+async def set_idf_version(db: AsyncSession, user_id: int, version: int) -> None:
+    await db.execute(
+        update(UserCorpusStat).where(UserCorpusStat.user_id == user_id).values(idf_version=version)
+    )
+
+# Получение всего индекса документной частоты пользователя двумя массивами (одна строка результата)
+async def get_all_document_frequencies(db: AsyncSession, user_id: int) -> tuple[list[str], list[int]]:
+    result = await db.execute(
+        select(func.array_agg(UserTermDF.word), func.array_agg(UserTermDF.doc_count))
+        .where(UserTermDF.user_id == user_id)
+    )
+    words, doc_counts = result.one()
+    return words or [], doc_counts or []
+
+# Получение документной частоты для списка слов
+async def get_document_frequencies(db: AsyncSession, user_id: int, words: Iterable[str]) -> dict[str, int]:
+    result = await db.execute(
+        select(UserTermDF.word, UserTermDF.doc_count)
+        .where(UserTermDF.user_id == user_id, UserTermDF.word == any_(_array(words)))
+    )
+    return {row.word: row.doc_count for row in result}
+
+# Отбор limit слов по IDF в БД: слова и их TF соединяются с индексом через unnest
+async def rank_words_by_idf(
+    db: AsyncSession,
+    user_id: int,
+    total_docs: int,
+    tf: Mapping[str, float],
+    limit: int | None,
+    descending: bool
+) -> list[dict]:
+    terms = (
+        func.unnest(_array(tf.keys()), _array(tf.values(), Float))
+        .table_valued("word", "tf")
+        .render_derived(name="terms")
+    )
+    if total_docs:
+        # IDF по формуле log10(N / (1 + n_i)), где N — общее число документов пользователя
+        doc_count = cast(1 + func.coalesce(UserTermDF.doc_count, 0), Float)
+        idf = func.log(literal(total_docs, Float) / doc_count)
+    else:
+        idf = literal(0.0, Float)
+    idf = idf.label("idf")
+
+    query = (
+        select(terms.c.word, terms.c.tf, idf)
+        .select_from(terms.outerjoin(
+            UserTermDF, and_(UserTermDF.user_id == user_id, UserTermDF.word == terms.c.word)
+        ))
+        .order_by(idf.desc() if descending else idf.asc(), terms.c.tf.desc() if descending else terms.c.tf.asc())
+        .limit(limit)
+    )
+    result = await db.execute(query)
+    return [{"word": row.word, "tf": row.tf, "idf": row.idf} for row in result]
+
+# Учёт нового документа: +1 к счётчику документов и к частоте каждого его слова
+async def register_document_terms(db: AsyncSession, user_id: int, words: Iterable[str]) -> tuple[int, dict[str, int]]:
+    return await register_documents_terms(db, user_id, 1, dict.fromkeys(words, 1))
+
+# Учёт пачки документов: +new_docs к счётчику документов и +doc_counts[word] к частоте слов
+async def register_documents_terms(
+    db: AsyncSession,
+    user_id: int,
+    new_docs: int,
+    doc_counts: Mapping[str, int]
+) -> tuple[int, dict[str, int]]:
+    counter = pg_insert(UserCorpusStat).values(user_id=user_id, doc_count=new_docs)
+    total_docs = await db.scalar(
+        counter.on_conflict_do_update(
+            index_elements=[UserCorpusStat.user_id],
+            set_={
+                "doc_count": UserCorpusStat.doc_count + counter.excluded.doc_count,
+                "version": UserCorpusStat.version + 1
+            }
+        ).returning(UserCorpusStat.doc_count)
+    )
+
+    upsert = pg_insert(UserTermDF).from_select(
+        ["user_id", "word", "doc_count"],
+        select(
+            literal(user_id, Integer),
+            func.unnest(_array(doc_counts.keys())),
+            func.unnest(_array(doc_counts.values(), Integer))
+        )
+    )
+    result = await db.execute(
+        upsert.on_conflict_do_update(
+            index_elements=[UserTermDF.user_id, UserTermDF.word],
+            set_={"doc_count": UserTermDF.doc_count + upsert.excluded.doc_count}
+        ).returning(UserTermDF.word, UserTermDF.doc_count)
+    )
+    return total_docs, {row.word: row.doc_count for row in result}
+
+# Учёт удаления документа: -1 к счётчику документов и к частоте каждого его слова
+async def unregister_document_terms(db: AsyncSession, user_id: int, words: Iterable[str]) -> None:
+    await db.execute(
+        update(UserCorpusStat)
+        .where(UserCorpusStat.user_id == user_id)
+        .values(doc_count=func.greatest(UserCorpusStat.doc_count - 1, 0), version=UserCorpusStat.version + 1)
+    )
+    await db.execute(
+        update(UserTermDF)
+        .where(UserTermDF.user_id == user_id, UserTermDF.word == any_(_array(words)))
+        .values(doc_count=UserTermDF.doc_count - 1)
+    )
+    await db.execute(
+        delete(UserTermDF).where(UserTermDF.user_id == user_id, UserTermDF.doc_count <= 0)
+    )
+
+# Полная замена индекса пользователя (используется для первичного построения)
+async def replace_user_term_index(db: AsyncSession, user_id: int, total_docs: int, doc_counts: Mapping[str, int]) -> None:
+    await db.execute(delete(UserTermDF).where(UserTermDF.user_id == user_id))
+    counter = pg_insert(UserCorpusStat).values(user_id=user_id, doc_count=total_docs)
+    await db.execute(
+        counter.on_conflict_do_update(
+            index_elements=[UserCorpusStat.user_id],
+            set_={"doc_count": counter.excluded.doc_count, "version": UserCorpusStat.version + 1}
+        )
+    )
+    if doc_counts:
+        await db.execute(
+            pg_insert(UserTermDF).from_select(
+                ["user_id", "word", "doc_count"],
+                select(
+                    literal(user_id, Integer),
+                    func.unnest(_array(doc_counts.keys())),
+                    func.unnest(_array(doc_counts.values(), Integer))
+                )
+            )
+        )
+
+# Удаление индекса пользователя (при удалении аккаунта)
+async def drop_user_term_index(db: AsyncSession, user_id: int) -> None:
+    await db.execute(delete(UserTermDF).where(UserTermDF.user_id == user_id))
+    await db.execute(delete(UserCorpusStat).where(UserCorpusStat.user_id == user_id))
+
+# === ВЕКТОРЫ ДОКУМЕНТОВ ===
+
+def pack_term_vector(word_ids: Mapping[str, int], word_counts: Mapping[str, int]) -> tuple[bytes, bytes]:
+    """Упаковывает вектор документа: отсортированные id слов (uint32) и их количества (float32)."""
+    pairs = sorted((word_ids[word], count) for word, count in word_counts.items())
+    term_ids = array("I", (term_id for term_id, _ in pairs))
+    counts = array("f", (count for _, count in pairs))
+    return term_ids.tobytes(), counts.tobytes()
+
+def unpack_term_vector(vector: DocumentTermVector) -> tuple[memoryview, memoryview]:
+    """Возвращает id слов и количества как memoryview поверх bytea без копирования."""
+    return memoryview(vector.term_ids).cast("I"), memoryview(vector.counts).cast("f")
+
+# Получение id слов, которые уже есть в словаре
+async def get_word_ids(db: AsyncSession, words: Iterable[str]) -> dict[str, int]:
+    result = await db.execute(
+        select(Vocabulary.word, Vocabulary.id).where(Vocabulary.word == any_(_array(words)))
+    )
+    return {row.word: row.id for row in result}
+
+# Получение id слов словаря, недостающие слова добавляются
+async def get_or_create_word_ids(db: AsyncSession, words: Iterable[str]) -> dict[str, int]:
+    words = list(words)
+    word_ids = await get_word_ids(db, words)
+
+    missing = [word for word in words if word not in word_ids]
+    if missing:
+        result = await db.execute(
+            pg_insert(Vocabulary)
+            .from_select(["word"], select(func.unnest(_array(missing))))
+            .on_conflict_do_nothing(index_elements=[Vocabulary.word])
+            .returning(Vocabulary.word, Vocabulary.id)
+        )
+        word_ids.update({row.word: row.id for row in result})
+
+        # Слова, добавленные параллельной загрузкой, не возвращаются из ON CONFLICT DO NOTHING
+        if len(word_ids) < len(words):
+            result = await db.execute(
+                select(Vocabulary.word, Vocabulary.id)
+                .where(Vocabulary.word == any_(_array(w for w in missing if w not in word_ids)))
+            )
+            word_ids.update({row.word: row.id for row in result})
+    return word_ids
+
+# Получение слов по их id
+async def get_words_by_ids(db: AsyncSession, term_ids: Iterable[int]) -> dict[int, str]:
+    result = await db.execute(
+        select(Vocabulary.id, Vocabulary.word).where(Vocabulary.id == any_(_array(term_ids, Integer)))
+    )
+    return {row.id: row.word for row in result}
+
+# Сохранение полного вектора документа
+async def save_term_vector(db: AsyncSession, file_id: int, word_counts: Mapping[str, int]) -> DocumentTermVector:
+    word_ids = await get_or_create_word_ids(db, word_counts.keys())
+    term_ids, counts = pack_term_vector(word_ids, word_counts)
+    vector = DocumentTermVector(
+        file_id=file_id,
+        total_words=sum(word_counts.values()),
+        term_ids=term_ids,
+        counts=counts
+    )
+    db.add(vector)
+    return vector
+
+# Сохранение векторов пачки документов одним многострочным INSERT
+async def save_term_vectors(db: AsyncSession, documents: Mapping[int, Mapping[str, int]]) -> list[DocumentTermVector]:
+    vocabulary = set()
+    for word_counts in documents.values():
+        vocabulary.update(word_counts)
+    word_ids = await get_or_create_word_ids(db, vocabulary)
+
+    rows = []
+    for file_id, word_counts in documents.items():
+        term_ids, counts = pack_term_vector(word_ids, word_counts)
+        rows.append({
+            "file_id": file_id,
+            "total_words": sum(word_counts.values()),
+            "term_ids": term_ids,
+            "counts": counts
+        })
+    await db.execute(insert(DocumentTermVector), rows)
+    return [DocumentTermVector(**row) for row in rows]
+
+# Получение векторов для списка документов
+async def get_term_vectors(db: AsyncSession, file_ids: Iterable[int]) -> list[DocumentTermVector]:
+    result = await db.execute(
+        select(DocumentTermVector).where(DocumentTermVector.file_id == any_(_array(file_ids, Integer)))
+    )
+    return result.scalars().all()
+
+# Потоковое чтение векторов всех документов пользователя по возрастанию id документа
+async def stream_user_term_vectors(db: AsyncSession, user_id: int):
+    return await db.stream(
+        select(DocumentTermVector.file_id, DocumentTermVector.total_words, DocumentTermVector.term_ids, DocumentTermVector.counts)
+        .join(FileUpload, FileUpload.id == DocumentTermVector.file_id)
+        .where(FileUpload.user_id == user_id)
+        .order_by(DocumentTermVector.file_id)
+    )
+
+# Документы пользователя без сохранённого вектора (загружены до появления векторов)
+async def get_files_without_vectors(db: AsyncSession, user_id: int) -> list[FileUpload]:
+    result = await db.execute(
+        select(FileUpload).where(
+            FileUpload.user_id == user_id,
+            ~exists().where(DocumentTermVector.file_id == FileUpload.id)
+        )
+    )
+    return result.scalars().all()
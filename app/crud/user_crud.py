@@ -1,6 +1,8 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func
 from app.models.user import User
+from app.auth.user_cache import user_cache
+from app.crud import term_index_crud
 from passlib.context import CryptContext
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -29,8 +31,10 @@ async def delete_user(db: AsyncSession, user_id: int) -> bool:
     user = await get_user_by_id(db, user_id)
     if not user:
         return False
+    await term_index_crud.drop_user_term_index(db, user_id)
     await db.delete(user)
     await db.commit()
+    user_cache.invalidate(user_id)
     return True
 
 # Обновление пароля
@@ -40,6 +44,7 @@ async def update_password(db: AsyncSession, user_id: int, new_password: str) ->
         return False
     user.hashed_password = pwd_context.hash(new_password)
     await db.commit()
+    user_cache.invalidate(user_id)
     return True
 
 # Подсчёт пользователей
@@ -0,0 +1,142 @@
+"""
+Определение кодировки загружаемого файла по выборке байтов.
+
+Файл не декодируется целиком в нескольких кодировках по очереди: кодировка выбирается один раз
+по нескольким блокам (начало, середина, конец — всего не больше ENCODING_SAMPLE_SIZE байт),
+после чего файл один раз читается инкрементальным декодером этой кодировки.
+
+Порядок проверок:
+1. BOM (UTF-8, UTF-16, UTF-32);
+2. только ASCII или корректный UTF-8 во всех блоках — utf-8;
+3. иначе однобайтовая кодировка. Выборка не декодируется, считаются байты: в русском тексте
+   байты старше 0x7F идут подряд (слова целиком из кириллицы), а в западноевропейском — поодиночке,
+   внутри латинских слов («café»). Для русского текста из кириллических кодировок (windows-1251,
+   koi8-r, cp866) выбирается та, где больше всего байтов означают самые частые буквы русского
+   языка; иначе — cp1252.
+"""
+import codecs
+import os
+from dataclasses import dataclass
+from typing import Sequence
+
+# === Константы конфигурации ===
+ENCODING_SAMPLE_SIZE = int(os.getenv("ENCODING_SAMPLE_SIZE", str(64 * 1024)))
+ENCODING_SAMPLE_BLOCKS = 4
+
+CYRILLIC_ENCODINGS = ("windows-1251", "koi8-r", "cp866")
+LATIN_ENCODING = "cp1252"
+
+# Сигнатура должна проверяться до более короткой, с которой она начинается (UTF-32 LE и UTF-16 LE)
+BOMS = (
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
+# Около 80% букв русского текста; при неверной кодировке их доля заметно ниже
+FREQUENT_CYRILLIC = "оеаинтсрвлкмдпу"
+# Средняя длина серии байтов старше 0x7F, начиная с которой текст считается кириллическим
+CYRILLIC_MIN_RUN = 2.0
+
+ASCII_BYTES = bytes(range(0x80))
+# Таблица для bytes.translate: 0 — байт ASCII, 1 — байт старше 0x7F
+HIGH_BYTE_MARKS = bytes(0x80) + bytes([1]) * 0x80
+
+
+def _not_frequent_bytes(encoding: str) -> bytes:
+    """
+    Байты, которые в кодировке НЕ означают самые частые русские буквы (в любом регистре):
+    их удаление через bytes.translate оставляет только байты частых букв.
+    """
+    frequent = bytearray()
+    for byte in range(0x80, 0x100):
+        char = bytes([byte]).decode(encoding, errors="ignore").casefold()
+        # Неопределённый в кодировке байт декодируется в пустую строку
+        if char and char in FREQUENT_CYRILLIC:
+            frequent.append(byte)
+    return bytes(byte for byte in range(256) if byte not in frequent)
+
+
+NOT_FREQUENT_BYTES = {encoding: _not_frequent_bytes(encoding) for encoding in CYRILLIC_ENCODINGS}
+
+
+@dataclass(frozen=True)
+class Detection:
+    """Выбранная кодировка (имя кодека Python) и признак, по которому она выбрана."""
+    encoding: str
+    reason: str
+
+
+def sample_offsets(size: int, sample_size: int = ENCODING_SAMPLE_SIZE, blocks: int = ENCODING_SAMPLE_BLOCKS) -> list[tuple[int, int]]:
+    """
+    Смещения и длины блоков выборки, равномерно от начала до конца файла размером size:
+    первый блок начинается в начале файла, последний заканчивается в его конце.
+    """
+    if size <= sample_size:
+        return [(0, size)]
+    block = sample_size // blocks
+    return [((size - block) * i // (blocks - 1), block) for i in range(blocks)]
+
+
+def sample_bytes(data: bytes) -> list[bytes]:
+    """Выборка блоков из данных, целиком находящихся в памяти."""
+    view = memoryview(data)
+    return [bytes(view[offset:offset + length]) for offset, length in sample_offsets(len(data))]
+
+
+def _valid_utf8(block: bytes, first: bool, last: bool) -> bool:
+    if not first:
+        # Блок из середины файла может начинаться с продолжения многобайтового символа
+        start = 0
+        while start < 3 and start < len(block) and 0x80 <= block[start] <= 0xBF:
+            start += 1
+        block = block[start:]
+    try:
+        # Символ, обрезанный концом блока, ошибкой не считается, если блок не в конце файла
+        codecs.getincrementaldecoder("utf-8")().decode(block, final=last)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def high_byte_run(sample: bytes) -> float:
+    """Средняя длина серии подряд идущих байтов старше 0x7F."""
+    marks = sample.translate(HIGH_BYTE_MARKS)
+    high = marks.count(1)
+    runs = marks.count(b"\x00\x01") + marks.startswith(b"\x01")
+    return high / runs if runs else 0.0
+
+
+def cyrillic_score(sample: bytes, encoding: str) -> float:
+    """Доля байтов старше 0x7F, которые в кодировке encoding означают самые частые русские буквы."""
+    high = len(sample.translate(None, ASCII_BYTES))
+    if not high:
+        return 0.0
+    return len(sample.translate(None, NOT_FREQUENT_BYTES[encoding])) / high
+
+
+def detect_encoding(blocks: Sequence[bytes]) -> Detection:
+    """Кодировка по блокам выборки; первый блок — начало файла, последний — его конец."""
+    head = blocks[0] if blocks else b""
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return Detection(encoding, "bom")
+
+    if all(block.isascii() for block in blocks):
+        return Detection("utf-8", "ascii")
+    last = len(blocks) - 1
+    if all(_valid_utf8(block, i == 0, i == last) for i, block in enumerate(blocks)):
+        return Detection("utf-8", "utf-8")
+
+    sample = b"\n".join(blocks)
+    if high_byte_run(sample) < CYRILLIC_MIN_RUN:
+        return Detection(LATIN_ENCODING, "latin")
+    best = max(CYRILLIC_ENCODINGS, key=lambda encoding: cyrillic_score(sample, encoding))
+    return Detection(best, "cyrillic")
+
+
+def detect_bytes_encoding(data: bytes) -> Detection:
+    """Кодировка данных, целиком находящихся в памяти."""
+    return detect_encoding(sample_bytes(data))
@@ -0,0 +1,62 @@
+"""
+Пересчёт сохранённых IDF в статистике документов (word_stat.idf).
+
+IDF записывается в word_stat при загрузке документа и устаревает с каждой следующей загрузкой
+или удалением. Пересчёт приводит сохранённые значения к текущему корпусу по той же формуле,
+что и статистика на лету: log10(N / (1 + n_i)), где N — документы пользователя,
+n_i — документы пользователя, содержащие слово.
+
+IDF считается один раз на слово словаря пользователя, векторно в NumPy, по индексу документной
+частоты (user_term_df), а в word_stat записывается пакетами UPDATE ... FROM unnest(...):
+все строки со словом обновляются одним соединением по индексу (user_id, word).
+
+Пересчёт инкрементальный: пользователь пропускается, если версия его корпуса не менялась
+с прошлого пересчёта (user_corpus_stat.idf_version).
+
+    python -m app.idf                  # пересчитать для всех пользователей с изменившимся корпусом
+    python -m app.idf --user-id 1
+    python -m app.idf --force          # пересчитать всё, даже если корпус не менялся
+"""
+import argparse
+import asyncio
+import os
+
+import numpy as np
+
+# === Константы конфигурации ===
+# Слов в одном UPDATE ... FROM unnest
+IDF_UPDATE_BATCH = int(os.getenv("IDF_UPDATE_BATCH", "50000"))
+
+
+def compute_idf(total_docs: int, doc_counts: np.ndarray) -> np.ndarray:
+    """IDF всех слов одним векторным вычислением: log10(N / (1 + n_i)); для пустого корпуса — нули."""
+    if total_docs <= 0:
+        return np.zeros(len(doc_counts), dtype=np.float64)
+    return np.log10(total_docs / (1.0 + doc_counts.astype(np.float64)))
+
+
+async def main(user_id: int | None, force: bool) -> None:
+    from app.database import async_session, engine
+    from app.crud import term_index_crud
+    from app.services import recompute_user_idf
+
+    async with async_session() as db:
+        user_ids = [stat.user_id for stat in await term_index_crud.get_stale_idf_users(db, user_id, force)]
+    total_rows = 0
+    for current in user_ids:
+        # Отдельная транзакция на пользователя: обновлённые строки не держатся заблокированными долго
+        async with async_session() as db:
+            rows = await recompute_user_idf(db, current, force)
+            await db.commit()
+        total_rows += rows
+        print(f"Пользователь {current}: обновлено строк {rows}")
+    print(f"✅ Пользователей: {len(user_ids)}, обновлено строк: {total_rows}")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user-id", type=int, help="только для одного пользователя")
+    parser.add_argument("--force", action="store_true", help="пересчитать, даже если корпус не менялся")
+    args = parser.parse_args()
+    asyncio.run(main(args.user_id, args.force))
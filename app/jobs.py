@@ -0,0 +1,207 @@
+"""
+Фоновая обработка загруженных файлов и перестроение поисковых индексов.
+
+Воркер забирает задачи из таблицы upload_jobs и запросы на перестроение индекса
+из search_rebuild_requests через SELECT ... FOR UPDATE SKIP LOCKED,
+поэтому можно запускать его как внутри приложения (JOBS_INPROCESS=1),
+так и отдельными процессами:
+
+    python -m app.jobs
+"""
+import asyncio
+import io
+import logging
+import os
+import uuid
+from datetime import timedelta
+from typing import BinaryIO, Optional
+
+from fastapi import HTTPException, UploadFile
+from sqlalchemy.orm import undefer
+
+from app import metrics, tracing
+from app.analysis_pool import analysis_pool, AnalysisUnavailable
+from app.crud import job_crud, search_crud
+from app.database import async_session
+from app.models.job import UploadJob, JOB_DONE, JOB_FAILED
+from app.models.user import User
+from app.services import tokenize_upload, ingest_document, rebuild_search_index
+from app.storage import open_spooled, delete_spooled
+
+logger = logging.getLogger(__name__)
+
+# === Константы конфигурации ===
+JOBS_INPROCESS = os.getenv("JOBS_INPROCESS", "1") == "1"
+# Сколько задач воркер забирает и обрабатывает одновременно (0 — по числу процессов пула анализа)
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "0")) or max(analysis_pool.workers, 1)
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+JOB_STALE_AFTER = timedelta(seconds=int(os.getenv("JOB_STALE_AFTER", "600")))
+# Сколько раз задачу можно забрать, прежде чем она будет завершена с ошибкой
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Как часто выполняющаяся задача отмечает, что воркер жив
+JOB_HEARTBEAT_INTERVAL = JOB_STALE_AFTER.total_seconds() / 3
+
+# Сигнал о новой задаче для воркера, работающего в том же процессе
+job_wakeup = asyncio.Event()
+
+
+class JobLost(Exception):
+    """Задачу перехватил другой воркер: результат этого воркера не сохраняется."""
+
+
+async def process_job(job_id: int, attempt: int, token: str) -> None:
+    """Обрабатывает одну задачу: токенизация, TF/IDF и сохранение документа."""
+    with tracing.trace(f"job {job_id}", job_id=job_id, attempt=attempt):
+        heartbeat = asyncio.create_task(_heartbeat(job_id, token))
+        try:
+            await _process_job(job_id, attempt, token)
+        finally:
+            heartbeat.cancel()
+
+
+async def _heartbeat(job_id: int, token: str) -> None:
+    """Пока задача выполняется, обновляет её updated_at, чтобы другой воркер не счёл её зависшей."""
+    while True:
+        await asyncio.sleep(JOB_HEARTBEAT_INTERVAL)
+        try:
+            async with async_session() as db:
+                if not await job_crud.touch_job(db, job_id, token):
+                    return
+        except Exception as e:
+            logger.warning(f"Не удалось обновить задачу {job_id}: {e}")
+
+
+async def _fail_job(job_id: int, token: str, detail: str, payload_ref: Optional[str]) -> None:
+    logger.error(f"Ошибка при обработке задачи {job_id}: {detail}")
+    async with async_session() as db:
+        await job_crud.mark_job_failed(db, job_id, token, detail)
+    metrics.upload_jobs_finished.inc(status=JOB_FAILED)
+    if payload_ref:
+        delete_spooled(payload_ref)
+
+
+def _open_payload(job: UploadJob) -> BinaryIO:
+    """Загруженный файл задачи: с диска или, у задач до появления payload_ref, из самой задачи."""
+    if job.payload_ref:
+        return open_spooled(job.payload_ref)
+    return io.BytesIO(job.payload or b"")
+
+
+async def _process_job(job_id: int, attempt: int, token: str) -> None:
+    with tracing.span("job.load"):
+        async with async_session() as db:
+            job = await db.get(UploadJob, job_id, options=[undefer(UploadJob.payload)])
+            user = await db.get(User, job.user_id) if job else None
+            if not job or not user:
+                return
+            filename, tokenizer, payload_ref = job.filename, job.tokenizer, job.payload_ref
+
+    if attempt > JOB_MAX_ATTEMPTS:
+        # Воркеры падали или пул анализа не справлялся с задачей при каждой попытке
+        await _fail_job(job_id, token, f"Превышено число попыток обработки ({JOB_MAX_ATTEMPTS})", payload_ref)
+        return
+
+    try:
+        # Файл читается с диска порциями, как при потоковой токенизации загрузки
+        source = UploadFile(_open_payload(job), filename=filename)
+        counts, text, stream_stats = await tokenize_upload(source, tokenizer=tokenizer)
+        logger.info(
+            f"Задача {job_id}: файл {filename} прочитан: {stream_stats.bytes_read} байт, "
+            f"{stream_stats.bytes_per_sec / 1024 / 1024:.2f} МБ/с, кодировка {stream_stats.encoding} ({stream_stats.detected_by}), "
+            f"пик RSS {stream_stats.peak_rss_kb} КБ"
+        )
+        async with async_session() as db:
+            await job_crud.set_job_progress(db, job_id, token, 0.5)
+
+            file_upload = await ingest_document(
+                db, user, filename, counts, text, tokenizer, stream_stats.encoding
+            )
+            with tracing.span("job.commit"):
+                # Документ сохраняется, только если задача всё ещё за этим воркером
+                if not await job_crud.mark_job_done(db, job_id, token, file_upload.id):
+                    await db.rollback()
+                    raise JobLost()
+                await db.commit()
+        metrics.upload_jobs_finished.inc(status=JOB_DONE)
+        if payload_ref:
+            delete_spooled(payload_ref)
+    except JobLost:
+        logger.warning(f"Задача {job_id} перехвачена другим воркером, результат отброшен")
+    except AnalysisUnavailable as e:
+        if attempt >= JOB_MAX_ATTEMPTS:
+            await _fail_job(job_id, token, e.detail, payload_ref)
+            return
+        # Пул анализа перегружен — задача вернётся в очередь и будет обработана позже
+        async with async_session() as db:
+            await job_crud.requeue_job(db, job_id, token)
+        await asyncio.sleep(JOB_POLL_INTERVAL)
+    except Exception as e:
+        await _fail_job(job_id, token, e.detail if isinstance(e, HTTPException) else str(e), payload_ref)
+
+
+async def drain_jobs() -> int:
+    """
+    Забирает не больше JOB_CONCURRENCY задач и обрабатывает их одновременно.
+    Возвращает количество обработанных задач.
+    """
+    token = uuid.uuid4().hex
+    async with async_session() as db:
+        jobs = await job_crud.claim_upload_jobs(db, JOB_CONCURRENCY, JOB_STALE_AFTER, token)
+    # Ошибка одной задачи не прерывает остальные: следующая пачка берётся, только когда закончены все
+    results = await asyncio.gather(
+        *(process_job(job_id, attempt, token) for job_id, attempt in jobs), return_exceptions=True
+    )
+    for (job_id, _), result in zip(jobs, results):
+        if isinstance(result, Exception):
+            logger.error(f"Ошибка воркера при обработке задачи {job_id}: {result}")
+    return len(jobs)
+
+
+async def rebuild_requested_index() -> bool:
+    """
+    Перестраивает поисковый индекс по одному запросу. Запрос удаляется в той же транзакции,
+    что и замена индекса. Возвращает False, если запросов нет.
+    """
+    async with async_session() as db:
+        user_id = await search_crud.claim_rebuild_request(db)
+        if user_id is None:
+            await db.rollback()
+            return False
+        with tracing.trace(f"search rebuild {user_id}", user_id=user_id):
+            stat = await rebuild_search_index(db, user_id)
+        await db.commit()
+    logger.info(f"Поисковый индекс пользователя {user_id} перестроен: документов {stat.doc_count}")
+    return True
+
+
+async def run_worker() -> None:
+    """
+    Бесконечный цикл воркера: обрабатывает задачи, пока они есть, затем перестраивает
+    запрошенные поисковые индексы и ждёт новых задач.
+    """
+    logger.info("Воркер обработки загрузок запущен")
+    while True:
+        try:
+            if await drain_jobs() or await rebuild_requested_index():
+                continue
+        except Exception as e:
+            logger.exception(f"Ошибка воркера обработки загрузок: {e}")
+
+        job_wakeup.clear()
+        try:
+            await asyncio.wait_for(job_wakeup.wait(), JOB_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def main() -> None:
+    analysis_pool.start()
+    try:
+        await run_worker()
+    finally:
+        analysis_pool.shutdown()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    asyncio.run(main())
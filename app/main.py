@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import os
 from datetime import datetime, timedelta
@@ -5,22 +6,30 @@ from contextlib import asynccontextmanager
 from http import HTTPStatus
 from urllib.parse import unquote
 
-from fastapi import FastAPI, Request, UploadFile, File, Depends
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+from fastapi import FastAPI, Request, UploadFile, File, Form, Depends
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database import async_session, engine, Base, get_db
+from app import metrics, tracing
+from app.analysis_pool import analysis_pool
+from app.database import engine, Base, get_db
+from app.migrations import run_migrations
 from app.auth.dependencies import get_current_user, get_current_user_optional
 from app.models.user import User
 from app.models.document import FileUpload, WordStat
+from app.models.job import JOB_DONE, JOB_FAILED
 from app.routes.html_routes import router as html_router
 from app.routes.api_routes import router as api_router
-from app.services import get_text, term_frequency, inverse_document_frequency
+from app.jobs import run_worker, job_wakeup, JOBS_INPROCESS
 from app.schemas import StatusResponse, VersionResponse
 from app.crud.document_crud import get_user_files
-from app.crud.collection_crud import add_file_to_default_collection
+from app.crud import job_crud
+from app.stats_cache import collection_stats_cache, posting_block_cache
+from app.similarity import similarity_cache
+from app.tokenizers import TOKENIZERS, TOKENIZER_DEFAULT, TokenizerName
+from app.storage import spool_upload, delete_spooled
 
 # Версия приложения
 VERSION = "0.0.3"
@@ -35,10 +44,16 @@ async def lifespan(app: FastAPI):
     try:
         async with engine.begin() as conn:
             await conn.run_sync(Base.metadata.create_all)
+        await run_migrations(engine)
         logger.info("✅ База данных инициализирована.")
     except Exception as e:
         logger.exception(f"❌ Ошибка инициализации БД: {e}")
+    analysis_pool.start()
+    worker = asyncio.create_task(run_worker()) if JOBS_INPROCESS else None
     yield
+    if worker:
+        worker.cancel()
+    analysis_pool.shutdown()
 
 # Конфигурация FastAPI-приложения
 app = FastAPI(
@@ -51,6 +66,53 @@ app = FastAPI(
     openapi_url="/openapi.json"
 )
 
+# Метрики запросов: количество, длительность по маршрутам и число запросов в обработке
+app.add_middleware(metrics.MetricsMiddleware)
+if tracing.TRACING_ENABLED:
+    app.add_middleware(tracing.TracingMiddleware)
+
+# Метрики состояния пулов и кэшей вычисляются при опросе /metrics
+db_pool = engine.sync_engine.pool
+metrics.register_callback(
+    "db_pool_connections", "Соединения пула БД по состоянию",
+    lambda: {"in_use": db_pool.checkedout(), "idle": db_pool.checkedin(), "overflow": max(db_pool.overflow(), 0)},
+    labels=("state",)
+)
+metrics.register_callback(
+    "db_pool_checkouts_total", "Сколько раз соединение выдавалось из пула", lambda: db_pool.checkouts, type="counter"
+)
+metrics.register_callback(
+    "db_pool_wait_seconds_total", "Суммарное время ожидания соединения из пула", lambda: db_pool.wait_total, type="counter"
+)
+metrics.register_callback(
+    "db_pool_timeouts_total", "Сколько раз соединение не удалось получить за DB_POOL_TIMEOUT", lambda: db_pool.timeouts, type="counter"
+)
+metrics.register_callback(
+    "analysis_pool_in_flight", "Задачи в пуле анализа (выполняются и ждут в очереди)", lambda: analysis_pool.in_flight
+)
+metrics.register_callback(
+    "analysis_pool_capacity", "Предельное число задач в пуле анализа", lambda: analysis_pool.capacity
+)
+metrics.register_callback(
+    "collection_stats_cache_requests_total", "Обращения к кэшу статистики коллекций",
+    lambda: {"hit": collection_stats_cache.hits, "miss": collection_stats_cache.misses},
+    labels=("result",), type="counter"
+)
+metrics.register_callback(
+    "search_block_cache_requests_total", "Обращения к кэшу блоков поискового индекса",
+    lambda: {"hit": posting_block_cache.hits, "miss": posting_block_cache.misses},
+    labels=("result",), type="counter"
+)
+metrics.register_callback(
+    "similarity_cache_requests_total", "Обращения к кэшу матриц похожих документов",
+    lambda: {"hit": similarity_cache.hits, "miss": similarity_cache.misses},
+    labels=("result",), type="counter"
+)
+metrics.register_callback(
+    "similarity_cache_nonzero_entries", "Ненулевых элементов в закэшированных матрицах похожих документов",
+    lambda: similarity_cache.nnz
+)
+
 # Регистрация маршрутов
 app.include_router(html_router, prefix="/auth", include_in_schema=False)
 app.include_router(api_router, prefix="/api")
@@ -81,7 +143,13 @@ async def get_root(request: Request, current_user: User | None = Depends(get_cur
     response = templates.TemplateResponse(
         request=request,
         name="index.html",
-        context={"request": request, "current_user": current_user, "msg": msg}
+        context={
+            "request": request,
+            "current_user": current_user,
+            "msg": msg,
+            "tokenizers": TOKENIZERS.values(),
+            "default_tokenizer": TOKENIZER_DEFAULT
+        }
     )
     response.delete_cookie("msg")
     return response
@@ -90,74 +158,73 @@ async def get_root(request: Request, current_user: User | None = Depends(get_cur
 @app.post("/uploadfile", response_class=RedirectResponse, include_in_schema=False)
 async def handle_upload(
     file: UploadFile = File(...),
+    tokenizer: TokenizerName = Form(TOKENIZER_DEFAULT),
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
     """
-    Загрузка и обработка документа: TF/IDF, сохранение в БД и добавление в коллекцию.
+    Загрузка документа: файл ставится в очередь на обработку (TF/IDF, сохранение в БД
+    и добавление в коллекцию), пользователь перенаправляется на страницу результата задачи.
     """
     if not current_user:
         return RedirectResponse("/auth/login", status_code=HTTPStatus.SEE_OTHER)
 
-    try:
-        text = await get_text(file)
-        tf = term_frequency(text)
-
-        file_upload = FileUpload(
-            user_id=current_user.id,
-            filename=file.filename,
-            content=text,
-            unique_words=len(tf)
-        )
-        db.add(file_upload)
-        await db.flush()  # получить ID
-
-        words_all = list(tf.keys())
-        idf_map = await inverse_document_frequency(db, current_user, words_all)
-
-        sorted_words = sorted(words_all, key=lambda word: (idf_map.get(word, 0.0), tf[word]))
-        selected_words = sorted_words[:50]
-
-        word_stat = [
-            WordStat(
-                file_id=file_upload.id,
-                user_id=current_user.id,
-                word=word,
-                tf=tf[word],
-                idf=idf_map.get(word, 0.0)
-            )
-            for word in selected_words
-        ]
-        db.add_all(word_stat)
-
-        await add_file_to_default_collection(db, file_upload, current_user)
+    # Файл копируется на диск порциями, в задаче остаётся только ссылка на него
+    with tracing.span("upload.spool"):
+        try:
+            payload_ref, size = await spool_upload(file.file)
+        finally:
+            await file.close()
+    metrics.upload_bytes.inc(size)
 
-        await db.commit()
-    except Exception as e:
-        await db.rollback()
-        logger.error(f"Ошибка при загрузке файла: {e}")
-        return RedirectResponse("/?msg=Upload+failed", status_code=HTTPStatus.SEE_OTHER)
+    # Анализ выполняется воркером, пользователь сразу получает номер задачи
+    with tracing.span("upload.enqueue", bytes=size):
+        try:
+            job = await job_crud.create_upload_job(db, current_user.id, file.filename, payload_ref, tokenizer)
+        except Exception:
+            delete_spooled(payload_ref)
+            raise
+    job_wakeup.set()
 
-    return RedirectResponse(url="/output", status_code=HTTPStatus.SEE_OTHER)
+    return RedirectResponse(url=f"/output?job_id={job.id}", status_code=HTTPStatus.SEE_OTHER)
 
 
 @app.get("/output", response_class=HTMLResponse, include_in_schema=False)
-async def get_output(request: Request, current_user: User = Depends(get_current_user)):
+async def get_output(
+    request: Request,
+    job_id: int | None = None,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
     """
     HTML-страница с 50 редкими словами (TF и IDF).
+    Если передан job_id, показывает слова документа этой задачи, а для незавершённой — прогресс обработки.
     """
     if not current_user:
         return RedirectResponse("/auth/login", status_code=HTTPStatus.SEE_OTHER)
 
-    async with async_session() as session:
-        result = await session.execute(
-            WordStat.__table__.select()
-            .join(FileUpload, WordStat.file_id == FileUpload.id)
-            .where(FileUpload.user_id == current_user.id)
-            .order_by(WordStat.id.desc())
-            .limit(50)
-        )
-        word_stat = result.fetchall()
+    job = None
+    if job_id is not None:
+        job = await job_crud.get_user_job(db, job_id, current_user.id)
+        if job and job.status == JOB_FAILED:
+            return RedirectResponse("/?msg=Upload+failed", status_code=HTTPStatus.SEE_OTHER)
+        if job and job.status != JOB_DONE:
+            return templates.TemplateResponse(
+                request=request,
+                name="output.html",
+                context={"job": job, "current_user": current_user}
+            )
+
+    query = (
+        WordStat.__table__.select()
+        .join(FileUpload, WordStat.file_id == FileUpload.id)
+        .where(FileUpload.user_id == current_user.id)
+    )
+    # Задачи завершаются в любом порядке — показываем слова документа именно этой задачи
+    if job is not None:
+        query = query.where(WordStat.file_id == job.document_id)
+    result = await db.execute(query.order_by(WordStat.id.desc()).limit(50))
+    word_stat = result.fetchall()
 
     tf = {row.word: row.tf for row in word_stat}
     words = [(row.word, row.idf) for row in word_stat]
@@ -170,15 +237,18 @@ async def get_output(request: Request, current_user: User = Depends(get_current_
 
 
 @app.get("/myfiles", response_class=HTMLResponse, include_in_schema=False)
-async def list_user_files(request: Request, current_user: User = Depends(get_current_user)):
+async def list_user_files(
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
     """
     HTML-страница со списком файлов пользователя.
     """
     if not current_user:
         return RedirectResponse("/auth/login", status_code=HTTPStatus.SEE_OTHER)
 
-    async with async_session() as session:
-        files = await get_user_files(session, current_user.id)
+    files = await get_user_files(db, current_user.id)
 
     return templates.TemplateResponse(
         request=request,
@@ -187,6 +257,12 @@ async def list_user_files(request: Request, current_user: User = Depends(get_cur
     )
 
 
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def prometheus_metrics():
+    """Метрики в текстовом формате Prometheus. Не обращается к БД."""
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
 @app.get("/version", response_model=VersionResponse, include_in_schema=False)
 async def version():
     return {"version": VERSION}
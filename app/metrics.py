@@ -0,0 +1,282 @@
+"""
+Метрики приложения в текстовом формате Prometheus.
+
+Значения хранятся в памяти процесса и не требуют обращений к БД, поэтому /metrics
+можно опрашивать часто. При запуске нескольких процессов uvicorn каждый отдаёт свои
+значения, суммирование выполняет Prometheus.
+"""
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Iterable
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Границы корзин гистограмм по умолчанию, секунды
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(ABC):
+    """Базовый класс метрики: имя, описание, тип и имена меток. Подкласс реализует samples."""
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+
+    def _key(self, labels: dict) -> tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    @abstractmethod
+    def samples(self) -> Iterable[str]:
+        """Строки значений метрики в формате Prometheus."""
+
+    def render(self) -> str:
+        header = f"# HELP {self.name} {self.documentation}\n# TYPE {self.name} {self.type}\n"
+        return header + "".join(f"{line}\n" for line in self.samples())
+
+
+class Counter(Metric):
+    """Монотонно растущий счётчик."""
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: dict[tuple[str, ...], float] = {}
+        # Метрика без меток выводится сразу, даже до первого изменения
+        if not self.label_names:
+            self._values[()] = 0
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> Iterable[str]:
+        for key, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+
+
+class Gauge(Counter):
+    """Значение, которое может расти и уменьшаться."""
+    type = "gauge"
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+
+class CallbackMetric(Metric):
+    """
+    Значение, которое вычисляется при каждом опросе /metrics (gauge или counter).
+    callback возвращает число или словарь {значения меток: число}.
+    """
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable,
+        labels: Iterable[str] = (),
+        type: str = "gauge"
+    ):
+        super().__init__(name, documentation, labels)
+        self.callback = callback
+        self.type = type
+
+    def samples(self) -> Iterable[str]:
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in values.items():
+            key = key if isinstance(key, tuple) else (key,)
+            yield f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+
+
+class Histogram(Metric):
+    """Гистограмма распределения значений (обычно длительностей) по корзинам."""
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Iterable[str] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Для каждого набора меток: количество попаданий в каждую корзину, сумма и число наблюдений
+        self._values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+        if not self.label_names:
+            self._entry(())
+
+    def _entry(self, key: tuple[str, ...]) -> tuple[list[int], list[float]]:
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = ([0] * (len(self.buckets) + 1), [0.0, 0])
+        return entry
+
+    def observe(self, value: float, **labels) -> None:
+        counts, total = self._entry(self._key(labels))
+        counts[bisect_left(self.buckets, value)] += 1
+        total[0] += value
+        total[1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Замеряет длительность блока with."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> Iterable[str]:
+        for key, (counts, (total, count)) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(float(bound))}"'
+                yield f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.label_names, key)} {count}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "".join(metric.render() for metric in self._metrics)
+
+
+registry = Registry()
+
+# === HTTP ===
+http_requests = registry.register(Counter(
+    "http_requests_total", "Количество обработанных HTTP-запросов", ("method", "route", "status")
+))
+http_request_duration = registry.register(Histogram(
+    "http_request_duration_seconds", "Длительность обработки HTTP-запроса", ("method", "route")
+))
+http_requests_in_flight = registry.register(Gauge(
+    "http_requests_in_flight", "Количество запросов, обрабатываемых в данный момент"
+))
+
+# === Обработка документов ===
+upload_bytes = registry.register(Counter(
+    "upload_bytes_total", "Объём загруженных файлов, байт"
+))
+tokenize_duration = registry.register(Histogram(
+    "tokenize_duration_seconds", "Время чтения и токенизации одного файла"
+))
+idf_query_duration = registry.register(Histogram(
+    "idf_query_duration_seconds", "Время запроса IDF к индексу документной частоты"
+))
+idf_recompute_duration = registry.register(Histogram(
+    "idf_recompute_duration_seconds", "Время пересчёта сохранённых IDF статистики пользователя"
+))
+huffman_encode_duration = registry.register(Histogram(
+    "huffman_encode_duration_seconds", "Время построения кода Хаффмана документа (без кэша)"
+))
+search_query_duration = registry.register(Histogram(
+    "search_query_duration_seconds", "Время полнотекстового поиска по документам пользователя"
+))
+similarity_query_duration = registry.register(Histogram(
+    "similarity_query_duration_seconds", "Время поиска похожих документов"
+))
+
+# === Бизнес-счётчики (с момента запуска процесса) ===
+documents_created = registry.register(Counter(
+    "documents_created_total", "Количество сохранённых документов"
+))
+documents_deleted = registry.register(Counter(
+    "documents_deleted_total", "Количество удалённых документов"
+))
+collections_created = registry.register(Counter(
+    "collections_created_total", "Количество созданных коллекций"
+))
+upload_jobs_finished = registry.register(Counter(
+    "upload_jobs_finished_total", "Количество завершённых задач обработки загрузок", ("status",)
+))
+
+
+def register_callback(
+    name: str,
+    documentation: str,
+    callback: Callable,
+    labels: Iterable[str] = (),
+    type: str = "gauge"
+) -> None:
+    """Регистрирует метрику, значение которой вычисляется при опросе (состояние пулов, кэшей)."""
+    registry.register(CallbackMetric(name, documentation, callback, labels, type))
+
+
+def render() -> str:
+    return registry.render()
+
+
+class MetricsMiddleware:
+    """
+    ASGI-middleware: количество и длительность запросов по шаблону маршрута
+    (например, /api/documents/{document_id}), а не по фактическому пути,
+    чтобы число рядов метрик не зависело от id в URL.
+    """
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            http_requests_in_flight.dec()
+            # Маршрут известен только после того, как роутер нашёл обработчик
+            route = scope.get("route")
+            route = getattr(route, "path", None) or ("/static" if scope["path"].startswith("/static/") else "unmatched")
+            method = scope["method"]
+            http_requests.inc(method=method, route=route, status=status_code)
+            http_request_duration.observe(elapsed, method=method, route=route)
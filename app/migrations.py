@@ -0,0 +1,275 @@
+"""
+Версионные миграции схемы БД.
+
+create_all создаёт только отсутствующие таблицы и не меняет существующие,
+поэтому новые колонки и индексы для уже развёрнутых баз добавляются здесь.
+Применённые версии хранятся в таблице schema_migrations.
+
+Индексы строятся через CREATE INDEX CONCURRENTLY, чтобы не блокировать запись
+в большие таблицы, поэтому миграции выполняются вне транзакции (AUTOCOMMIT)
+и должны быть идемпотентными.
+
+    python -m app.migrations
+"""
+import asyncio
+import logging
+from dataclasses import dataclass
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+logger = logging.getLogger(__name__)
+
+# Ключ advisory-блокировки: миграции выполняет только один процесс одновременно
+MIGRATIONS_LOCK_KEY = 72_190_013
+
+
+@dataclass(frozen=True)
+class IndexSpec:
+    """Описание индекса: имя, таблица, колонки и уникальность."""
+    name: str
+    table: str
+    columns: tuple[str, ...]
+    unique: bool = False
+
+    def create_sql(self) -> str:
+        unique = "UNIQUE " if self.unique else ""
+        columns = ", ".join(self.columns)
+        return f"CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {self.name} ON {self.table} ({columns})"
+
+
+@dataclass(frozen=True)
+class Migration:
+    """
+    Одна миграция:
+    - statements: обычные SQL-выражения, выполняются по порядку до построения индексов
+    - indexes: индексы, которые строятся конкурентно
+    """
+    version: int
+    description: str
+    statements: tuple[str, ...] = ()
+    indexes: tuple[IndexSpec, ...] = ()
+
+
+# Таблицы, число строк которых поддерживается в table_row_counts
+ROW_COUNT_TABLES = ("fileuploads", "collections")
+ROW_COUNT_SHARDS = 16
+
+
+def _row_count_triggers(table: str) -> str:
+    """
+    Триггеры счётчика строк и начальное значение одним выражением (одной транзакцией):
+    SHARE-блокировка не даёт вставкам попасть между подсчётом и созданием триггеров.
+    """
+    return f"""
+    DO $$
+    BEGIN
+        LOCK TABLE {table} IN SHARE MODE;
+        DROP TRIGGER IF EXISTS {table}_count_insert ON {table};
+        DROP TRIGGER IF EXISTS {table}_count_delete ON {table};
+        CREATE TRIGGER {table}_count_insert AFTER INSERT ON {table}
+            REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION track_row_count();
+        CREATE TRIGGER {table}_count_delete AFTER DELETE ON {table}
+            REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION track_row_count();
+        DELETE FROM table_row_counts WHERE table_name = '{table}';
+        INSERT INTO table_row_counts (table_name, shard, row_count) SELECT '{table}', 0, count(*) FROM {table};
+    END
+    $$
+    """
+
+
+MIGRATIONS: tuple[Migration, ...] = (
+    Migration(
+        version=1,
+        description="user_corpus_stat.version для проверки актуальности кэша статистики",
+        statements=(
+            "ALTER TABLE user_corpus_stat ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0",
+        ),
+    ),
+    Migration(
+        version=2,
+        description="Индексы для IDF, статистики коллекций, коллекции по умолчанию и /output",
+        statements=(
+            # Повторные связи документа с коллекцией не дали бы построить уникальный индекс
+            """
+            DELETE FROM collection_documents a
+            USING collection_documents b
+            WHERE a.collection_id = b.collection_id
+              AND a.document_id = b.document_id
+              AND a.id > b.id
+            """,
+        ),
+        indexes=(
+            IndexSpec("ix_word_stat_user_id_word_file_id", "word_stat", ("user_id", "word", "file_id")),
+            IndexSpec("ix_word_stat_file_id", "word_stat", ("file_id",)),
+            IndexSpec("ix_fileuploads_user_id_id", "fileuploads", ("user_id", "id")),
+            IndexSpec(
+                "uq_collection_documents_collection_id_document_id",
+                "collection_documents",
+                ("collection_id", "document_id"),
+                unique=True,
+            ),
+            IndexSpec("ix_collection_documents_document_id", "collection_documents", ("document_id",)),
+            IndexSpec("ix_collections_user_id_name", "collections", ("user_id", "name")),
+        ),
+    ),
+    Migration(
+        version=3,
+        description="fileuploads.content_ref и content_size: тексты документов во внешнем хранилище",
+        statements=(
+            "ALTER TABLE fileuploads ADD COLUMN IF NOT EXISTS content_ref VARCHAR(80)",
+            "ALTER TABLE fileuploads ADD COLUMN IF NOT EXISTS content_size BIGINT",
+            "ALTER TABLE fileuploads ALTER COLUMN content DROP NOT NULL",
+            "UPDATE fileuploads SET content_size = octet_length(content) "
+            "WHERE content_size IS NULL AND content IS NOT NULL",
+        ),
+    ),
+    Migration(
+        version=4,
+        description="user_corpus_stat.idf_version: версия корпуса при последнем пересчёте word_stat.idf",
+        statements=(
+            "ALTER TABLE user_corpus_stat ADD COLUMN IF NOT EXISTS idf_version BIGINT",
+        ),
+    ),
+    Migration(
+        version=5,
+        description="fileuploads.tokenizer и upload_jobs.tokenizer: токенизатор, выбранный при загрузке",
+        statements=(
+            "ALTER TABLE fileuploads ADD COLUMN IF NOT EXISTS tokenizer VARCHAR(32) NOT NULL DEFAULT 'simple'",
+            "ALTER TABLE upload_jobs ADD COLUMN IF NOT EXISTS tokenizer VARCHAR(32) NOT NULL DEFAULT 'simple'",
+        ),
+    ),
+    Migration(
+        version=6,
+        description="fileuploads.encoding: кодировка загруженного файла",
+        statements=(
+            "ALTER TABLE fileuploads ADD COLUMN IF NOT EXISTS encoding VARCHAR(32)",
+        ),
+    ),
+    Migration(
+        version=7,
+        description="table_row_counts: точное число документов и коллекций, поддерживаемое триггерами",
+        statements=(
+            # Счётчик разбит на ROW_COUNT_SHARDS строк по номеру процесса сервера, чтобы параллельные
+            # загрузки не ждали друг друга на блокировке одной строки до commit
+            """
+            CREATE TABLE IF NOT EXISTS table_row_counts (
+                table_name VARCHAR(63) NOT NULL,
+                shard SMALLINT NOT NULL,
+                row_count BIGINT NOT NULL DEFAULT 0,
+                PRIMARY KEY (table_name, shard)
+            )
+            """,
+            f"""
+            CREATE OR REPLACE FUNCTION track_row_count() RETURNS trigger LANGUAGE plpgsql AS $$
+            DECLARE
+                delta BIGINT;
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    SELECT count(*) INTO delta FROM new_rows;
+                ELSE
+                    SELECT -count(*) INTO delta FROM old_rows;
+                END IF;
+                IF delta <> 0 THEN
+                    INSERT INTO table_row_counts (table_name, shard, row_count)
+                    VALUES (TG_TABLE_NAME, pg_backend_pid() % {ROW_COUNT_SHARDS}, delta)
+                    ON CONFLICT (table_name, shard)
+                    DO UPDATE SET row_count = table_row_counts.row_count + EXCLUDED.row_count;
+                END IF;
+                RETURN NULL;
+            END
+            $$
+            """,
+            *(_row_count_triggers(table) for table in ROW_COUNT_TABLES),
+        ),
+    ),
+    Migration(
+        version=8,
+        description="upload_jobs.attempts и claim_token: число попыток и метка захвата задачи воркером",
+        statements=(
+            "ALTER TABLE upload_jobs ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0",
+            "ALTER TABLE upload_jobs ADD COLUMN IF NOT EXISTS claim_token VARCHAR(32)",
+        ),
+    ),
+    Migration(
+        version=9,
+        description="upload_jobs.payload_ref: загруженный файл хранится на диске, а не в upload_jobs.payload",
+        statements=(
+            "ALTER TABLE upload_jobs ADD COLUMN IF NOT EXISTS payload_ref VARCHAR(32)",
+        ),
+    ),
+)
+
+
+async def _drop_invalid_index(conn: AsyncConnection, name: str) -> None:
+    """
+    Прерванный CREATE INDEX CONCURRENTLY оставляет невалидный индекс,
+    который IF NOT EXISTS пропустил бы. Такой индекс удаляется и строится заново.
+    """
+    invalid = await conn.scalar(
+        text(
+            "SELECT NOT i.indisvalid FROM pg_index i "
+            "JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = :name AND pg_catalog.pg_table_is_visible(c.oid)"
+        ),
+        {"name": name}
+    )
+    if invalid:
+        logger.warning(f"Индекс {name} невалиден, перестраивается")
+        await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+
+async def apply_migration(conn: AsyncConnection, migration: Migration) -> None:
+    """Применяет одну миграцию на соединении в режиме AUTOCOMMIT."""
+    for statement in migration.statements:
+        await conn.execute(text(statement))
+    for index in migration.indexes:
+        await _drop_invalid_index(conn, index.name)
+        await conn.execute(text(index.create_sql()))
+
+
+async def run_migrations(engine: AsyncEngine) -> list[int]:
+    """Применяет недостающие миграции. Возвращает список применённых версий."""
+    applied_now = []
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATIONS_LOCK_KEY})
+        try:
+            await conn.execute(text(
+                "CREATE TABLE IF NOT EXISTS schema_migrations ("
+                "version INTEGER PRIMARY KEY, "
+                "description VARCHAR NOT NULL, "
+                "applied_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+            ))
+            applied = set((await conn.execute(text("SELECT version FROM schema_migrations"))).scalars())
+
+            for migration in MIGRATIONS:
+                if migration.version in applied:
+                    continue
+                logger.info(f"Миграция {migration.version}: {migration.description}")
+                await apply_migration(conn, migration)
+                await conn.execute(
+                    text("INSERT INTO schema_migrations (version, description) VALUES (:version, :description)"),
+                    {"version": migration.version, "description": migration.description}
+                )
+                applied_now.append(migration.version)
+        finally:
+            await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATIONS_LOCK_KEY})
+    return applied_now
+
+
+async def main() -> None:
+    from app.database import engine, Base
+    # Регистрация всех моделей в Base.metadata
+    from app.models import user, document, collection, term_index, job  # noqa: F401
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    applied = await run_migrations(engine)
+    print(f"✅ Применено миграций: {len(applied)}")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    asyncio.run(main())
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey
+from sqlalchemy import Column, Integer, String, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from app.database import Base
 from pydantic import BaseModel
@@ -9,6 +9,10 @@ class CollectionDocument(Base):
     Промежуточная таблица для связи многие-ко-многим между коллекциями и документами.
     """
     __tablename__ = "collection_documents"
+    __table_args__ = (
+        Index("uq_collection_documents_collection_id_document_id", "collection_id", "document_id", unique=True),
+        Index("ix_collection_documents_document_id", "document_id"),
+    )
 
     id = Column(Integer, primary_key=True)
     collection_id = Column(Integer, ForeignKey("collections.id", ondelete="CASCADE"))
@@ -26,6 +30,9 @@ class Collection(Base):
     - user_id: внешний ключ пользователя
     """
     __tablename__ = "collections"
+    __table_args__ = (
+        Index("ix_collections_user_id_name", "user_id", "name"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False)
@@ -38,7 +45,8 @@ class Collection(Base):
         "FileUpload",
         secondary="collection_documents",
         back_populates="collections",
-        lazy="selectin"
+        lazy="raise",
+        passive_deletes=True
     )
 
     def __repr__(self):
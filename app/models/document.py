@@ -1,6 +1,8 @@
+from typing import Optional
+
 from pydantic import BaseModel, ConfigDict
-from sqlalchemy import Column, Integer, String, ForeignKey, Float, DateTime, func
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, BigInteger, String, ForeignKey, Float, DateTime, LargeBinary, Index, func
+from sqlalchemy.orm import relationship, deferred
 from app.database import Base
 
 class FileUpload(Base):
@@ -8,16 +10,30 @@ class FileUpload(Base):
     Модель загруженного файла:
     - user_id: владелец файла
     - unique_words: количество уникальных слов
-    - content: текстовое содержимое файла
+    - content: текст документов, загруженных до появления хранилища (app/storage.py);
+      не загружается вместе с записью, нужен явный undefer
+      (обращение без него вызывает ошибку, а не скрытый запрос)
+    - content_ref: ссылка на текст в хранилище документов
+    - content_size: размер текста в байтах UTF-8
+    - tokenizer: токенизатор, которым разобран текст (app/tokenizers.py)
+    - encoding: кодировка загруженного файла, определённая по выборке (app/encoding.py);
+      пусто у документов, загруженных раньше
     - created_at: время загрузки
     """
     __tablename__ = "fileuploads"
+    __table_args__ = (
+        Index("ix_fileuploads_user_id_id", "user_id", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     filename = Column(String, nullable=False)
-    content = Column(String, nullable=False)
+    content = deferred(Column(String, nullable=True), raiseload=True)
+    content_ref = Column(String(80), nullable=True)
+    content_size = Column(BigInteger, nullable=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     unique_words = Column(Integer, nullable=True)
+    tokenizer = Column(String(32), nullable=False, default="simple", server_default="simple")
+    encoding = Column(String(32), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     user = relationship("User", back_populates="files")
@@ -25,7 +41,8 @@ class FileUpload(Base):
         "Collection",
         secondary="collection_documents",
         back_populates="files",
-        lazy="selectin"
+        lazy="raise",
+        passive_deletes=True
     )
     word_stat = relationship("WordStat", back_populates="file", cascade="all, delete-orphan")
 
@@ -40,6 +57,10 @@ class WordStat(Base):
     - idf: обратная частота документа (inverse document frequency)
     """
     __tablename__ = "word_stat"
+    __table_args__ = (
+        Index("ix_word_stat_user_id_word_file_id", "user_id", "word", "file_id"),
+        Index("ix_word_stat_file_id", "file_id"),
+    )
 
     id = Column(Integer, primary_key=True)
     file_id = Column(Integer, ForeignKey("fileuploads.id", ondelete="CASCADE"))
@@ -52,11 +73,29 @@ class WordStat(Base):
     user = relationship("User", back_populates="word_stat")
 
 
+class HuffmanCache(Base):
+    """
+    Сохранённый код Хаффмана документа (документ после загрузки не меняется):
+    - content_hash: SHA-256 текста документа, используется как ETag
+    - encoded: двоичный канонический код — таблица длин кодов и упакованные биты
+    """
+    __tablename__ = "huffman_cache"
+
+    file_id = Column(Integer, ForeignKey("fileuploads.id", ondelete="CASCADE"), primary_key=True)
+    content_hash = Column(String(64), nullable=False)
+    encoded = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    def __repr__(self):
+        return f"<HuffmanCache(file_id={self.file_id}, content_hash={self.content_hash})>"
+
+
 class FileUploadShort(BaseModel):
     """
     Короткое представление документа — используется в списках.
     """
     id: int
     filename: str
+    encoding: Optional[str] = None
 
     model_config = ConfigDict(from_attributes=True)
@@ -0,0 +1,43 @@
+from sqlalchemy import Column, Integer, String, ForeignKey, Float, DateTime, LargeBinary, func
+from sqlalchemy.orm import deferred
+from app.database import Base
+
+# Статусы задачи обработки загрузки
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+class UploadJob(Base):
+    """
+    Задача фоновой обработки загруженного файла:
+    - status: queued / running / done / failed
+    - progress: доля выполненной работы от 0 до 1
+    - payload_ref: имя загруженного файла в UPLOAD_SPOOL_DIR (app/storage.py), удаляется после обработки
+    - payload: исходные байты файла у задач, поставленных до появления payload_ref
+    - tokenizer: токенизатор, выбранный при загрузке
+    - attempts: сколько раз задачу забирал воркер
+    - claim_token: метка последнего захвата; воркер, у которого задачу перехватили, не может её завершить
+    - document_id: созданный документ (после успешной обработки)
+    - error: текст ошибки (для failed)
+    """
+    __tablename__ = "upload_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    filename = Column(String, nullable=False)
+    status = Column(String, nullable=False, default=JOB_QUEUED, index=True)
+    progress = Column(Float, nullable=False, default=0.0)
+    payload_ref = Column(String(32), nullable=True)
+    payload = deferred(Column(LargeBinary, nullable=True))
+    tokenizer = Column(String(32), nullable=False, default="simple", server_default="simple")
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    claim_token = Column(String(32), nullable=True)
+    document_id = Column(Integer, ForeignKey("fileuploads.id", ondelete="SET NULL"), nullable=True)
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<UploadJob(id={self.id}, status={self.status})>"
@@ -0,0 +1,128 @@
+from sqlalchemy import Column, Integer, BigInteger, String, ForeignKey, LargeBinary, DateTime, func
+from app.database import Base
+
+
+class UserTermDF(Base):
+    """
+    Индекс документной частоты слов пользователя:
+    - word: слово
+    - doc_count: количество документов пользователя, содержащих слово
+    """
+    __tablename__ = "user_term_df"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    word = Column(String, primary_key=True)
+    doc_count = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<UserTermDF(user_id={self.user_id}, word={self.word}, doc_count={self.doc_count})>"
+
+
+class UserCorpusStat(Base):
+    """
+    Счётчики корпуса пользователя:
+    - doc_count: количество документов пользователя
+    - version: увеличивается при любом изменении документов или коллекций пользователя,
+      по нему проверяется актуальность кэша статистики
+    - idf_version: версия корпуса, для которой пересчитаны сохранённые IDF (None — не пересчитывались)
+    """
+    __tablename__ = "user_corpus_stat"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    doc_count = Column(Integer, nullable=False, default=0)
+    version = Column(BigInteger, nullable=False, default=0, server_default="0")
+    idf_version = Column(BigInteger, nullable=True)
+
+    def __repr__(self):
+        return f"<UserCorpusStat(user_id={self.user_id}, doc_count={self.doc_count})>"
+
+
+class Vocabulary(Base):
+    """
+    Общий словарь: соответствие слова и его числового идентификатора.
+    Идентификаторы используются в компактных векторах документов.
+    """
+    __tablename__ = "vocabulary"
+
+    id = Column(Integer, primary_key=True)
+    word = Column(String, unique=True, nullable=False)
+
+    def __repr__(self):
+        return f"<Vocabulary(id={self.id}, word={self.word})>"
+
+
+class DocumentTermVector(Base):
+    """
+    Полный вектор слов документа в двоичном виде:
+    - term_ids: отсортированные id слов из словаря (uint32)
+    - counts: количество вхождений каждого слова (float32)
+    - total_words: общее количество слов документа
+    """
+    __tablename__ = "document_term_vectors"
+
+    file_id = Column(Integer, ForeignKey("fileuploads.id", ondelete="CASCADE"), primary_key=True)
+    total_words = Column(Integer, nullable=False)
+    term_ids = Column(LargeBinary, nullable=False)
+    counts = Column(LargeBinary, nullable=False)
+
+    def __repr__(self):
+        return f"<DocumentTermVector(file_id={self.file_id}, total_words={self.total_words})>"
+
+
+class SearchPosting(Base):
+    """
+    Блок списка вхождений слова в документы пользователя (инвертированный индекс для поиска):
+    - block: номер блока; новые документы дописываются в последний блок слова
+    - doc_count: количество документов в блоке (не больше SEARCH_BLOCK_SIZE)
+    - last_doc_id: id последнего документа блока, от него считается разность для следующего
+    - doc_ids: разности id документов (у первого в блоке — сам id), varint
+    - counts: количество вхождений слова в каждый документ, varint
+    - norms: длина каждого документа, сжатая в один байт (нормировка BM25)
+    """
+    __tablename__ = "search_postings"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    term_id = Column(Integer, primary_key=True)
+    block = Column(Integer, primary_key=True)
+    doc_count = Column(Integer, nullable=False)
+    last_doc_id = Column(Integer, nullable=False)
+    doc_ids = Column(LargeBinary, nullable=False)
+    counts = Column(LargeBinary, nullable=False)
+    norms = Column(LargeBinary, nullable=False)
+
+    def __repr__(self):
+        return f"<SearchPosting(user_id={self.user_id}, term_id={self.term_id}, block={self.block})>"
+
+
+class SearchIndexStat(Base):
+    """
+    Состояние поискового индекса пользователя (запись есть, только если индекс построен):
+    - doc_count: количество документов в индексе
+    - total_words: суммарная длина документов, для средней длины в BM25
+    - deleted_docs: сколько удалённых документов ещё остаётся в списках вхождений
+    - generation: номер построения индекса, меняется при каждом перестроении
+    """
+    __tablename__ = "search_index_stat"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    doc_count = Column(Integer, nullable=False, default=0)
+    total_words = Column(BigInteger, nullable=False, default=0)
+    deleted_docs = Column(Integer, nullable=False, default=0)
+    generation = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<SearchIndexStat(user_id={self.user_id}, doc_count={self.doc_count})>"
+
+
+class SearchRebuildRequest(Base):
+    """
+    Запрос на построение или перестроение поискового индекса пользователя.
+    Поиск только оставляет запрос, индекс перестраивает фоновый воркер (app/jobs.py).
+    """
+    __tablename__ = "search_rebuild_requests"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    requested_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    def __repr__(self):
+        return f"<SearchRebuildRequest(user_id={self.user_id})>"
@@ -0,0 +1,23 @@
+import heapq
+import os
+from typing import Callable, Iterable, Optional, TypeVar
+
+T = TypeVar("T")
+
+# === Константы конфигурации ===
+# Сколько слов документа сохраняется в WordStat и в каком порядке по IDF они отбираются
+TOP_WORDS_LIMIT = int(os.getenv("TOP_WORDS_LIMIT", "50"))
+TOP_WORDS_ORDER = os.getenv("TOP_WORDS_ORDER", "asc")
+
+
+def top_k(items: Iterable[T], key: Callable[[T], object], limit: Optional[int], descending: bool) -> list[T]:
+    """
+    Возвращает limit лучших элементов по ключу.
+    Вместо сортировки всего набора используется куча: O(n log k) вместо O(n log n).
+    Без limit возвращает весь набор, отсортированный по ключу.
+    """
+    if limit is None:
+        return sorted(items, key=key, reverse=descending)
+    if descending:
+        return heapq.nlargest(limit, items, key=key)
+    return heapq.nsmallest(limit, items, key=key)
@@ -1,22 +1,43 @@
+import asyncio
 import logging
+import struct
+import tarfile
+import zipfile
 
-from fastapi import APIRouter, Depends, HTTPException, Request
-from fastapi.responses import RedirectResponse
+from typing import Literal
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, UploadFile, File
+from fastapi.responses import RedirectResponse, StreamingResponse, PlainTextResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy import select, func
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 from starlette.responses import JSONResponse
 
+from app import metrics
+from app.analysis_pool import analysis_pool, AnalysisUnavailable
 from app.auth.auth_services import authenticate_user, create_access_token
 from app.auth.dependencies import get_current_user
-from app.crud import document_crud, collection_crud, user_crud
-from app.database import get_db, async_session
+from app.crud import document_crud, collection_crud, user_crud, job_crud, term_index_crud
+from app.database import get_db, pool_stats
 from app.models.collection import CollectionsAddRequest
 from app.models.user import User, UserCreate
+from app.jobs import job_wakeup
 from app.models.document import FileUpload, FileUploadShort
-from app.schemas import WordStatRead, CollectionWithDocumentIDs
-from app.services import inverse_document_frequency, huffman_encode
+from app.models.job import JOB_DONE, JOB_FAILED
+from app.stats_cache import collection_stats_cache
+from app.storage import content_store, parse_byte_range, spool_upload, delete_spooled, CONTENT_CHUNK_SIZE
+from app.schemas import WordStatRead, MergedStatRead, CollectionWithDocumentIDs, JobRead, BatchUploadRead, SearchRead, \
+    SimilarDocumentRead, IdfRecomputeRead, TokenizerRead
+from app.services import (
+    collection_statistics, unregister_document_terms, document_word_stat, document_huffman_code, document_text,
+    huffman_binary_to_text, huffman_decode_binary, iter_chunks, HUFFMAN_DECODE_MAX_SIZE,
+    tokenize_upload, ingest_documents, expand_archive, search_documents, unindex_document, similar_documents,
+    recompute_user_idf
+)
+from app.search import SEARCH_MAX_LIMIT
+from app.similarity import SIMILAR_MAX_LIMIT
+from app.tokenizers import TOKENIZERS, TOKENIZER_DEFAULT, TokenizerName
 
 router = APIRouter()
 
@@ -27,7 +48,7 @@ router = APIRouter()
     response_model=list[FileUploadShort],
     summary="Получить список загруженных документов",
     tags=["Документ"],
-    description="Возвращает список документов ('id', название), загруженных текущим пользователем."
+    description="Возвращает список документов ('id', название, кодировка исходного файла), загруженных текущим пользователем."
 )
 async def list_documents(
     db: AsyncSession = Depends(get_db),
@@ -40,53 +61,277 @@ async def list_documents(
         logging.exception(user.id," Ошибка при получении документов")
         raise HTTPException(status_code=500, detail="Внутренняя ошибка сервера")
 
+@router.get(
+    "/tokenizers",
+    response_model=list[TokenizerRead],
+    summary="Список токенизаторов",
+    description="Токенизаторы, которые можно выбрать при загрузке документа (параметр tokenizer)",
+    tags=["Документ"]
+)
+async def list_tokenizers():
+    return [
+        {"name": tokenizer.name, "description": tokenizer.description, "default": tokenizer.name == TOKENIZER_DEFAULT}
+        for tokenizer in TOKENIZERS.values()
+    ]
+
+@router.post(
+    "/documents",
+    response_model=JobRead,
+    status_code=status.HTTP_202_ACCEPTED,
+    summary="Загрузить документ",
+    description="Ставит файл в очередь на обработку и сразу возвращает задачу. "
+                "Ход обработки — GET /api/jobs/{job_id}. tokenizer задаёт разбор текста на слова "
+                "(список — GET /api/tokenizers)",
+    tags=["Документ"]
+)
+async def upload_document(
+        file: UploadFile = File(...),
+        tokenizer: TokenizerName = TOKENIZER_DEFAULT,
+        db: AsyncSession = Depends(get_db),
+        user: User = Depends(get_current_user)):
+    # Файл копируется на диск порциями, в задаче остаётся только ссылка на него
+    try:
+        payload_ref, size = await spool_upload(file.file)
+    finally:
+        await file.close()
+    metrics.upload_bytes.inc(size)
+
+    try:
+        job = await job_crud.create_upload_job(db, user.id, file.filename, payload_ref, tokenizer)
+    except Exception:
+        delete_spooled(payload_ref)
+        raise
+    job_wakeup.set()
+    return job
+
+@router.post(
+    "/documents/batch",
+    response_model=BatchUploadRead,
+    status_code=status.HTTP_201_CREATED,
+    summary="Пакетная загрузка документов",
+    description="Принимает несколько файлов или zip/tar-архивы, обрабатывает их параллельно "
+                "и сохраняет одной транзакцией, все — одним токенизатором. Файлы без допустимого текста пропускаются",
+    tags=["Документ"]
+)
+async def upload_documents_batch(
+        files: list[UploadFile] = File(...),
+        tokenizer: TokenizerName = TOKENIZER_DEFAULT,
+        db: AsyncSession = Depends(get_db),
+        user: User = Depends(get_current_user)):
+    sources = []
+    for file in files:
+        metrics.upload_bytes.inc(file.size or 0)
+        try:
+            # Распаковка синхронная и CPU-ёмкая — выполняется вне цикла событий
+            sources.extend(await asyncio.to_thread(expand_archive, file))
+        except (zipfile.BadZipFile, tarfile.TarError):
+            raise HTTPException(status_code=400, detail=f"Не удалось распаковать архив {file.filename}")
+
+    # Не больше задач одновременно, чем процессов в пуле, чтобы не упереться в его очередь
+    limit = asyncio.Semaphore(max(analysis_pool.workers, 1))
+
+    async def tokenize(source: UploadFile):
+        async with limit:
+            counts, text, stream_stats = await tokenize_upload(source, tokenizer=tokenizer)
+            return source.filename, counts, text, stream_stats.encoding
+
+    results = await asyncio.gather(*(tokenize(source) for source in sources), return_exceptions=True)
+
+    documents, skipped = [], []
+    for source, result in zip(sources, results):
+        if isinstance(result, AnalysisUnavailable):
+            raise result
+        if isinstance(result, BaseException) or not result[1]:
+            skipped.append(source.filename)
+        else:
+            documents.append(result)
+
+    if not documents:
+        raise HTTPException(status_code=400, detail="Файлы не содержат допустимого текста")
+
+    document_ids = await ingest_documents(db, user, documents, tokenizer)
+    await db.commit()
+    return {"document_ids": document_ids, "skipped": skipped}
+
 @router.get(
     "/documents/{document_id}",
     summary="Получить документ",
-    description="Возвращает содержимое документа",
+    description="Возвращает содержимое документа. С format=text отдаёт текст потоком (text/plain) "
+                "и поддерживает запрос диапазона байт заголовком Range",
     tags=["Документ"]
 )
-async def get_document(document_id: int, db: AsyncSession = Depends(get_db), user: User = Depends(get_current_user)):
+async def get_document(
+        document_id: int,
+        format: Literal["json", "text"] = "json",
+        range_header: str | None = Header(None, alias="Range"),
+        db: AsyncSession = Depends(get_db),
+        user: User = Depends(get_current_user)):
     # Проверяем, что документ принадлежит текущему пользователю
-    file = await db.get(FileUpload, document_id)
-    if not file or file.user_id != user.id:
+    file = await document_crud.get_user_file(db, document_id, user.id)
+    if not file:
         raise HTTPException(status_code=404, detail="Документ не найден")
-    return {"content": file.content}
+
+    if format == "json":
+        return {"content": await document_text(db, file)}
+
+    # Документы, загруженные до появления хранилища, отдаются из fileuploads.content
+    data = None
+    if file.content_ref:
+        size = file.content_size
+    else:
+        data = (await document_text(db, file)).encode("utf-8")
+        size = len(data)
+
+    try:
+        byte_range = parse_byte_range(range_header, size)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            detail="Диапазон вне документа",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    start, end = byte_range or (0, size - 1)
+    headers = {"Accept-Ranges": "bytes", "Content-Length": str(end - start + 1)}
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    if data is None:
+        body = content_store.iter_range(file.content_ref, start, end)
+    else:
+        body = iter_chunks(data[start:end + 1], CONTENT_CHUNK_SIZE)
+    return StreamingResponse(
+        body,
+        status_code=status.HTTP_206_PARTIAL_CONTENT if byte_range else status.HTTP_200_OK,
+        media_type="text/plain; charset=utf-8",
+        headers=headers
+    )
 
 @router.get(
     "/documents/{document_id}/statistics",
-    response_model=list[WordStatRead],
+    response_model=list[WordStatRead] | list[MergedStatRead],
     summary="Статистика по документу",
-    description="Получает TF/IDF статистику по конкретному документу",
+    description="Получает TF/IDF статистику по конкретному документу. "
+                "С параметром full=true возвращает точные TF/IDF для всех слов документа",
     tags=["Документ"]
 )
-async def get_document_stat(document_id: int, db: AsyncSession = Depends(get_db), user: User = Depends(get_current_user)):
+async def get_document_stat(
+        document_id: int,
+        full: bool = False,
+        db: AsyncSession = Depends(get_db),
+        user: User = Depends(get_current_user)):
     file = await db.get(FileUpload, document_id)
     if not file or file.user_id != user.id:
         raise HTTPException(status_code=404, detail="Документ не найден")
+
+    if full:
+        stats = await document_word_stat(db, file, user)
+        if stats is not None:
+            return stats
+
     return await document_crud.get_word_stat_for_file(db, document_id)
 
 
+@router.post(
+    "/documents/statistics/recompute",
+    response_model=IdfRecomputeRead,
+    summary="Пересчитать IDF в статистике документов",
+    description="Пересчитывает сохранённые IDF во всей статистике текущего пользователя по текущему корпусу. "
+                "Если документы не менялись с прошлого пересчёта, ничего не делает (force=true — пересчитать всё)",
+    tags=["Документ"]
+)
+async def recompute_document_stat(
+        force: bool = False,
+        db: AsyncSession = Depends(get_db),
+        user: User = Depends(get_current_user)):
+    updated = await recompute_user_idf(db, user.id, force)
+    await db.commit()
+    return {"updated": updated}
+
 @router.get(
     "/documents/{document_id}/huffman",
     summary="Код Хаффмана по документу",
-    description="Возвращает содержимое документа, закодированное с помощью алгоритма Хаффмана",
+    description="Возвращает содержимое документа, закодированное с помощью алгоритма Хаффмана. "
+                "С format=binary отдаёт канонический код в двоичном виде (application/octet-stream): "
+                "заголовок с таблицей длин кодов и упакованные биты",
     tags=["Документ"]
 )
-async def get_document_huffman(document_id: int, db: AsyncSession = Depends(get_db), user: User = Depends(get_current_user)):
-    file = await db.get(FileUpload, document_id)
-    if not file or file.user_id != user.id:
+async def get_document_huffman(
+        document_id: int,
+        format: Literal["json", "binary"] = "json",
+        if_none_match: str | None = Header(None),
+        db: AsyncSession = Depends(get_db),
+        user: User = Depends(get_current_user)):
+    file = await document_crud.get_user_file(db, document_id, user.id)
+    if not file:
         raise HTTPException(status_code=404, detail="Документ не найден")
 
-    if not file.content:
+    if not file.content_size:
         raise HTTPException(status_code=400, detail="Документ пустой")
 
-    encoded_text, huffman_tree = huffman_encode(file.content)
+    # Код считается один раз на документ; ETag — хэш содержимого и формат ответа
+    content_hash, encoded = await document_huffman_code(db, file)
+    etag = f'"{content_hash}-{format}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if if_none_match and (if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    if format == "binary":
+        return StreamingResponse(
+            iter_chunks(encoded),
+            media_type="application/octet-stream",
+            headers={**headers, "Content-Length": str(len(encoded))}
+        )
 
-    return {
-        "encoded": encoded_text,
-        "tree": huffman_tree  # для отладки
-    }
+    encoded_text, huffman_tree = await analysis_pool.run(huffman_binary_to_text, encoded)
+
+    return JSONResponse(
+        content={
+            "encoded": encoded_text,
+            "tree": huffman_tree  # для отладки
+        },
+        headers=headers
+    )
+
+@router.get(
+    "/documents/{document_id}/similar",
+    response_model=list[SimilarDocumentRead],
+    summary="Похожие документы",
+    description="Возвращает до limit документов текущего пользователя, наиболее похожих на данный, "
+                "по косинусному сходству TF-IDF векторов",
+    tags=["Документ"]
+)
+async def get_similar_documents(
+        document_id: int,
+        limit: int = Query(10, ge=1, le=SIMILAR_MAX_LIMIT),
+        db: AsyncSession = Depends(get_db),
+        user: User = Depends(get_current_user)):
+    file = await document_crud.get_user_file(db, document_id, user.id)
+    if not file:
+        raise HTTPException(status_code=404, detail="Документ не найден")
+    return await similar_documents(db, user.id, document_id, limit)
+
+@router.post(
+    "/huffman/decode",
+    response_class=PlainTextResponse,
+    summary="Декодировать код Хаффмана",
+    description="Принимает двоичный код Хаффмана (результат format=binary) и возвращает исходный текст",
+    tags=["Документ"]
+)
+async def decode_huffman(request: Request, user: User = Depends(get_current_user)):
+    # Размер проверяется до передачи в пул: тело читается порциями и обрывается на пределе
+    too_large = HTTPException(status_code=413, detail="Код Хаффмана слишком большой")
+    if int(request.headers.get("content-length") or 0) > HUFFMAN_DECODE_MAX_SIZE:
+        raise too_large
+    data = bytearray()
+    async for chunk in request.stream():
+        data += chunk
+        if len(data) > HUFFMAN_DECODE_MAX_SIZE:
+            raise too_large
+    data = bytes(data)
+    try:
+        return await analysis_pool.run(huffman_decode_binary, data)
+    except (ValueError, struct.error):
+        raise HTTPException(status_code=400, detail="Некорректный код Хаффмана")
 
 @router.delete(
     "/documents/{document_id}",
@@ -95,14 +340,81 @@ async def get_document_huffman(document_id: int, db: AsyncSession = Depends(get_
     tags=["Документ"]
 )
 async def delete_document(document_id: int, db: AsyncSession = Depends(get_db), user: User = Depends(get_current_user)):
+    file = await db.get(FileUpload, document_id)
+    if not file or file.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Документ не найден")
+
+    # Уменьшаем документную частоту слов до удаления, фиксируется тем же commit
+    await unregister_document_terms(db, file)
+    await unindex_document(db, file)
+
     # Удаляем файл и его статистику, если есть
     file = await document_crud.delete_file_upload(db, document_id, user.id)
     if not file:
         raise HTTPException(status_code=404, detail="Документ не найден")
     else:
         await document_crud.delete_word_stat_for_file(db, document_id)
+        metrics.documents_deleted.inc()
         return {"detail": "Документ и статистика удалены"}
 
+# === SEARCH ===
+
+@router.get(
+    "/search",
+    response_model=SearchRead,
+    summary="Поиск по документам",
+    description="Полнотекстовый поиск по документам текущего пользователя с ранжированием BM25. "
+                "limit и offset задают страницу результатов",
+    tags=["Поиск"]
+)
+async def search_user_documents(
+        q: str = Query(..., min_length=1, max_length=1000),
+        limit: int = Query(10, ge=1, le=SEARCH_MAX_LIMIT),
+        offset: int = Query(0, ge=0),
+        db: AsyncSession = Depends(get_db),
+        user: User = Depends(get_current_user)):
+    result = await search_documents(db, user, q, limit, offset)
+    if result["index_pending"]:
+        # Фиксируем запрос на перестроение индекса и будим воркер
+        await db.commit()
+        job_wakeup.set()
+    return result
+
+# === JOBS ===
+
+@router.get(
+    "/jobs/{job_id}",
+    response_model=JobRead,
+    summary="Статус задачи",
+    description="Возвращает статус и прогресс обработки загруженного файла",
+    tags=["Задача"]
+)
+async def get_job(job_id: int, db: AsyncSession = Depends(get_db), user: User = Depends(get_current_user)):
+    job = await job_crud.get_user_job(db, job_id, user.id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return job
+
+@router.get(
+    "/jobs/{job_id}/result",
+    response_model=list[WordStatRead],
+    summary="Результат задачи",
+    description="Возвращает TF/IDF статистику документа, созданного задачей. "
+                "Пока задача не завершена, отвечает 409",
+    tags=["Задача"]
+)
+async def get_job_result(job_id: int, db: AsyncSession = Depends(get_db), user: User = Depends(get_current_user)):
+    job = await job_crud.get_user_job(db, job_id, user.id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    if job.status == JOB_FAILED:
+        raise HTTPException(status_code=422, detail=job.error or "Ошибка обработки файла")
+    if job.status != JOB_DONE:
+        raise HTTPException(status_code=409, detail="Задача ещё не завершена")
+    if job.document_id is None:
+        raise HTTPException(status_code=404, detail="Документ не найден")
+    return await document_crud.get_word_stat_for_file(db, job.document_id)
+
 # === COLLECTIONS ===
 
 @router.get(
@@ -125,29 +437,34 @@ async def get_collection_documents(collection_id: int, db: AsyncSession = Depend
     collection = await collection_crud.get_collection_by_id(db, collection_id, user)
     if not collection:
         raise HTTPException(status_code=404, detail="Коллекция не найдена")
-    return [file.id for file in collection.files]
+    return await collection_crud.get_collection_file_ids(db, collection.id)
 
 @router.get(
     "/collections/{collection_id}/statistics",
     summary="TF/IDF по коллекции",
-    description="Считает объединённый TF для всех документов коллекции и возвращает IDF",
+    description="Считает объединённый TF для всех документов коллекции и возвращает IDF. "
+                "limit ограничивает количество слов, order задаёт порядок по IDF",
     tags=["Коллекция"]
 )
-async def get_collection_statistics(collection_id: int, db: AsyncSession = Depends(get_db), user: User = Depends(get_current_user)):
-    stats = await collection_crud.get_collection_word_stat(db, collection_id, user)
-    words = [s["word"] for s in stats]
-
-    idf_map = await inverse_document_frequency(db, user, words)
+async def get_collection_statistics(
+        collection_id: int,
+        limit: int | None = Query(None, ge=1),
+        order: Literal["asc", "desc"] = "desc",
+        db: AsyncSession = Depends(get_db),
+        user: User = Depends(get_current_user)):
+    # Полный список по убыванию IDF берётся из кэша или считается в БД
+    ranked = await collection_statistics(db, user, collection_id)
+    if order == "asc":
+        ranked = ranked[::-1]
 
-    merged_stat = [
+    return [
         {
             "word": s["word"],
             "tf": round(s["tf"], 6),
-            "idf": round(idf_map.get(s["word"], 0.0), 6)
+            "idf": round(s["idf"], 6)
         }
-        for s in stats
+        for s in ranked[:limit]
     ]
-    return sorted(merged_stat, key=lambda x: x["idf"], reverse=True)
 
 @router.post(
     "/collection/add_document_to_collections/{document_id}",
@@ -193,7 +510,7 @@ async def remove_document_from_collection(collection_id: int, document_id: int,
     tags=["Пользователь"]
 )
 async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
-    user = await authenticate_user(form_data.username, form_data.password)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(status_code=400, detail="Неверное имя пользователя или пароль")
 
@@ -263,27 +580,29 @@ async def delete_user(user_id: int, db: AsyncSession = Depends(get_db), current_
 
 @router.get("/metrics", include_in_schema=False)
 async def get_metrics(current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    # Общие количества — из счётчиков, поддерживаемых триггерами, без сканирования таблиц
     document_count = await document_crud.count_documents(db)
     collection_count = await collection_crud.count_collections(db)
 
-    async with async_session() as session:
-        total_uploads = await session.scalar(
+    # Количество документов пользователя поддерживается индексом документной частоты
+    total_uploads = await term_index_crud.get_document_count(db, current_user.id)
+    if total_uploads is None:
+        total_uploads = await db.scalar(
             select(func.count()).select_from(FileUpload).where(FileUpload.user_id == current_user.id)
         )
-        result = await session.execute(
-            select(FileUpload)
-            .where(FileUpload.user_id == current_user.id)
-            .order_by(FileUpload.id.desc())
-            .limit(1)
-        )
-        last_upload = result.scalars().first()
-
-        unique_words = last_upload.unique_words if last_upload else 0
+    unique_words = await db.scalar(
+        select(FileUpload.unique_words)
+        .where(FileUpload.user_id == current_user.id)
+        .order_by(FileUpload.id.desc())
+        .limit(1)
+    )
 
     return JSONResponse(content={
         "total_uploads": total_uploads,
-        "unique_words": unique_words,
+        "unique_words": unique_words or 0,
         "documents": document_count,
-        "collections": collection_count
+        "collections": collection_count,
+        "collection_stats_cache": collection_stats_cache.stats(),
+        "db_pool": pool_stats()
     })
 
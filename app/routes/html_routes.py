@@ -8,10 +8,12 @@ from fastapi.templating import Jinja2Templates
 from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database import async_session, get_db
+from app.database import get_db
 from app.models.user import User
-from app.auth.auth_services import verify_password, hash_password, create_access_token
+from app.auth.auth_services import authenticate_user, verify_password, hash_password, create_access_token
 from app.auth.dependencies import get_current_user
+from app.auth.user_cache import user_cache
+from app.crud import user_crud
 
 templates = Jinja2Templates(directory="app/templates")
 router = APIRouter()
@@ -34,17 +36,19 @@ async def login_form(request: Request):
 
 
 @router.post("/login", include_in_schema=False)
-async def login_user(request: Request, username: str = Form(...), password: str = Form(...)):
+async def login_user(
+    request: Request,
+    username: str = Form(...),
+    password: str = Form(...),
+    db: AsyncSession = Depends(get_db)
+):
     """Обработка логина пользователя."""
-    async with async_session() as session:
-        result = await session.execute(select(User).where(User.username == username))
-        user = result.scalar_one_or_none()
-
-        if not user or not verify_password(password, user.hashed_password):
-            return templates.TemplateResponse("login.html", {
-                "request": request,
-                "error": "Неверный логин или пароль"
-            })
+    user = await authenticate_user(db, username, password)
+    if not user:
+        return templates.TemplateResponse("login.html", {
+            "request": request,
+            "error": "Неверный логин или пароль"
+        })
 
     # Устанавливаем токен в cookie
     response = RedirectResponse(url="/", status_code=HTTPStatus.SEE_OTHER)
@@ -60,29 +64,33 @@ async def register_form(request: Request):
 
 
 @router.post("/register", include_in_schema=False)
-async def register_user(request: Request, username: str = Form(...), password: str = Form(...)):
+async def register_user(
+    request: Request,
+    username: str = Form(...),
+    password: str = Form(...),
+    db: AsyncSession = Depends(get_db)
+):
     """Обработка регистрации."""
-    async with async_session() as session:
-        result = await session.execute(select(User).where(User.username == username))
-        existing_user = result.scalar_one_or_none()
-
-        if existing_user:
-            return templates.TemplateResponse("register.html", {
-                "request": request,
-                "error": "Пользователь уже существует",
-                "password_hint": PASSWORD_HINT
-            })
-
-        if not is_valid_password(password):
-            return templates.TemplateResponse("register.html", {
-                "request": request,
-                "error": "Пароль не соответствует требованиям.",
-                "password_hint": PASSWORD_HINT
-            })
-
-        new_user = User(username=username, hashed_password=hash_password(password))
-        session.add(new_user)
-        await session.commit()
+    result = await db.execute(select(User).where(User.username == username))
+    existing_user = result.scalar_one_or_none()
+
+    if existing_user:
+        return templates.TemplateResponse("register.html", {
+            "request": request,
+            "error": "Пользователь уже существует",
+            "password_hint": PASSWORD_HINT
+        })
+
+    if not is_valid_password(password):
+        return templates.TemplateResponse("register.html", {
+            "request": request,
+            "error": "Пароль не соответствует требованиям.",
+            "password_hint": PASSWORD_HINT
+        })
+
+    new_user = User(username=username, hashed_password=hash_password(password))
+    db.add(new_user)
+    await db.commit()
 
     return RedirectResponse(url="/auth/login", status_code=HTTPStatus.SEE_OTHER)
 
@@ -120,6 +128,7 @@ async def account_page(request: Request, current_user: User = Depends(get_curren
 async def change_password(
     old_password: str = Form(...),
     new_password: str = Form(...),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """Изменение пароля."""
@@ -135,13 +144,13 @@ async def change_password(
         response.set_cookie("msg_class", "flash-error", max_age=5)
         return response
 
-    async with async_session() as session:
-        await session.execute(
-            update(User)
-            .where(User.id == current_user.id)
-            .values(hashed_password=hash_password(new_password))
-        )
-        await session.commit()
+    await db.execute(
+        update(User)
+        .where(User.id == current_user.id)
+        .values(hashed_password=hash_password(new_password))
+    )
+    await db.commit()
+    user_cache.invalidate(current_user.id)
 
     response = RedirectResponse("/auth/account", status_code=HTTPStatus.SEE_OTHER)
     response.set_cookie("msg", quote("Пароль успешно изменён"), max_age=5)
@@ -155,8 +164,7 @@ async def delete_account(
     current_user: User = Depends(get_current_user)
 ):
     """Удаление аккаунта."""
-    await db.delete(current_user)
-    await db.commit()
+    await user_crud.delete_user(db, current_user.id)
 
     response = RedirectResponse(url="/", status_code=HTTPStatus.SEE_OTHER)
     response.delete_cookie("access_token")
@@ -17,7 +17,6 @@ class FileUploadRead(FileUploadBase):
     user_id: int
     created_at: datetime
     filename: str
-    content: str
 
     model_config = {
         "from_attributes": True
@@ -81,6 +80,61 @@ class MergedStatRead(BaseModel):
     tf: float
     idf: float
 
+# === SEARCH ===
+
+class SearchResultRead(BaseModel):
+    document_id: int
+    filename: str
+    score: float
+
+class SearchRead(BaseModel):
+    """
+    Страница результатов поиска; total — количество найденных документов.
+    index_pending — индекс строится или перестраивается в фоне, результаты могут быть неполными
+    """
+    query: str
+    total: int
+    results: List[SearchResultRead]
+    index_pending: bool = False
+
+class SimilarDocumentRead(BaseModel):
+    """Похожий документ; score — косинусное сходство TF-IDF векторов (0..1)"""
+    document_id: int
+    filename: str
+    score: float
+
+class IdfRecomputeRead(BaseModel):
+    """Результат пересчёта сохранённых IDF; updated — количество обновлённых строк статистики"""
+    updated: int
+
+class TokenizerRead(BaseModel):
+    """Токенизатор, который можно выбрать при загрузке документа"""
+    name: str
+    description: str
+    default: bool
+
+class BatchUploadRead(BaseModel):
+    """Результат пакетной загрузки документов"""
+    document_ids: List[int]
+    skipped: List[str]
+
+# === UPLOAD JOB ===
+
+class JobRead(BaseModel):
+    """Состояние задачи обработки загруженного файла"""
+    id: int
+    filename: str
+    status: str
+    progress: float
+    document_id: Optional[int]
+    error: Optional[str]
+    created_at: datetime
+    updated_at: Optional[datetime]
+
+    model_config = {
+        "from_attributes": True
+    }
+
 # === USER ===
 
 class UserRead(BaseModel):
@@ -0,0 +1,171 @@
+"""
+Полнотекстовый поиск по документам пользователя: инвертированный индекс и ранжирование BM25.
+
+Для каждого слова хранится список документов, где оно встречается, разбитый на блоки
+(таблица search_postings). В блоке id документов идут по возрастанию и хранятся разностями
+в varint, количества вхождений — в varint, длина документа — одним байтом на логарифмической
+шкале, как нормы в Lucene. Новый документ дописывается в конец последнего блока слова
+конкатенацией bytea, без чтения и перезаписи всего списка.
+
+Удалённые документы остаются в блоках до перестроения индекса и отбрасываются при выдаче.
+Индекс перестраивается по сохранённым векторам документов: для пользователя, документы которого
+загружены до появления индекса, и когда удалённых становится слишком много. Поиск только оставляет
+запрос (search_rebuild_requests), перестраивает индекс фоновый воркер (app/jobs.py) или команда rebuild.
+
+Оценка документа — BM25 с IDF приложения (log10(N / n_i), как в статистике документов):
+    score = Σ idf(t) · tf · (k1 + 1) / (tf + k1 · (1 − b + b · |d| / avgdl))
+
+    python -m app.search rebuild              # перестроить индексы всех пользователей
+    python -m app.search rebuild --user-id 1
+"""
+import argparse
+import asyncio
+import math
+import os
+from array import array
+from dataclasses import dataclass
+from itertools import accumulate
+from typing import Iterable, Mapping, Sequence
+
+# === Константы конфигурации ===
+SEARCH_BLOCK_SIZE = int(os.getenv("SEARCH_BLOCK_SIZE", "256"))
+SEARCH_BM25_K1 = float(os.getenv("SEARCH_BM25_K1", "1.2"))
+SEARCH_BM25_B = float(os.getenv("SEARCH_BM25_B", "0.75"))
+# Индекс перестраивается, когда удалённых документов в нём больше этой доли от живых
+SEARCH_COMPACT_RATIO = float(os.getenv("SEARCH_COMPACT_RATIO", "0.25"))
+SEARCH_MAX_LIMIT = 100
+
+# Длина документа в байте нормы: ближайшая степень NORM_BASE (погрешность до ~5%)
+NORM_BASE = 1.1
+NORM_LENGTHS = tuple(NORM_BASE ** norm for norm in range(256))
+
+
+def encode_varints(values: Iterable[int]) -> bytes:
+    """Целые неотрицательные числа в varint: по 7 бит на байт, старший бит — признак продолжения."""
+    out = bytearray()
+    for value in values:
+        while value >= 0x80:
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        out.append(value)
+    return bytes(out)
+
+
+def decode_varints(data: bytes) -> array:
+    values = array("I")
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = shift = 0
+    return values
+
+
+def encode_norm(length: int) -> int:
+    return min(255, round(math.log(max(length, 1), NORM_BASE)))
+
+
+@dataclass(frozen=True)
+class PostingBlock:
+    """Декодированный блок: id документов, количества вхождений и нормы длины."""
+    doc_ids: array
+    counts: array
+    norms: bytes
+
+
+def decode_block(doc_ids: bytes, counts: bytes, norms: bytes) -> PostingBlock:
+    return PostingBlock(array("I", accumulate(decode_varints(doc_ids))), decode_varints(counts), bytes(norms))
+
+
+def plan_appends(
+    postings: Mapping[int, Sequence[tuple[int, int, int]]],
+    tails: Mapping[int, tuple[int, int, int]],
+    block_size: int = SEARCH_BLOCK_SIZE
+) -> list[dict]:
+    """
+    Раскладывает новые вхождения по блокам.
+
+    :param postings: id слова -> [(id документа, количество, норма)] по возрастанию id документа
+    :param tails: id слова -> (номер, количество документов, id последнего документа) последнего блока
+    :return: строки для upsert в search_postings; для существующего блока байты дописываются в конец
+    """
+    rows = []
+    for term_id, entries in postings.items():
+        tail = tails.get(term_id)
+        start = 0
+        next_block = 0
+        if tail is not None:
+            block, doc_count, last_doc_id = tail
+            next_block = block + 1
+            # Документ с меньшим id (загрузка, зафиксированная позже соседней) начинает новый блок:
+            # разности в блоке должны быть положительными
+            if doc_count < block_size and entries[0][0] > last_doc_id:
+                start = block_size - doc_count
+                rows.append(_block_row(term_id, block, entries[:start], last_doc_id))
+        for offset in range(start, len(entries), block_size):
+            rows.append(_block_row(term_id, next_block, entries[offset:offset + block_size], 0))
+            next_block += 1
+    return rows
+
+
+def _block_row(term_id: int, block: int, entries: Sequence[tuple[int, int, int]], previous: int) -> dict:
+    deltas = []
+    for doc_id, _, _ in entries:
+        deltas.append(doc_id - previous)
+        previous = doc_id
+    return {
+        "term_id": term_id,
+        "block": block,
+        "doc_count": len(entries),
+        "last_doc_id": previous,
+        "doc_ids": encode_varints(deltas),
+        "counts": encode_varints(count for _, count, _ in entries),
+        "norms": bytes(norm for _, _, norm in entries),
+    }
+
+
+def bm25_scores(
+    blocks: Mapping[int, Iterable[PostingBlock]],
+    idf: Mapping[int, float],
+    avgdl: float,
+    k1: float = SEARCH_BM25_K1,
+    b: float = SEARCH_BM25_B
+) -> dict[int, float]:
+    """Суммарная оценка BM25 каждого документа по всем словам запроса."""
+    # Знаменатель зависит от длины только через байт нормы, поэтому считается один раз на 256 значений
+    length_norm = [k1 * (1 - b + b * length / avgdl) for length in NORM_LENGTHS] if avgdl else [k1] * 256
+    scores: dict[int, float] = {}
+    for term_id, term_blocks in blocks.items():
+        weight = idf.get(term_id, 0.0) * (k1 + 1)
+        for block in term_blocks:
+            for doc_id, tf, norm in zip(block.doc_ids, block.counts, block.norms):
+                scores[doc_id] = scores.get(doc_id, 0.0) + weight * tf / (tf + length_norm[norm])
+    return scores
+
+
+async def main(user_id: int | None) -> None:
+    from sqlalchemy import select
+    from app.database import async_session, engine
+    from app.models.user import User
+    from app.services import rebuild_search_index
+
+    async with async_session() as db:
+        user_ids = [user_id] if user_id is not None else (await db.scalars(select(User.id))).all()
+    for current in user_ids:
+        # Отдельная транзакция на пользователя: блокировка его загрузок держится недолго
+        async with async_session() as db:
+            stat = await rebuild_search_index(db, current)
+            await db.commit()
+        print(f"Пользователь {current}: документов в индексе {stat.doc_count}")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--user-id", type=int, help="только для одного пользователя")
+    args = parser.parse_args()
+    asyncio.run(main(args.user_id))
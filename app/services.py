@@ -1,25 +1,61 @@
+import asyncio
+import codecs
+import hashlib
+import io
 import math
-import re
 import heapq
+import struct
+import tarfile
+import time
+import unicodedata
+import zipfile
+from dataclasses import dataclass
 from typing import Optional
 from collections import Counter
 from http import HTTPStatus
 
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import numpy as np
 from fastapi import UploadFile, HTTPException
-from sqlalchemy import select, func
+from sqlalchemy import select, insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app import metrics, tracing, storage, search
+from app.idf import compute_idf, IDF_UPDATE_BATCH
+from app.encoding import Detection, detect_encoding, detect_bytes_encoding, sample_offsets
+from app.tokenizers import get_tokenizer, query_terms
+from app.similarity import DocumentMatrix, similarity_cache, SIMILARITY_BUILD_BATCH
+from app.analysis_pool import analysis_pool
+from app.ranking import top_k, TOP_WORDS_LIMIT, TOP_WORDS_ORDER
+from app.stats_cache import collection_stats_cache, posting_block_cache
+from app.crud import document_crud, term_index_crud, search_crud
+from app.crud.collection_crud import (
+    add_file_to_default_collection, add_files_to_default_collection, get_collection_word_stat
+)
 from app.models.document import FileUpload, WordStat
+from app.models.term_index import DocumentTermVector, SearchIndexStat
 from app.models.user import User
 
 
+# Размер порции при потоковом чтении загружаемого файла
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Сколько символов текста накапливать перед передачей на подсчёт слов в пул процессов
+TOKENIZE_BATCH_SIZE = 1024 * 1024
+
+
 def decode_content(content: bytes) -> str:
-    for encoding in ["utf-8", "windows-1251", "cp1252"]:
-        try:
-            return content.decode(encoding)
-        except UnicodeDecodeError:
-            continue
-    return content.decode("utf-8", errors="ignore")  # fallback
+    """Декодирует файл в кодировке, определённой по выборке (app/encoding.py)."""
+    encoding = detect_bytes_encoding(content).encoding
+    try:
+        return content.decode(encoding)
+    except UnicodeDecodeError:
+        # Выборка не заметила байтов, недопустимых в этой кодировке
+        return content.decode(encoding, errors="replace")
 
 
 async def get_text(file: UploadFile) -> str:
@@ -35,27 +71,520 @@ async def get_text(file: UploadFile) -> str:
     return text
 
 
-def clean_words(text: str) -> list[str]:
-    """Извлекает слова на любом алфавите (русский, английский и др.)."""
-    return re.findall(r'\b[^\W\d_]{2,}\b', text.lower(), flags=re.UNICODE)
+def clean_words(text: str, tokenizer: Optional[str] = None) -> list[str]:
+    """Извлекает слова на любом алфавите (русский, английский и др.) заданным токенизатором."""
+    return get_tokenizer(tokenizer).tokenize(text)
 
 
-def term_frequency(text: str) -> Counter[str]:
-    """Вычисляет Term Frequency (TF) для текста."""
-    words = clean_words(text)
+class StreamingTokenizer:
+    """
+    Делит текст, поступающий порциями, по границам слов.
+    Незавершённое слово в конце порции переносится в следующую,
+    поэтому подсчёт слов по отданным частям совпадает с подсчётом по всему тексту сразу.
+    """
+    def __init__(self):
+        self._tail = ""
 
-    if not words:
+    def feed(self, text: str) -> str:
+        """Принимает очередную порцию и возвращает часть текста, готовую к токенизации."""
+        text = self._tail + text
+        # Режем по последнему символу, не входящему в слово (\W). Комбинируемые знаки (категория M)
+        # остаются со словом: NFC может собрать «и» + бреве в «й» уже после разбиения
+        cut = len(text)
+        while cut and (text[cut - 1].isalnum() or text[cut - 1] == "_"
+                       or unicodedata.category(text[cut - 1]).startswith("M")):
+            cut -= 1
+        self._tail = text[cut:]
+        return text[:cut]
+
+    def close(self) -> str:
+        """Возвращает остаток текста после последней порции."""
+        tail, self._tail = self._tail, ""
+        return tail
+
+
+@dataclass
+class StreamStats:
+    """Показатели потоковой обработки файла."""
+    encoding: str
+    # Признак, по которому выбрана кодировка (bom, ascii, utf-8, cyrillic, latin)
+    detected_by: str = ""
+    bytes_read: int = 0
+    elapsed: float = 0.0
+    peak_rss_kb: Optional[int] = None
+
+    @property
+    def bytes_per_sec(self) -> float:
+        return self.bytes_read / self.elapsed if self.elapsed else 0.0
+
+
+def peak_rss_kb() -> Optional[int]:
+    """Пиковое потребление памяти процессом (КБ), если платформа это поддерживает."""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+async def _tokenize_stream(file: UploadFile, encoding: str, errors: str, keep_text: bool, tokenizer: Optional[str]):
+    """Один проход по файлу с инкрементальным декодером заданной кодировки."""
+    await file.seek(0)
+    decoder = codecs.getincrementaldecoder(encoding)(errors=errors)
+    splitter = StreamingTokenizer()
+    counts: Counter[str] = Counter()
+    parts = [] if keep_text else None
+    batch, batch_size = [], 0
+    stats = StreamStats(encoding=encoding)
+    started = time.perf_counter()
+
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        stats.bytes_read += len(chunk)
+        text = decoder.decode(chunk)
+        if keep_text:
+            parts.append(text)
+
+        batch.append(splitter.feed(text))
+        batch_size += len(text)
+        # Подсчёт слов отправляется в пул процессов пакетами, чтобы не платить за передачу каждой порции
+        if batch_size >= TOKENIZE_BATCH_SIZE:
+            counts.update(await analysis_pool.run(word_counts, "".join(batch), tokenizer))
+            batch, batch_size = [], 0
+
+    text = decoder.decode(b"", final=True)
+    if keep_text:
+        parts.append(text)
+    batch.append(splitter.feed(text))
+    batch.append(splitter.close())
+    counts.update(await analysis_pool.run(word_counts, "".join(batch), tokenizer))
+
+    stats.elapsed = time.perf_counter() - started
+    stats.peak_rss_kb = peak_rss_kb()
+    return counts, "".join(parts) if keep_text else None, stats
+
+
+async def detect_upload_encoding(file: UploadFile) -> Detection:
+    """Определяет кодировку по нескольким блокам файла, не читая его целиком."""
+    file.file.seek(0, io.SEEK_END)
+    size = file.file.tell()
+    blocks = []
+    for offset, length in sample_offsets(size):
+        await file.seek(offset)
+        blocks.append(await file.read(length))
+    return detect_encoding(blocks)
+
+
+async def tokenize_upload(
+    file: UploadFile,
+    keep_text: bool = True,
+    tokenizer: Optional[str] = None
+) -> tuple[Counter[str], Optional[str], StreamStats]:
+    """
+    Потоково читает файл порциями по UPLOAD_CHUNK_SIZE и считает слова.
+    Кодировка определяется один раз по выборке блоков (detect_upload_encoding), файл читается
+    одним проходом. Если дальше в файле встретились байты, недопустимые в этой кодировке,
+    файл перечитывается в той же кодировке с заменой таких байтов на U+FFFD.
+
+    :param keep_text: собрать ли декодированный текст (нужен для сохранения документа)
+    :param tokenizer: имя токенизатора (None — по умолчанию)
+    :return: (количество вхождений слов, текст или None, показатели обработки)
+    """
+    try:
+        with metrics.tokenize_duration.time(), tracing.span("tokenize", filename=file.filename):
+            with tracing.span("tokenize.detect_encoding") as span:
+                detection = await detect_upload_encoding(file)
+                if span:
+                    span.set(encoding=detection.encoding, detected_by=detection.reason)
+            try:
+                counts, text, stats = await _tokenize_stream(file, detection.encoding, "strict", keep_text, tokenizer)
+            except UnicodeDecodeError:
+                counts, text, stats = await _tokenize_stream(file, detection.encoding, "replace", keep_text, tokenizer)
+            stats.detected_by = detection.reason
+            return counts, text, stats
+    except HTTPException:
+        raise
+    except Exception:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="Не удалось прочитать файл")
+    finally:
+        await file.close()
+
+
+def word_counts(text: str, tokenizer: Optional[str] = None) -> Counter[str]:
+    """Подсчитывает количество вхождений каждого слова в тексте."""
+    return get_tokenizer(tokenizer).count(text)
+
+
+def frequencies(word_counts: Counter[str]) -> Counter[str]:
+    """Нормализует количества вхождений слов в Term Frequency (TF)."""
+    if not word_counts:
         raise HTTPException(
             status_code=HTTPStatus.BAD_REQUEST,
             detail="Файл не содержит допустимого текста"
         )
 
-    word_counts = Counter(words)
     total_words = sum(word_counts.values())
 
     # Возвращаем нормализованную частоту
     return Counter({word: count / total_words for word, count in word_counts.items()})
 
+
+def term_frequency(text: str) -> Counter[str]:
+    """Вычисляет Term Frequency (TF) для текста."""
+    return frequencies(word_counts(text))
+
+async def rebuild_term_index(db: AsyncSession, user_id: int) -> int:
+    """
+    Строит индекс документной частоты по уже загруженным документам пользователя.
+
+    :return: количество документов пользователя
+    """
+    result = await db.stream(
+        select(FileUpload.content, FileUpload.content_ref, FileUpload.tokenizer).where(FileUpload.user_id == user_id)
+    )
+    doc_counts = Counter()
+    total_docs = 0
+    async for content, content_ref, tokenizer in result:
+        if content_ref:
+            content = await storage.load_text(content_ref)
+        doc_counts.update(word_counts(content or "", tokenizer).keys())
+        total_docs += 1
+
+    await term_index_crud.replace_user_term_index(db, user_id, total_docs, doc_counts)
+    return total_docs
+
+
+async def ensure_term_index(db: AsyncSession, user_id: int) -> int:
+    """
+    Возвращает количество документов пользователя из индекса.
+    Если индекс ещё не построен (документы загружены до его появления), строит его.
+    """
+    total_docs = await term_index_crud.get_document_count(db, user_id)
+    if total_docs is None:
+        total_docs = await rebuild_term_index(db, user_id)
+    return total_docs
+
+
+async def register_document_terms(db: AsyncSession, user: User, words: list[str]) -> dict[str, float]:
+    """
+    Учитывает новый документ в индексе одним пакетным upsert и возвращает IDF его слов.
+
+    Сам документ входит в N, но не в n_i, как и при подсчёте до его сохранения:
+    после upsert doc_count уже равен 1 + n_i.
+    """
+    with metrics.idf_query_duration.time():
+        total_docs, doc_counts = await term_index_crud.register_document_terms(db, user.id, words)
+    return {word: math.log10(total_docs / doc_counts[word]) for word in words}
+
+
+async def document_text(db: AsyncSession, file: FileUpload) -> str:
+    """Текст документа: из хранилища или, для документов, загруженных до него, из fileuploads.content."""
+    if file.content_ref:
+        return await storage.load_text(file.content_ref)
+    return await document_crud.get_file_content(db, file.id) or ""
+
+
+async def document_vocabulary(db: AsyncSession, file: FileUpload) -> set[str]:
+    """Возвращает все слова документа: из сохранённого вектора или, для старых документов, из текста."""
+    vectors = await term_index_crud.get_term_vectors(db, [file.id])
+    if not vectors:
+        return set(clean_words(await document_text(db, file), file.tokenizer))
+
+    term_ids, _ = term_index_crud.unpack_term_vector(vectors[0])
+    words = await term_index_crud.get_words_by_ids(db, term_ids)
+    return set(words.values())
+
+
+async def unregister_document_terms(db: AsyncSession, file: FileUpload) -> None:
+    """Убирает удаляемый документ из индекса документной частоты."""
+    await ensure_term_index(db, file.user_id)
+    words = await document_vocabulary(db, file)
+    await term_index_crud.unregister_document_terms(db, file.user_id, words)
+
+
+async def document_word_stat(db: AsyncSession, file: FileUpload, user: User) -> list[dict] | None:
+    """
+    Возвращает TF/IDF для всех слов документа по его полному вектору, по убыванию IDF.
+    Для документов без сохранённого вектора возвращает None.
+    """
+    with tracing.span("statistics.term_vector"):
+        vectors = await term_index_crud.get_term_vectors(db, [file.id])
+        if not vectors:
+            return None
+
+        vector = vectors[0]
+        term_ids, counts = term_index_crud.unpack_term_vector(vector)
+        words = await term_index_crud.get_words_by_ids(db, term_ids)
+        tf = {words[term_id]: count / vector.total_words for term_id, count in zip(term_ids, counts)}
+
+    return await rank_words_by_idf(db, user, tf)
+
+
+def select_top_words(
+    tf: dict[str, float],
+    idf_map: dict[str, float],
+    limit: int = TOP_WORDS_LIMIT,
+    order: str = TOP_WORDS_ORDER
+) -> list[str]:
+    """Отбирает слова документа для WordStat по IDF, при равенстве — по TF (по умолчанию по возрастанию)."""
+    return top_k(tf, key=lambda word: (idf_map.get(word, 0.0), tf[word]), limit=limit, descending=order == "desc")
+
+
+async def ingest_document(
+    db: AsyncSession,
+    user: User,
+    filename: str,
+    counts: Counter[str],
+    text: str,
+    tokenizer: Optional[str] = None,
+    encoding: Optional[str] = None
+) -> FileUpload:
+    """
+    Сохраняет документ: TF/IDF, 50 слов в WordStat, полный вектор и добавление в коллекцию.
+    tokenizer — имя токенизатора, которым посчитаны counts, encoding — определённая кодировка файла.
+    Фиксация транзакции остаётся за вызывающим кодом.
+    """
+    tf = frequencies(counts)
+
+    # Индекс документной частоты должен существовать до сохранения нового документа
+    with tracing.span("ingest.ensure_index"):
+        await ensure_term_index(db, user.id)
+
+    with tracing.span("ingest.store_content", chars=len(text)):
+        content_ref, content_size = await storage.save_text(text)
+
+    with tracing.span("ingest.insert_document"):
+        file_upload = FileUpload(
+            user_id=user.id,
+            filename=filename,
+            content_ref=content_ref,
+            content_size=content_size,
+            unique_words=len(tf),
+            tokenizer=get_tokenizer(tokenizer).name,
+            encoding=encoding
+        )
+        db.add(file_upload)
+        await db.flush()  # получить ID
+
+    words_all = list(tf.keys())
+    with tracing.span("ingest.idf", words=len(words_all)):
+        idf_map = await register_document_terms(db, user, words_all)
+
+    with tracing.span("ingest.word_stat"):
+        selected_words = select_top_words(tf, idf_map)
+        word_stat = [
+            WordStat(
+                file_id=file_upload.id,
+                user_id=user.id,
+                word=word,
+                tf=tf[word],
+                idf=idf_map.get(word, 0.0)
+            )
+            for word in selected_words
+        ]
+        db.add_all(word_stat)
+
+    # Полный вектор документа: все слова, а не только отобранные 50
+    with tracing.span("ingest.term_vector"):
+        vector = await term_index_crud.save_term_vector(db, file_upload.id, counts)
+
+    with tracing.span("ingest.search_index"):
+        await index_documents(db, user.id, [vector])
+
+    with tracing.span("ingest.default_collection"):
+        await add_file_to_default_collection(db, file_upload, user)
+    metrics.documents_created.inc()
+    return file_upload
+
+
+async def ingest_documents(
+    db: AsyncSession,
+    user: User,
+    documents: list[tuple[str, Counter[str], str, Optional[str]]],
+    tokenizer: Optional[str] = None
+) -> list[int]:
+    """
+    Пакетно сохраняет документы (имя файла, количества слов, текст, кодировка), разобранные токенизатором tokenizer.
+    IDF считается один раз по корпусу пользователя с учётом всей пачки,
+    все строки пишутся многострочными INSERT. Фиксация транзакции остаётся за вызывающим кодом.
+
+    :return: id созданных документов в порядке documents
+    """
+    with tracing.span("ingest.ensure_index"):
+        await ensure_term_index(db, user.id)
+
+    with tracing.span("ingest.store_content", documents=len(documents)):
+        stored = await asyncio.gather(*(storage.save_text(text) for _, _, text, _ in documents))
+
+    with tracing.span("ingest.insert_documents", documents=len(documents)):
+        result = await db.execute(
+            insert(FileUpload).returning(FileUpload.id, sort_by_parameter_order=True),
+            [
+                {
+                    "user_id": user.id,
+                    "filename": filename,
+                    "content_ref": content_ref,
+                    "content_size": content_size,
+                    "unique_words": len(counts),
+                    "tokenizer": get_tokenizer(tokenizer).name,
+                    "encoding": encoding
+                }
+                for (filename, counts, _, encoding), (content_ref, content_size) in zip(documents, stored)
+            ]
+        )
+        file_ids = result.scalars().all()
+
+    # Частота слов в пачке: в скольких новых документах встречается каждое слово
+    batch_doc_counts = Counter()
+    for _, counts, _, _ in documents:
+        batch_doc_counts.update(counts.keys())
+    with metrics.idf_query_duration.time(), tracing.span("ingest.idf", words=len(batch_doc_counts)):
+        total_docs, doc_counts = await term_index_crud.register_documents_terms(
+            db, user.id, len(documents), batch_doc_counts
+        )
+    # doc_count уже учитывает сам документ, т.е. равен 1 + n_i, как и при загрузке по одному
+    idf_map = {word: math.log10(total_docs / doc_count) for word, doc_count in doc_counts.items()}
+
+    with tracing.span("ingest.word_stat"):
+        word_stat = []
+        for file_id, (_, counts, _, _) in zip(file_ids, documents):
+            tf = frequencies(counts)
+            word_stat.extend(
+                {"file_id": file_id, "user_id": user.id, "word": word, "tf": tf[word], "idf": idf_map[word]}
+                for word in select_top_words(tf, idf_map)
+            )
+        await db.execute(insert(WordStat), word_stat)
+
+    with tracing.span("ingest.term_vector"):
+        vectors = await term_index_crud.save_term_vectors(
+            db, {file_id: counts for file_id, (_, counts, _, _) in zip(file_ids, documents)}
+        )
+    with tracing.span("ingest.search_index"):
+        await index_documents(db, user.id, vectors)
+    with tracing.span("ingest.default_collection"):
+        await add_files_to_default_collection(db, file_ids, user)
+    metrics.documents_created.inc(len(file_ids))
+    return file_ids
+
+
+# Ограничения распаковки архивов в пакетной загрузке (защита от zip/tar-бомб)
+ARCHIVE_MAX_MEMBERS = 1000
+ARCHIVE_MAX_MEMBER_SIZE = 50 * 1024 * 1024
+ARCHIVE_MAX_TOTAL_SIZE = 200 * 1024 * 1024
+ARCHIVE_MAX_RATIO = 100
+
+
+def archive_limit_exceeded(filename: str, reason: str) -> HTTPException:
+    return HTTPException(
+        status_code=HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+        detail=f"Архив {filename} превышает допустимые размеры: {reason}"
+    )
+
+
+def read_archive_member(stream, limit: int, filename: str) -> bytes:
+    """
+    Читает файл из архива порциями, не более limit байт.
+    Заявленный в заголовке архива размер может не совпадать с реальным, поэтому
+    ограничение проверяется по фактически распакованным данным.
+    """
+    buffer = io.BytesIO()
+    while chunk := stream.read(min(UPLOAD_CHUNK_SIZE, limit - buffer.tell() + 1)):
+        buffer.write(chunk)
+        if buffer.tell() > limit:
+            raise archive_limit_exceeded(filename, "размер распакованных данных")
+    return buffer.getvalue()
+
+
+def expand_archive(file: UploadFile) -> list[UploadFile]:
+    """
+    Раскрывает zip/tar-архив в список файлов. Обычный файл возвращается как есть.
+    Количество файлов, их размер, общий объём распакованных данных и степень сжатия
+    ограничены (ARCHIVE_MAX_*); при превышении отвечает 413.
+    Распаковка синхронная — вызывать через asyncio.to_thread.
+    """
+    name = (file.filename or "").lower()
+    archive_size = max(file.size or 0, 1)
+    members: list[UploadFile] = []
+    total_size = 0
+
+    def take(member_name: str, declared_size: int, open_member) -> None:
+        nonlocal total_size
+        if len(members) >= ARCHIVE_MAX_MEMBERS:
+            raise archive_limit_exceeded(file.filename, "количество файлов")
+        if declared_size > ARCHIVE_MAX_MEMBER_SIZE:
+            raise archive_limit_exceeded(file.filename, f"размер файла {member_name}")
+        budget = min(ARCHIVE_MAX_MEMBER_SIZE, ARCHIVE_MAX_TOTAL_SIZE - total_size,
+                     archive_size * ARCHIVE_MAX_RATIO - total_size)
+        if declared_size > budget:
+            raise archive_limit_exceeded(file.filename, "общий размер или степень сжатия")
+        with open_member() as stream:
+            content = read_archive_member(stream, budget, file.filename)
+        total_size += len(content)
+        members.append(UploadFile(io.BytesIO(content), filename=member_name))
+
+    if name.endswith(".zip"):
+        with zipfile.ZipFile(file.file) as archive:
+            for member in archive.infolist():
+                if member.is_dir():
+                    continue
+                if member.file_size > max(member.compress_size, 1) * ARCHIVE_MAX_RATIO:
+                    raise archive_limit_exceeded(file.filename, f"степень сжатия {member.filename}")
+                take(member.filename, member.file_size, lambda member=member: archive.open(member))
+        return members
+    if name.endswith((".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")):
+        with tarfile.open(fileobj=file.file, mode="r:*") as archive:
+            # Итерация по архиву, а не getmembers(): заголовки читаются, пока не превышен лимит
+            for member in archive:
+                if member.isfile():
+                    take(member.name, member.size, lambda member=member: archive.extractfile(member))
+        return members
+    return [file]
+
+
+async def rank_words_by_idf(
+    db: AsyncSession,
+    user: User,
+    tf: dict[str, float],
+    limit: Optional[int] = None,
+    order: str = "desc"
+) -> list[dict]:
+    """
+    Считает IDF для слов с их TF и отбирает limit слов по IDF на стороне БД.
+    Слова передаются массивами и соединяются с индексом документной частоты через unnest,
+    поэтому размер запроса не зависит от размера словаря.
+    """
+    total_docs = await ensure_term_index(db, user.id)
+    if not tf:
+        return []
+    with metrics.idf_query_duration.time(), tracing.span("statistics.idf", words=len(tf)):
+        return await term_index_crud.rank_words_by_idf(db, user.id, total_docs, tf, limit, order == "desc")
+
+
+async def collection_statistics(db: AsyncSession, user: User, collection_id: int) -> list[dict]:
+    """
+    TF/IDF по всем словам коллекции, по убыванию IDF.
+    Результат кэшируется до следующего изменения документов или коллекций пользователя:
+    при попадании в кэш выполняется только чтение версии корпуса по первичному ключу.
+    """
+    with tracing.span("statistics.cache_lookup") as lookup:
+        version = await term_index_crud.get_corpus_version(db, user.id)
+        cached = collection_stats_cache.get((user.id, collection_id), version) if version is not None else None
+        if lookup:
+            lookup.set(hit=cached is not None)
+    if cached is not None:
+        return cached
+
+    with tracing.span("statistics.collection_word_stat"):
+        stats = await get_collection_word_stat(db, collection_id, user)
+    ranked = await rank_words_by_idf(db, user, {s["word"]: s["tf"] for s in stats})
+
+    # Кэшируем под версией, прочитанной до подсчёта: загрузка, закоммиченная во время
+    # подсчёта, поднимет версию и не даст устаревшему результату попасть под новую.
+    # Перечитываем только если индекса не было и он построен только что
+    if version is None:
+        version = await term_index_crud.get_corpus_version(db, user.id)
+    if version is not None:
+        collection_stats_cache.put((user.id, collection_id), version, ranked)
+    return ranked
+
+
 async def inverse_document_frequency(db: AsyncSession, user: User, words: list[str]) -> dict[str, float]:
     """
     Вычисляет IDF для списка слов по документам конкретного пользователя.
@@ -65,27 +594,15 @@ async def inverse_document_frequency(db: AsyncSession, user: User, words: list[s
     :param words: список слов для подсчёта IDF
     :return: словарь {слово: idf}
     """
-    # Получаем количество документов текущего пользователя
-    total_docs_res = await db.execute(
-        select(func.count(FileUpload.id)).where(FileUpload.user_id == user.id)
-    )
-    total_docs = total_docs_res.scalar_one()
+    # Количество документов пользователя хранится в счётчике, а не считается по fileuploads
+    total_docs = await ensure_term_index(db, user.id)
 
     if total_docs == 0:
         return {word: 0.0 for word in words}
 
-    # Считаем, в скольких документах пользователя встречается каждое слово
-    result = await db.execute(
-        select(
-            WordStat.word,
-            func.count(func.distinct(WordStat.file_id)).label("doc_count")
-        ).where(
-            WordStat.word.in_(words),
-            WordStat.user_id == user.id
-        ).group_by(WordStat.word)
-    )
-
-    word_doc_counts = {row.word: row.doc_count for row in result}
+    # Документная частота слов — поиск по первичному ключу (user_id, word)
+    with metrics.idf_query_duration.time():
+        word_doc_counts = await term_index_crud.get_document_frequencies(db, user.id, words)
 
     # IDF по формуле log10(N / (1 + n_i)), где N — общее число документов пользователя
     idf_scores = {}
@@ -94,6 +611,264 @@ async def inverse_document_frequency(db: AsyncSession, user: User, words: list[s
         idf_scores[word] = math.log10(total_docs / (1 + doc_count))
     return idf_scores
 
+
+async def recompute_user_idf(db: AsyncSession, user_id: int, force: bool = False) -> int:
+    """
+    Пересчитывает сохранённые IDF во всей статистике пользователя по текущему корпусу.
+    Возвращает число обновлённых строк word_stat; если корпус не менялся с прошлого пересчёта
+    (и не задан force), ничего не делает.
+
+    Версия корпуса читается до подсчёта: загрузка, зафиксированная во время пересчёта,
+    увеличит её, и следующий пересчёт пользователя не пропустит.
+    """
+    await ensure_term_index(db, user_id)
+    stats = await term_index_crud.get_stale_idf_users(db, user_id, force)
+    if not stats:
+        return 0
+    stat = stats[0]
+
+    with metrics.idf_recompute_duration.time():
+        with tracing.span("idf_recompute.load") as span:
+            words, doc_counts = await term_index_crud.get_all_document_frequencies(db, user_id)
+            if span:
+                span.set(words=len(words))
+        idf_values = compute_idf(stat.doc_count, np.fromiter(doc_counts, dtype=np.int64, count=len(doc_counts)))
+
+        updated = 0
+        with tracing.span("idf_recompute.update") as span:
+            for offset in range(0, len(words), IDF_UPDATE_BATCH):
+                updated += await document_crud.update_word_stat_idf(
+                    db,
+                    user_id,
+                    words[offset:offset + IDF_UPDATE_BATCH],
+                    idf_values[offset:offset + IDF_UPDATE_BATCH].tolist()
+                )
+            if span:
+                span.set(rows=updated)
+        await term_index_crud.set_idf_version(db, user_id, stat.version)
+    return updated
+
+# === ПОИСК ===
+
+def _collect_postings(postings: dict[int, list[tuple[int, int, int]]], vector) -> None:
+    """Добавляет вхождения слов документа (вектор или строка с теми же полями) в списки по словам."""
+    norm = search.encode_norm(vector.total_words)
+    term_ids, counts = term_index_crud.unpack_term_vector(vector)
+    for term_id, count in zip(term_ids, counts):
+        postings.setdefault(term_id, []).append((vector.file_id, int(count), norm))
+
+
+async def index_documents(db: AsyncSession, user_id: int, vectors: list[DocumentTermVector]) -> None:
+    """
+    Дописывает новые документы в поисковый индекс пользователя.
+    Вызывается после учёта документов в индексе документной частоты: его upsert держит блокировку
+    счётчиков корпуса до конца транзакции, поэтому загрузки одного пользователя дописывают блоки по очереди.
+    Если индекс ещё не построен, документы попадут в него при построении на первом поиске.
+    """
+    if await search_crud.get_index_stat(db, user_id) is None:
+        # Первые документы пользователя: индекс ведётся с самого начала и не требует построения
+        if await term_index_crud.get_document_count(db, user_id) != len(vectors):
+            return
+        await search_crud.create_index_stat(db, user_id)
+
+    postings: dict[int, list[tuple[int, int, int]]] = {}
+    for vector in sorted(vectors, key=lambda v: v.file_id):
+        _collect_postings(postings, vector)
+
+    tails = await search_crud.get_tail_blocks(db, user_id, postings.keys())
+    await search_crud.append_postings(db, user_id, search.plan_appends(postings, tails))
+    await search_crud.add_documents(db, user_id, len(vectors), sum(v.total_words for v in vectors))
+
+
+async def unindex_document(db: AsyncSession, file: FileUpload) -> None:
+    """Учитывает удаление документа в поисковом индексе; его вхождения убираются при перестроении."""
+    if await search_crud.get_index_stat(db, file.user_id) is None:
+        return
+    vectors = await term_index_crud.get_term_vectors(db, [file.id])
+    # Документ без вектора в индекс не попадал
+    if vectors:
+        await search_crud.mark_document_deleted(db, file.user_id, vectors[0].total_words)
+
+
+async def rebuild_search_index(db: AsyncSession, user_id: int) -> SearchIndexStat:
+    """
+    Строит поисковый индекс пользователя заново по векторам документов.
+    Для документов, загруженных до появления векторов, векторы предварительно строятся из текста.
+    Выполняется фоновым воркером или командой python -m app.search rebuild, не в запросе:
+    на время перестроения блокируются загрузки и удаления документов пользователя.
+    """
+    await ensure_term_index(db, user_id)
+    # Загрузки пользователя ждут окончания перестроения и не теряют документы
+    await term_index_crud.lock_corpus(db, user_id)
+
+    for file in await term_index_crud.get_files_without_vectors(db, user_id):
+        await term_index_crud.save_term_vector(db, file.id, word_counts(await document_text(db, file), file.tokenizer))
+    await db.flush()
+
+    postings: dict[int, list[tuple[int, int, int]]] = {}
+    doc_count = total_words = 0
+    async for row in await term_index_crud.stream_user_term_vectors(db, user_id):
+        _collect_postings(postings, row)
+        doc_count += 1
+        total_words += row.total_words
+
+    stat = await search_crud.replace_index(db, user_id, search.plan_appends(postings, {}), doc_count, total_words)
+    await search_crud.delete_rebuild_request(db, user_id)
+    return stat
+
+
+def search_index_outdated(stat: Optional[SearchIndexStat]) -> bool:
+    """Индекс не построен или удалённых документов в нём слишком много."""
+    return stat is None or stat.deleted_docs > max(stat.doc_count, 1) * search.SEARCH_COMPACT_RATIO
+
+
+async def load_posting_blocks(
+    db: AsyncSession,
+    user_id: int,
+    generation: int,
+    term_ids
+) -> dict[int, list[search.PostingBlock]]:
+    """
+    Блоки списков вхождений для слов запроса. Сначала читается только состав блоков,
+    данные загружаются и декодируются лишь для блоков, которых нет в кэше или которые выросли.
+    """
+    blocks: dict[int, list[search.PostingBlock]] = {}
+    missing = []
+    for term_id, block, doc_count in await search_crud.get_block_versions(db, user_id, term_ids):
+        cached = posting_block_cache.get((user_id, term_id, block), (generation, doc_count))
+        if cached is None:
+            missing.append((term_id, block))
+        else:
+            blocks.setdefault(term_id, []).append(cached)
+
+    if missing:
+        for row in await search_crud.get_blocks(db, user_id, missing):
+            decoded = search.decode_block(row.doc_ids, row.counts, row.norms)
+            posting_block_cache.put((user_id, row.term_id, row.block), (generation, row.doc_count), decoded)
+            blocks.setdefault(row.term_id, []).append(decoded)
+    return blocks
+
+
+async def search_documents(db: AsyncSession, user: User, query: str, limit: int, offset: int = 0) -> dict:
+    """
+    Ищет документы пользователя по словам запроса и ранжирует их по BM25.
+    IDF слова — log10(N / n_i), как при загрузке документа. total приблизителен,
+    пока в индексе остаются вхождения удалённых документов.
+    Поиск идёт по текущему индексу; если его нужно построить или перестроить, оставляется запрос
+    фоновому воркеру (index_pending), а до построения индекса результат пустой.
+    """
+    result = {"query": query, "total": 0, "results": [], "index_pending": False}
+    words = query_terms(query)
+    if not words:
+        return result
+
+    with metrics.search_query_duration.time():
+        stat = await search_crud.get_index_stat(db, user.id)
+        if search_index_outdated(stat):
+            await search_crud.request_rebuild(db, user.id)
+            result["index_pending"] = True
+        if stat is None:
+            return result
+        total_docs = await term_index_crud.get_document_count(db, user.id) or 0
+        word_ids = await term_index_crud.get_word_ids(db, words)
+        doc_counts = await term_index_crud.get_document_frequencies(db, user.id, word_ids.keys())
+        idf = {
+            word_ids[word]: max(math.log10(total_docs / doc_count), 0.0)
+            for word, doc_count in doc_counts.items()
+            if doc_count > 0
+        }
+        if not idf:
+            return result
+
+        with tracing.span("search.postings", terms=len(idf)):
+            blocks = await load_posting_blocks(db, user.id, stat.generation, idf.keys())
+        with tracing.span("search.score") as span:
+            avgdl = stat.total_words / stat.doc_count if stat.doc_count else 0.0
+            scores = search.bm25_scores(blocks, idf, avgdl)
+            # Вхождения удалённых документов ещё в индексе, поэтому кандидаты берутся с запасом
+            ranked = heapq.nlargest(
+                offset + limit + stat.deleted_docs, scores.items(), key=lambda item: (item[1], item[0])
+            )
+            if span:
+                span.set(matched=len(scores))
+
+        names = await search_crud.get_document_names(db, user.id, [doc_id for doc_id, _ in ranked])
+        live = [(doc_id, score) for doc_id, score in ranked if doc_id in names]
+        result["total"] = len(scores) - (len(ranked) - len(live))
+        result["results"] = [
+            {"document_id": doc_id, "filename": names[doc_id], "score": score}
+            for doc_id, score in live[offset:offset + limit]
+        ]
+    return result
+
+
+# === ПОХОЖИЕ ДОКУМЕНТЫ ===
+
+async def load_document_matrix(db: AsyncSession, user_id: int) -> DocumentMatrix:
+    """
+    Матрица TF-IDF документов пользователя, сверенная с БД.
+    Из кэша берётся как есть, если версия корпуса не менялась; иначе дописываются
+    новые документы и отмечаются удалённые. С нуля строится только при промахе кэша.
+    """
+    version = await term_index_crud.get_corpus_version(db, user_id)
+    matrix = similarity_cache.get(user_id)
+    if matrix is not None and matrix.version == version:
+        return matrix
+
+    if matrix is None:
+        with tracing.span("similarity.build") as span:
+            matrix = DocumentMatrix()
+            result = await term_index_crud.stream_user_term_vectors(db, user_id)
+            async for rows in result.partitions(SIMILARITY_BUILD_BATCH):
+                matrix.append(rows)
+            matrix.skipped.update(
+                file.id for file in await term_index_crud.get_files_without_vectors(db, user_id)
+            )
+            matrix.reweight()
+            if span:
+                span.set(documents=matrix.doc_count)
+    else:
+        with tracing.span("similarity.sync") as span:
+            # Сравниваются множества id, а не максимальный id: загрузки фиксируются не по порядку id
+            file_ids = set(await document_crud.get_user_file_ids(db, user_id))
+            known = matrix.rows.keys() | matrix.skipped
+            added = file_ids - known
+            removed = known - file_ids
+            matrix.remove(removed)
+            matrix.skipped -= removed
+            if added:
+                vectors = await term_index_crud.get_term_vectors(db, added)
+                matrix.append(sorted(vectors, key=lambda vector: vector.file_id))
+                matrix.skipped.update(added - {vector.file_id for vector in vectors})
+            if matrix.needs_reweight():
+                matrix.reweight()
+            if span:
+                span.set(added=len(added), removed=len(removed))
+
+    matrix.version = version
+    similarity_cache.put(user_id, matrix)
+    return matrix
+
+
+async def similar_documents(db: AsyncSession, user_id: int, file_id: int, limit: int) -> list[dict]:
+    """
+    Документы пользователя, наиболее похожие на данный, по косинусному сходству TF-IDF векторов.
+    Документ без сохранённого вектора (загружен до их появления) похожих не имеет.
+    """
+    with metrics.similarity_query_duration.time():
+        matrix = await load_document_matrix(db, user_id)
+        with tracing.span("similarity.score", documents=matrix.doc_count):
+            ranked = matrix.similar(file_id, limit) or []
+        if not ranked:
+            return []
+        names = await search_crud.get_document_names(db, user_id, [doc_id for doc_id, _ in ranked])
+    return [
+        {"document_id": doc_id, "filename": names[doc_id], "score": score}
+        for doc_id, score in ranked
+        if doc_id in names
+    ]
+
+
 class HuffmanNode:
     def __init__(self, char: Optional[str], freq: int):
         self.char = char
@@ -105,10 +880,10 @@ class HuffmanNode:
         return self.freq < other.freq
 
 
-def build_huffman_tree(text: str) -> HuffmanNode:
-    frequency = {}
-    for char in text:
-        frequency[char] = frequency.get(char, 0) + 1
+def build_huffman_tree(text: str) -> Optional[HuffmanNode]:
+    frequency = Counter(text)
+    if not frequency:
+        return None
 
     heap = [HuffmanNode(char, freq) for char, freq in frequency.items()]
     heapq.heapify(heap)
@@ -129,17 +904,240 @@ def generate_codes(node: HuffmanNode, prefix: str = "", code_map: Optional[dict]
     if code_map is None:
         code_map = {}
 
-    if node.char is not None:
-        code_map[node.char] = prefix
-    else:
-        generate_codes(node.left, prefix + "0", code_map)
-        generate_codes(node.right, prefix + "1", code_map)
+    # Обход со стеком вместо рекурсии: глубина дерева не ограничена лимитом рекурсии
+    stack = [(node, prefix)]
+    while stack:
+        node, prefix = stack.pop()
+        if node.char is not None:
+            code_map[node.char] = prefix
+        else:
+            stack.append((node.right, prefix + "1"))
+            stack.append((node.left, prefix + "0"))
 
     return code_map
 
 
 def huffman_encode(text: str) -> tuple[str, dict]:
     root = build_huffman_tree(text)
+    if root is None:
+        return "", {}
     codes = generate_codes(root)
     encoded = ''.join(codes[char] for char in text)
-    return encoded, codes
\ No newline at end of file
+    return encoded, codes
+
+
+async def document_huffman_code(db: AsyncSession, file: FileUpload) -> tuple[str, bytes]:
+    """
+    Возвращает (хэш содержимого, двоичный код Хаффмана) документа.
+    Код вычисляется один раз при первом запросе и дальше читается из huffman_cache.
+    """
+    cache = await document_crud.get_huffman_cache(db, file.id)
+    if cache is not None:
+        return cache.content_hash, cache.encoded
+
+    text = await document_text(db, file)
+    # Для текста из хранилища хэш уже известен из ссылки на объект
+    if file.content_ref:
+        content_hash = storage.ref_digest(file.content_ref)
+    else:
+        content_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    with metrics.huffman_encode_duration.time(), tracing.span("huffman.encode", chars=len(text)):
+        encoded = await analysis_pool.run(huffman_encode_binary, text)
+    await document_crud.save_huffman_cache(db, file.id, content_hash, encoded)
+    return content_hash, encoded
+
+
+# === ДВОИЧНЫЙ КОД ХАФФМАНА ===
+# Формат: заголовок HUFFMAN_MAGIC, число символов (uint32), длина кода в битах (uint64),
+# затем для каждого символа его код Unicode (uint32) и длина кода (uint8).
+# Коды канонические, поэтому для декодирования достаточно длин. Следом идут упакованные биты,
+# последний байт дополняется нулями.
+
+HUFFMAN_MAGIC = b"HUF1"
+HUFFMAN_HEADER = struct.Struct(">4sIQ")
+HUFFMAN_SYMBOL = struct.Struct(">IB")
+
+# Сколько символов текста кодируется за один шаг упаковки
+HUFFMAN_CHUNK_SIZE = 64 * 1024
+
+# Предельный размер двоичного кода, принимаемого на декодирование
+HUFFMAN_DECODE_MAX_SIZE = 8 * 1024 * 1024
+
+
+def huffman_code_lengths(frequency: dict[str, int]) -> dict[str, int]:
+    """Длины кодов Хаффмана для символов; дерево строится и обходится без рекурсии."""
+    if not frequency:
+        return {}
+    if len(frequency) == 1:
+        return {char: 1 for char in frequency}
+
+    # Узлы: листья — символы, внутренние — пары индексов потомков
+    children: list[Optional[tuple[int, int]]] = []
+    symbols: list[Optional[str]] = []
+    heap = []
+    for order, (char, freq) in enumerate(sorted(frequency.items())):
+        children.append(None)
+        symbols.append(char)
+        heap.append((freq, order, order))
+    heapq.heapify(heap)
+
+    order = len(heap)
+    while len(heap) > 1:
+        freq1, _, node1 = heapq.heappop(heap)
+        freq2, _, node2 = heapq.heappop(heap)
+        children.append((node1, node2))
+        symbols.append(None)
+        heapq.heappush(heap, (freq1 + freq2, order, len(children) - 1))
+        order += 1
+
+    lengths = {}
+    stack = [(heap[0][2], 0)]
+    while stack:
+        node, depth = stack.pop()
+        if children[node] is None:
+            lengths[symbols[node]] = depth
+        else:
+            stack.append((children[node][0], depth + 1))
+            stack.append((children[node][1], depth + 1))
+    return lengths
+
+
+def canonical_codes(lengths: dict[str, int]) -> dict[str, str]:
+    """Канонические коды по длинам: символы упорядочены по (длина, код символа)."""
+    codes = {}
+    code = 0
+    previous_length = 0
+    for char, length in sorted(lengths.items(), key=lambda item: (item[1], item[0])):
+        code <<= length - previous_length
+        codes[char] = format(code, f"0{length}b")
+        code += 1
+        previous_length = length
+    return codes
+
+
+def huffman_header(lengths: dict[str, int], bit_length: int) -> bytes:
+    """Заголовок двоичного кода: таблица длин кодов и общая длина в битах."""
+    header = bytearray(HUFFMAN_HEADER.pack(HUFFMAN_MAGIC, len(lengths), bit_length))
+    for char, length in sorted(lengths.items(), key=lambda item: (item[1], item[0])):
+        header += HUFFMAN_SYMBOL.pack(ord(char), length)
+    return bytes(header)
+
+
+def pack_huffman_bits(text: str, codes: dict[str, str]) -> bytearray:
+    """Упаковывает коды символов в байты; текст обрабатывается порциями по HUFFMAN_CHUNK_SIZE."""
+    packed = bytearray()
+    pending = ""
+    for start in range(0, len(text), HUFFMAN_CHUNK_SIZE):
+        bits = pending + "".join(map(codes.__getitem__, text[start:start + HUFFMAN_CHUNK_SIZE]))
+        full = len(bits) - len(bits) % 8
+        if full:
+            packed += int(bits[:full], 2).to_bytes(full // 8, "big")
+        pending = bits[full:]
+    if pending:
+        packed += int(pending.ljust(8, "0"), 2).to_bytes(1, "big")
+    return packed
+
+
+def huffman_encode_binary(text: str) -> bytes:
+    """Кодирует текст каноническим кодом Хаффмана в двоичный формат (заголовок + упакованные биты)."""
+    frequency = Counter(text)
+    lengths = huffman_code_lengths(frequency)
+    codes = canonical_codes(lengths)
+    bit_length = sum(freq * lengths[char] for char, freq in frequency.items())
+    return huffman_header(lengths, bit_length) + pack_huffman_bits(text, codes)
+
+
+def parse_huffman_header(data: bytes) -> tuple[dict[str, int], int, int]:
+    """
+    Читает заголовок двоичного кода: (длины кодов символов, длина кода в битах, смещение битов).
+    Отклоняет таблицы, по которым нельзя построить префиксный код (неравенство Крафта),
+    и длину кода, превышающую объём переданных битов. Пустая таблица допустима только
+    для пустого текста (длина кода 0).
+    """
+    magic, symbol_count, bit_length = HUFFMAN_HEADER.unpack_from(data, 0)
+    if magic != HUFFMAN_MAGIC:
+        raise ValueError("Неверный формат кода Хаффмана")
+    if symbol_count == 0:
+        if bit_length:
+            raise ValueError("Пустая таблица кодов")
+        return {}, 0, HUFFMAN_HEADER.size
+
+    offset = HUFFMAN_HEADER.size
+    if len(data) < offset + symbol_count * HUFFMAN_SYMBOL.size:
+        raise ValueError("Таблица кодов обрезана")
+    lengths = {}
+    for _ in range(symbol_count):
+        codepoint, length = HUFFMAN_SYMBOL.unpack_from(data, offset)
+        if length == 0 or chr(codepoint) in lengths:
+            raise ValueError("Некорректная таблица кодов")
+        lengths[chr(codepoint)] = length
+        offset += HUFFMAN_SYMBOL.size
+
+    # Сумма 2^-длина по всем кодам не больше 1 — в целых числах относительно максимальной длины
+    max_length = max(lengths.values())
+    if sum(1 << (max_length - length) for length in lengths.values()) > 1 << max_length:
+        raise ValueError("Длины кодов не образуют префиксный код")
+    if bit_length > (len(data) - offset) * 8:
+        raise ValueError("Код Хаффмана обрезан")
+    return lengths, bit_length, offset
+
+
+def huffman_binary_to_text(data: bytes) -> tuple[str, dict]:
+    """Представляет двоичный код в текстовом виде huffman_encode: строка '0'/'1' и таблица кодов."""
+    lengths, bit_length, offset = parse_huffman_header(data)
+    payload = data[offset:]
+    bits = format(int.from_bytes(payload, "big"), f"0{len(payload) * 8}b")[:bit_length] if payload else ""
+    return bits, canonical_codes(lengths)
+
+
+def iter_chunks(data: bytes, chunk_size: int = HUFFMAN_CHUNK_SIZE):
+    """Отдаёт данные порциями без копирования — для потоковой передачи ответа."""
+    view = memoryview(data)
+    for start in range(0, len(view), chunk_size):
+        yield view[start:start + chunk_size]
+
+
+def huffman_decode_binary(data: bytes) -> str:
+    """
+    Декодирует результат huffman_encode_binary обратно в текст.
+    Канонический код декодируется по таблице: для каждой длины хранятся первый код и число кодов,
+    поэтому каждый бит обрабатывается за O(1), а код длиннее максимальной сразу считается ошибкой.
+    """
+    lengths, bit_length, offset = parse_huffman_header(data)
+    if not lengths:
+        return ""
+    max_length = max(lengths.values())
+    symbols = sorted(lengths, key=lambda char: (lengths[char], char))
+    count = [0] * (max_length + 1)
+    for length in lengths.values():
+        count[length] += 1
+    # first_code[n] — первый канонический код длины n, first_index[n] — его номер в symbols
+    first_code = [0] * (max_length + 1)
+    first_index = [0] * (max_length + 1)
+    code = index = 0
+    for length in range(1, max_length + 1):
+        code = (code + count[length - 1]) << 1
+        first_code[length] = code
+        first_index[length] = index
+        index += count[length]
+
+    payload = memoryview(data)[offset:]
+    result = []
+    code = length = 0
+    remaining = bit_length
+    for start in range(0, len(payload), HUFFMAN_CHUNK_SIZE):
+        chunk = payload[start:start + HUFFMAN_CHUNK_SIZE]
+        bits = format(int.from_bytes(chunk, "big"), f"0{len(chunk) * 8}b")[:remaining]
+        remaining -= len(bits)
+        for bit in bits:
+            code = (code << 1) | (bit == "1")
+            length += 1
+            position = code - first_code[length]
+            if position < count[length]:
+                result.append(symbols[first_index[length] + position])
+                code = length = 0
+            elif length == max_length:
+                raise ValueError("Неизвестный код Хаффмана")
+    if length:
+        raise ValueError("Код Хаффмана обрезан")
+    return "".join(result)
@@ -0,0 +1,209 @@
+"""
+Похожие документы: косинусное сходство TF-IDF векторов.
+
+Для каждого пользователя в памяти процесса хранится разреженная матрица документов (scipy CSR):
+строки — документы, столбцы — слова пользователя, значения — TF·IDF. Строки нормированы по L2,
+поэтому сходство документа со всеми остальными — одно умножение матрицы на его строку.
+
+Матрица строится лениво при первом запросе по сохранённым векторам документов и хранится
+в LRU-кэше, ограниченном суммарным числом ненулевых элементов (SIMILARITY_CACHE_NNZ).
+Перед ответом она сверяется с БД по версии корпуса: новые документы дочитываются и дописываются
+строками, удалённые помечаются, без перечитывания всего корпуса. Поэтому учитываются и загрузки,
+выполненные другими процессами.
+
+IDF (log10(N / n_i), как при загрузке документа) фиксируется при взвешивании; новые строки
+взвешиваются тем же IDF. Когда с момента взвешивания изменилось больше SIMILARITY_REWEIGHT_RATIO
+документов, матрица перевзвешивается целиком по сохранённым в памяти TF, без обращения к БД.
+"""
+import os
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+import numpy as np
+from scipy import sparse
+
+# === Константы конфигурации ===
+SIMILARITY_CACHE_NNZ = int(os.getenv("SIMILARITY_CACHE_NNZ", "5000000"))
+SIMILARITY_REWEIGHT_RATIO = float(os.getenv("SIMILARITY_REWEIGHT_RATIO", "0.1"))
+SIMILAR_MAX_LIMIT = 100
+
+# Документов в одной порции строк при построении матрицы
+SIMILARITY_BUILD_BATCH = 5000
+
+
+class DocumentMatrix:
+    """
+    TF и TF-IDF матрицы документов одного пользователя.
+    - tf: доля каждого слова в документе
+    - weighted: TF·IDF, строки нормированы по L2
+    - alive: удалённые документы остаются строками до перевзвешивания, но не участвуют в ответах
+    """
+    def __init__(self):
+        self.version: Optional[int] = None
+        self.doc_ids = np.empty(0, dtype=np.int64)
+        self.alive = np.empty(0, dtype=bool)
+        self.rows: dict[int, int] = {}
+        # Документы без сохранённого вектора (загружены до появления векторов): в матрицу не попадают
+        self.skipped: set[int] = set()
+        # Столбец j соответствует слову term_ids[j]; отсортированная копия — для поиска столбцов
+        self.term_ids = np.empty(0, dtype=np.int64)
+        self._sorted_terms = np.empty(0, dtype=np.int64)
+        self._sorted_columns = np.empty(0, dtype=np.int64)
+        self.tf = sparse.csr_matrix((0, 0), dtype=np.float32)
+        self.weighted = sparse.csr_matrix((0, 0), dtype=np.float32)
+        self.idf = np.empty(0, dtype=np.float32)
+        self.weighted_docs = 0
+        self.changed = 0
+
+    @property
+    def nnz(self) -> int:
+        return self.tf.nnz + self.weighted.nnz
+
+    @property
+    def doc_count(self) -> int:
+        return int(self.alive.sum())
+
+    def _columns(self, term_ids: np.ndarray) -> np.ndarray:
+        """Номера столбцов для id слов; для новых слов столбцы добавляются."""
+        positions = np.searchsorted(self._sorted_terms, term_ids)
+        positions = np.minimum(positions, max(len(self._sorted_terms) - 1, 0))
+        known = (
+            self._sorted_terms[positions] == term_ids
+            if len(self._sorted_terms) else np.zeros(len(term_ids), dtype=bool)
+        )
+        new_terms = np.unique(term_ids[~known])
+        if len(new_terms):
+            self.term_ids = np.concatenate([self.term_ids, new_terms])
+            self._sorted_columns = np.argsort(self.term_ids, kind="stable")
+            self._sorted_terms = self.term_ids[self._sorted_columns]
+            positions = np.searchsorted(self._sorted_terms, term_ids)
+        return self._sorted_columns[positions]
+
+    def _idf(self, width: int) -> np.ndarray:
+        # Слова, которых не было при взвешивании, считаются встречающимися в одном документе
+        if len(self.idf) < width:
+            fill = np.log10(max(self.weighted_docs, 1))
+            self.idf = np.concatenate([self.idf, np.full(width - len(self.idf), fill, dtype=np.float32)])
+        return self.idf
+
+    def _weigh(self, tf: sparse.csr_matrix) -> sparse.csr_matrix:
+        weighted = sparse.csr_matrix(tf.multiply(self._idf(tf.shape[1])[np.newaxis, :]), dtype=np.float32)
+        norms = np.sqrt(np.asarray(weighted.multiply(weighted).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        return sparse.csr_matrix(sparse.diags(1 / norms).dot(weighted), dtype=np.float32)
+
+    @staticmethod
+    def _widen(matrix: sparse.csr_matrix, width: int) -> sparse.csr_matrix:
+        return sparse.csr_matrix((matrix.data, matrix.indices, matrix.indptr), shape=(matrix.shape[0], width))
+
+    def append(self, vectors: Iterable) -> None:
+        """Дописывает документы строками. vectors — объекты с file_id, total_words, term_ids и counts (bytea)."""
+        file_ids, indptr, indices, data = [], [0], [], []
+        for vector in vectors:
+            if vector.file_id in self.rows:
+                continue
+            counts = np.frombuffer(vector.counts, dtype=np.float32)
+            file_ids.append(vector.file_id)
+            indices.append(np.frombuffer(vector.term_ids, dtype=np.uint32).astype(np.int64))
+            data.append(counts / max(vector.total_words, 1))
+            indptr.append(indptr[-1] + len(counts))
+        if not file_ids:
+            return
+
+        columns = self._columns(np.concatenate(indices))
+        width = len(self.term_ids)
+        block = sparse.csr_matrix(
+            (np.concatenate(data).astype(np.float32), columns, np.array(indptr)),
+            shape=(len(file_ids), width)
+        )
+        self.tf = sparse.vstack([self._widen(self.tf, width), block], format="csr")
+        self.weighted = sparse.vstack([self._widen(self.weighted, width), self._weigh(block)], format="csr")
+
+        start = len(self.doc_ids)
+        self.rows.update((file_id, start + i) for i, file_id in enumerate(file_ids))
+        self.doc_ids = np.concatenate([self.doc_ids, np.array(file_ids, dtype=np.int64)])
+        self.alive = np.concatenate([self.alive, np.ones(len(file_ids), dtype=bool)])
+        self.changed += len(file_ids)
+
+    def remove(self, file_ids: Iterable[int]) -> None:
+        for file_id in file_ids:
+            row = self.rows.pop(file_id, None)
+            if row is not None:
+                self.alive[row] = False
+                self.changed += 1
+
+    def reweight(self) -> None:
+        """Убирает строки удалённых документов и пересчитывает IDF по текущему набору документов."""
+        if not self.alive.all():
+            self.tf = self.tf[self.alive]
+            self.doc_ids = self.doc_ids[self.alive]
+            self.alive = np.ones(len(self.doc_ids), dtype=bool)
+            self.rows = {int(file_id): row for row, file_id in enumerate(self.doc_ids)}
+
+        width = len(self.term_ids)
+        n = len(self.doc_ids)
+        df = np.bincount(self.tf.indices, minlength=width)
+        with np.errstate(divide="ignore"):
+            idf = np.log10(n / df)
+        idf[~np.isfinite(idf)] = 0
+        self.idf = np.maximum(idf, 0).astype(np.float32)
+        self.weighted_docs = n
+        self.weighted = self._weigh(self._widen(self.tf, width))
+        self.changed = 0
+
+    def needs_reweight(self) -> bool:
+        return self.changed > SIMILARITY_REWEIGHT_RATIO * max(self.weighted_docs, 1)
+
+    def similar(self, file_id: int, limit: int) -> Optional[list[tuple[int, float]]]:
+        """limit самых похожих документов: (id документа, косинусное сходство). None — документа нет в матрице."""
+        row = self.rows.get(file_id)
+        if row is None:
+            return None
+        scores = (self.weighted @ self.weighted[row].T).toarray().ravel()
+        scores[~self.alive] = 0
+        scores[row] = 0
+
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(int(self.doc_ids[i]), float(scores[i])) for i in candidates]
+
+
+class SimilarityCache:
+    """LRU-кэш матриц пользователей, ограниченный суммарным числом ненулевых элементов."""
+    def __init__(self, max_nnz: int):
+        self.max_nnz = max_nnz
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[int, DocumentMatrix] = OrderedDict()
+
+    def get(self, user_id: int) -> Optional[DocumentMatrix]:
+        matrix = self._entries.get(user_id)
+        if matrix is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return matrix
+
+    def put(self, user_id: int, matrix: DocumentMatrix) -> None:
+        """Добавляет или обновляет матрицу; вызывается и после её роста, чтобы соблюсти лимит."""
+        self._entries[user_id] = matrix
+        self._entries.move_to_end(user_id)
+        # Последняя использованная матрица остаётся, даже если одна превышает лимит
+        while len(self._entries) > 1 and self.nnz > self.max_nnz:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        self._entries.pop(user_id, None)
+
+    @property
+    def nnz(self) -> int:
+        return sum(matrix.nnz for matrix in self._entries.values())
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "users": len(self._entries), "nnz": self.nnz}
+
+
+similarity_cache = SimilarityCache(SIMILARITY_CACHE_NNZ)
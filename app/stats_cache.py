@@ -0,0 +1,49 @@
+import os
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+# === Константы конфигурации ===
+STATS_CACHE_SIZE = int(os.getenv("STATS_CACHE_SIZE", "256"))
+SEARCH_CACHE_BLOCKS = int(os.getenv("SEARCH_CACHE_BLOCKS", "4096"))
+
+
+class VersionedLRUCache:
+    """
+    LRU-кэш в памяти процесса, каждая запись которого помечена версией данных.
+    Запись считается актуальной, только если её версия совпадает с текущей версией в БД,
+    поэтому изменения, сделанные другими процессами, тоже приводят к промаху.
+    """
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Hashable, tuple[int, Any]] = OrderedDict()
+
+    def get(self, key: Hashable, version: int) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != version:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: Hashable, version: int, value: Any) -> None:
+        self._entries[key] = (version, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+# Кэш статистики коллекций: ключ — (id пользователя, id коллекции), версия — версия корпуса пользователя
+collection_stats_cache = VersionedLRUCache(STATS_CACHE_SIZE)
+
+# Кэш декодированных блоков поискового индекса: ключ — (id пользователя, id слова, номер блока),
+# версия — (номер построения индекса, количество документов в блоке); заполненные блоки не меняются
+posting_block_cache = VersionedLRUCache(SEARCH_CACHE_BLOCKS)
@@ -0,0 +1,377 @@
+"""
+Хранилище текстов документов вне PostgreSQL.
+
+Хранилище адресуется по содержимому: ключ объекта — SHA-256 текста в UTF-8, поэтому
+одинаковые документы хранятся один раз. В fileuploads остаются только ссылка на объект
+(content_ref) и размер текста в байтах (content_size).
+
+Объекты сжимаются zstd, если установлен пакет zstandard, иначе gzip. Кодек входит в ссылку
+("<sha256>.zst", "<sha256>.gz"), поэтому смена CONTENT_STORE_CODEC не мешает читать старые объекты.
+
+Бэкенд по умолчанию — локальный каталог CONTENT_STORE_DIR с раскладкой ключей как
+в объектном хранилище (ab/abcdef….zst). Другой бэкенд подключается через BACKENDS.
+
+Объекты не удаляются вместе с документом: на них могут ссылаться другие документы.
+Объекты без ссылок убирает команда gc.
+
+Загруженные файлы до обработки воркером лежат в каталоге UPLOAD_SPOOL_DIR (в задаче хранится
+только имя файла), поэтому он должен быть общим для приложения и отдельных воркеров.
+Файлы завершённых задач удаляет воркер, брошенные — команда gc.
+
+    python -m app.storage migrate   # перенос текстов из fileuploads.content в хранилище
+    python -m app.storage gc        # удаление объектов, на которые не ссылается ни один документ
+"""
+import argparse
+import asyncio
+import gzip
+import hashlib
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterator, Optional
+
+try:
+    import zstandard
+except ImportError:  # zstd необязателен, без него используется gzip
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# === Константы конфигурации ===
+CONTENT_STORE_BACKEND = os.getenv("CONTENT_STORE_BACKEND", "local")
+CONTENT_STORE_DIR = os.getenv("CONTENT_STORE_DIR", "storage/content")
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR", "storage/uploads")
+CONTENT_STORE_CODEC = os.getenv("CONTENT_STORE_CODEC", "zst" if zstandard else "gz")
+ZSTD_LEVEL = int(os.getenv("CONTENT_STORE_ZSTD_LEVEL", "3"))
+GZIP_LEVEL = int(os.getenv("CONTENT_STORE_GZIP_LEVEL", "6"))
+
+# Размер порции при потоковой отдаче текста
+CONTENT_CHUNK_SIZE = 64 * 1024
+
+# Объекты моложе этого возраста gc не трогает: документ с ними может ещё сохраняться
+GC_GRACE_SECONDS = int(os.getenv("CONTENT_STORE_GC_GRACE", "3600"))
+
+# Документов в одной транзакции при переносе текстов в хранилище
+MIGRATE_BATCH_SIZE = 100
+
+REF_PATTERN = re.compile(r"^([0-9a-f]{64})\.([a-z]+)$")
+SPOOL_NAME_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+@dataclass(frozen=True)
+class Codec:
+    """Сжатие объекта целиком и потоковое чтение распакованных данных из файла."""
+    suffix: str
+    compress: Callable[[bytes], bytes]
+    open: Callable[[Path], BinaryIO]
+
+
+CODECS: dict[str, Codec] = {
+    "gz": Codec("gz", lambda data: gzip.compress(data, compresslevel=GZIP_LEVEL), lambda path: gzip.open(path, "rb")),
+    "raw": Codec("raw", lambda data: data, lambda path: open(path, "rb")),
+}
+if zstandard is not None:
+    # Компрессор не потокобезопасен, а put вызывается из нескольких потоков, поэтому создаётся на каждый вызов
+    CODECS["zst"] = Codec(
+        "zst",
+        lambda data: zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data),
+        lambda path: zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+    )
+
+
+def ref_digest(ref: str) -> str:
+    """SHA-256 текста, на который указывает ссылка."""
+    match = REF_PATTERN.match(ref)
+    if not match or match.group(2) not in CODECS:
+        raise ValueError(f"Некорректная ссылка на объект: {ref!r}")
+    return match.group(1)
+
+
+class ContentStore(ABC):
+    """
+    Базовый класс хранилища. Бэкенд реализует put, open, delete и refs;
+    чтение целиком и диапазонами построено поверх open.
+    """
+    @abstractmethod
+    def put(self, data: bytes) -> str:
+        """Сохраняет данные (если такого объекта ещё нет) и возвращает ссылку."""
+
+    @abstractmethod
+    def open(self, ref: str) -> BinaryIO:
+        """Поток распакованных данных объекта."""
+
+    @abstractmethod
+    def delete(self, ref: str) -> None:
+        """Удаляет объект; отсутствующий объект не считается ошибкой."""
+
+    @abstractmethod
+    def refs(self) -> Iterator[tuple[str, float]]:
+        """Все объекты хранилища: ссылка и время создания."""
+
+    def read(self, ref: str) -> bytes:
+        with self.open(ref) as stream:
+            return stream.read()
+
+    def iter_range(
+        self,
+        ref: str,
+        start: int = 0,
+        end: Optional[int] = None,
+        chunk_size: int = CONTENT_CHUNK_SIZE
+    ) -> Iterator[bytes]:
+        """
+        Отдаёт байты [start, end] распакованного объекта порциями, не держа объект в памяти.
+        Сжатый поток не поддерживает произвольный доступ, поэтому начало диапазона
+        находится чтением и отбрасыванием предшествующих данных.
+        """
+        with self.open(ref) as stream:
+            skip = start
+            while skip > 0:
+                chunk = stream.read(min(chunk_size, skip))
+                if not chunk:
+                    return
+                skip -= len(chunk)
+
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                chunk = stream.read(chunk_size if remaining is None else min(chunk_size, remaining))
+                if not chunk:
+                    return
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+
+class LocalContentStore(ContentStore):
+    """Объекты в локальном каталоге: <root>/<первые 2 символа хэша>/<хэш>.<кодек>."""
+    def __init__(self, root: str, codec: str = CONTENT_STORE_CODEC):
+        if codec not in CODECS:
+            logger.warning(f"Кодек {codec} недоступен, используется gz")
+            codec = "gz"
+        self.root = Path(root)
+        self.codec = CODECS[codec]
+
+    def _path(self, ref: str) -> Path:
+        return self.root / ref_digest(ref)[:2] / ref
+
+    def put(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        # Одинаковый текст мог быть сохранён раньше, в том числе другим кодеком
+        for suffix in CODECS:
+            ref = f"{digest}.{suffix}"
+            path = self._path(ref)
+            if path.exists():
+                # Обновлённое время защищает объект от gc, пока документ со ссылкой сохраняется
+                os.utime(path)
+                return ref
+
+        ref = f"{digest}.{self.codec.suffix}"
+        path = self._path(ref)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Запись во временный файл и переименование: читатели не видят недописанный объект,
+        # а параллельное сохранение того же текста просто перезапишет его тем же содержимым
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}")
+        try:
+            tmp.write_bytes(self.codec.compress(data))
+            os.replace(tmp, path)
+        finally:
+            tmp.unlink(missing_ok=True)
+        return ref
+
+    def open(self, ref: str) -> BinaryIO:
+        return CODECS[ref.rsplit(".", 1)[1]].open(self._path(ref))
+
+    def delete(self, ref: str) -> None:
+        self._path(ref).unlink(missing_ok=True)
+
+    def refs(self) -> Iterator[tuple[str, float]]:
+        if not self.root.exists():
+            return
+        for path in self.root.glob("*/*"):
+            if REF_PATTERN.match(path.name):
+                yield path.name, path.stat().st_mtime
+
+
+BACKENDS: dict[str, Callable[[], ContentStore]] = {
+    "local": lambda: LocalContentStore(CONTENT_STORE_DIR),
+}
+
+content_store = BACKENDS[CONTENT_STORE_BACKEND]()
+
+
+async def save_text(text: str) -> tuple[str, int]:
+    """Сохраняет текст в хранилище. Возвращает ссылку и размер текста в байтах UTF-8."""
+    data = text.encode("utf-8")
+    # Сжатие и запись на диск блокируют, поэтому выполняются в потоке
+    ref = await asyncio.to_thread(content_store.put, data)
+    return ref, len(data)
+
+
+async def load_text(ref: str) -> str:
+    """Читает текст из хранилища целиком."""
+    data = await asyncio.to_thread(content_store.read, ref)
+    return data.decode("utf-8")
+
+
+def _spool_path(name: str) -> Path:
+    if not SPOOL_NAME_PATTERN.match(name):
+        raise ValueError(f"Некорректное имя загруженного файла: {name!r}")
+    return Path(UPLOAD_SPOOL_DIR) / name
+
+
+def _copy_to_spool(source: BinaryIO) -> tuple[str, int]:
+    name = uuid.uuid4().hex
+    path = _spool_path(name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    source.seek(0)
+    with open(path, "wb") as target:
+        shutil.copyfileobj(source, target, CONTENT_CHUNK_SIZE)
+        size = target.tell()
+    return name, size
+
+
+async def spool_upload(source: BinaryIO) -> tuple[str, int]:
+    """
+    Копирует загруженный файл в UPLOAD_SPOOL_DIR порциями, не читая его в память целиком.
+    Возвращает имя файла для задачи обработки и размер в байтах.
+    """
+    return await asyncio.to_thread(_copy_to_spool, source)
+
+
+def open_spooled(name: str) -> BinaryIO:
+    return open(_spool_path(name), "rb")
+
+
+def delete_spooled(name: str) -> None:
+    _spool_path(name).unlink(missing_ok=True)
+
+
+def parse_byte_range(header: Optional[str], size: int) -> Optional[tuple[int, int]]:
+    """
+    Разбирает заголовок Range для ресурса размером size байт.
+    Возвращает (start, end) включительно или None, если нужно отдать ресурс целиком
+    (заголовка нет, он не в байтах или запрошено несколько диапазонов).
+    Для невыполнимого диапазона бросает ValueError (ответ 416).
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, _, end = header[len("bytes="):].strip().partition("-")
+    try:
+        if not start:
+            # bytes=-N — последние N байт
+            suffix = int(end)
+            if suffix <= 0:
+                raise ValueError("Пустой диапазон")
+            return max(size - suffix, 0), size - 1
+        start = int(start)
+        end = int(end) if end else size - 1
+    except ValueError:
+        raise ValueError(f"Некорректный диапазон: {header}")
+    if start >= size or end < start:
+        raise ValueError(f"Диапазон вне ресурса: {header}")
+    return start, min(end, size - 1)
+
+
+async def migrate_inline_content() -> int:
+    """Переносит тексты, сохранённые в fileuploads.content, в хранилище. Возвращает число документов."""
+    from sqlalchemy import select, update
+    from app.database import async_session
+    from app.models.document import FileUpload
+
+    moved = 0
+    while True:
+        async with async_session() as db:
+            result = await db.execute(
+                select(FileUpload.id, FileUpload.content)
+                .where(FileUpload.content_ref.is_(None), FileUpload.content.is_not(None))
+                .order_by(FileUpload.id)
+                .limit(MIGRATE_BATCH_SIZE)
+                .with_for_update(skip_locked=True)
+            )
+            rows = result.all()
+            if not rows:
+                return moved
+            for file_id, text in rows:
+                ref, size = await save_text(text)
+                await db.execute(
+                    update(FileUpload)
+                    .where(FileUpload.id == file_id)
+                    .values(content_ref=ref, content_size=size, content=None)
+                )
+            await db.commit()
+            moved += len(rows)
+            logger.info(f"Перенесено документов: {moved}")
+
+
+async def collect_garbage(grace_seconds: int = GC_GRACE_SECONDS) -> int:
+    """Удаляет объекты, на которые не ссылается ни один документ. Возвращает число удалённых."""
+    from sqlalchemy import select
+    from app.database import async_session
+    from app.models.document import FileUpload
+
+    # Список объектов снимается до чтения ссылок: объект, сохранённый позже, в него не попадёт
+    threshold = time.time() - grace_seconds
+    candidates = [ref for ref, created in content_store.refs() if created < threshold]
+    async with async_session() as db:
+        referenced = set(
+            (await db.scalars(select(FileUpload.content_ref).where(FileUpload.content_ref.is_not(None)).distinct())).all()
+        )
+    removed = 0
+    for ref in candidates:
+        if ref not in referenced:
+            content_store.delete(ref)
+            removed += 1
+    return removed
+
+
+async def collect_spool_garbage(grace_seconds: int = GC_GRACE_SECONDS) -> int:
+    """Удаляет загруженные файлы, которые не ждут обработки (задача завершена или не создана)."""
+    from sqlalchemy import select
+    from app.database import async_session
+    from app.models.job import UploadJob, JOB_QUEUED, JOB_RUNNING
+
+    root = Path(UPLOAD_SPOOL_DIR)
+    if not root.exists():
+        return 0
+    threshold = time.time() - grace_seconds
+    candidates = [
+        path for path in root.iterdir()
+        if SPOOL_NAME_PATTERN.match(path.name) and path.stat().st_mtime < threshold
+    ]
+    async with async_session() as db:
+        pending = set(
+            (await db.scalars(
+                select(UploadJob.payload_ref)
+                .where(UploadJob.payload_ref.is_not(None), UploadJob.status.in_([JOB_QUEUED, JOB_RUNNING]))
+            )).all()
+        )
+    removed = 0
+    for path in candidates:
+        if path.name not in pending:
+            path.unlink(missing_ok=True)
+            removed += 1
+    return removed
+
+
+async def main(command: str) -> None:
+    from app.database import engine
+    if command == "migrate":
+        print(f"✅ Перенесено документов: {await migrate_inline_content()}")
+    else:
+        print(f"✅ Удалено объектов: {await collect_garbage()}")
+        print(f"✅ Удалено загруженных файлов: {await collect_spool_garbage()}")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["migrate", "gc"])
+    asyncio.run(main(parser.parse_args().command))
@@ -0,0 +1,157 @@
+"""
+Токенизаторы: разбиение текста на слова (термы) для подсчёта TF/IDF, индекса и поиска.
+
+Токенизатор — набор шагов поверх одного заранее скомпилированного шаблона слова:
+- нормализация: нижний регистр (simple) или NFC + casefold — составные символы
+  («й» из «и» и знака бреве) собираются до поиска слов, а регистр сворачивается и вне кириллицы и латиницы;
+- стоп-слова: служебные слова выбранных языков отбрасываются;
+- стемминг: русские слова приводятся к основе стеммером Snowball для русского языка,
+  латинские — Snowball для английского (Porter2), остальные остаются как есть.
+  Основа вычисляется один раз на слово и запоминается (STEM_CACHE_SIZE слов на процесс).
+  Если установлен PyStemmer, snowballstemmer использует его реализацию на C.
+
+Стоп-слова и стемминг применяются к уникальным словам текста, а не к каждому вхождению.
+
+Токенизатор выбирается при загрузке и сохраняется в документе (fileuploads.tokenizer):
+по нему документ разбирается повторно, например при перестроении индексов. simple совпадает
+с прежней токенизацией и используется по умолчанию (TOKENIZER_DEFAULT).
+"""
+import os
+import re
+import unicodedata
+from collections import Counter
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Literal, Optional
+
+import snowballstemmer
+
+# === Константы конфигурации ===
+TOKENIZER_DEFAULT = os.getenv("TOKENIZER_DEFAULT", "simple")
+STEM_CACHE_SIZE = int(os.getenv("STEM_CACHE_SIZE", "200000"))
+
+# Слово — не меньше двух букв любого алфавита (без цифр и подчёркивания)
+WORD_PATTERN = re.compile(r'\b[^\W\d_]{2,}\b', flags=re.UNICODE)
+
+STOP_WORDS: dict[str, frozenset[str]] = {
+    "ru": frozenset("""
+        а без более бы был была были было быть в вам вас весь во вот все всё всего всех вы где да даже
+        для до его ее её ей ему если есть еще ещё же за здесь и из или им их к как какая какой когда
+        кто ли либо мне может мы на над надо наш не него нее неё нет ни них но ну о об однако он она
+        они оно от очень по под после при про раз с со так также такой там те тем то того тоже той
+        только том ты у уж уже хотя чего чей чем что чтобы чье чьё эта эти это этого этой этом этот
+        я между себя себе свой своя свои своё свое тот та тех ведь вдруг опять потом потому
+        поэтому сейчас тогда тут чуть будет будто всегда иногда куда зачем почему никогда ничего
+    """.split()),
+    "en": frozenset("""
+        a about above after again against all am an and any are as at be because been before being
+        below between both but by can could did do does doing down during each few for from further
+        had has have having he her here hers herself him himself his how if in into is it its itself
+        just me more most my myself no nor not now of off on once only or other our ours ourselves
+        out over own same she should so some such than that the their theirs them themselves then
+        there these they this those through to too under until up very was we were what when where
+        which while who whom why will with would you your yours yourself yourselves
+    """.split()),
+}
+
+_STEMMERS = {
+    "ru": snowballstemmer.stemmer("russian"),
+    "en": snowballstemmer.stemmer("english"),
+}
+
+
+@lru_cache(maxsize=STEM_CACHE_SIZE)
+def stem(word: str) -> str:
+    """Основа слова: стеммер выбирается по алфавиту первой буквы."""
+    first = word[0]
+    if "а" <= first <= "я" or first == "ё":
+        return _STEMMERS["ru"].stemWord(word)
+    if "a" <= first <= "z":
+        return _STEMMERS["en"].stemWord(word)
+    return word
+
+
+@dataclass(frozen=True)
+class Tokenizer:
+    """
+    Конвейер токенизации:
+    - normalize: NFC + casefold вместо lower()
+    - stop_words: отбрасываемые слова (в нормализованном виде)
+    - stem: приводить слова к основе
+    """
+    name: str
+    description: str
+    normalize: bool = False
+    stop_words: frozenset[str] = frozenset()
+    stem: bool = False
+
+    def fold(self, text: str) -> str:
+        if not self.normalize:
+            return text.lower()
+        # Проверка дешевле нормализации, а текст почти всегда уже в NFC
+        if not unicodedata.is_normalized("NFC", text):
+            text = unicodedata.normalize("NFC", text)
+        return text.casefold()
+
+    def term(self, word: str) -> Optional[str]:
+        """Терм для нормализованного слова; None — слово отбрасывается."""
+        if word in self.stop_words:
+            return None
+        return stem(word) if self.stem else word
+
+    def tokenize(self, text: str) -> list[str]:
+        """Термы текста в порядке следования."""
+        words = WORD_PATTERN.findall(self.fold(text))
+        if not self.stop_words and not self.stem:
+            return words
+        return [term for term in map(self.term, words) if term is not None]
+
+    def count(self, text: str) -> Counter[str]:
+        """Количество вхождений каждого терма; стоп-слова и стемминг — по уникальным словам."""
+        words = Counter(WORD_PATTERN.findall(self.fold(text)))
+        if not self.stop_words and not self.stem:
+            return words
+        counts: Counter[str] = Counter()
+        for word, count in words.items():
+            term = self.term(word)
+            if term is not None:
+                counts[term] += count
+        return counts
+
+
+TOKENIZERS: dict[str, Tokenizer] = {
+    tokenizer.name: tokenizer
+    for tokenizer in (
+        Tokenizer("simple", "Нижний регистр, без стоп-слов и стемминга"),
+        Tokenizer("normalized", "NFC и casefold, без стоп-слов и стемминга", normalize=True),
+        Tokenizer(
+            "stemmed",
+            "NFC и casefold, русские и английские стоп-слова, стемминг Snowball",
+            normalize=True,
+            stop_words=STOP_WORDS["ru"] | STOP_WORDS["en"],
+            stem=True
+        ),
+    )
+}
+
+if TOKENIZER_DEFAULT not in TOKENIZERS:
+    raise ValueError(f"Неизвестный токенизатор TOKENIZER_DEFAULT={TOKENIZER_DEFAULT}, доступны: {', '.join(TOKENIZERS)}")
+
+# Имя токенизатора в параметрах запросов: FastAPI проверяет значение и показывает варианты в OpenAPI
+TokenizerName = Literal[tuple(TOKENIZERS)]
+
+
+def get_tokenizer(name: Optional[str] = None) -> Tokenizer:
+    """Токенизатор по имени; None — токенизатор по умолчанию. Для неизвестного имени — KeyError."""
+    return TOKENIZERS[name or TOKENIZER_DEFAULT]
+
+
+def query_terms(text: str) -> list[str]:
+    """
+    Термы поискового запроса без повторов. Документы пользователя могли быть загружены
+    с разными токенизаторами, поэтому запрос разбирается каждым из них.
+    """
+    terms = {}
+    for tokenizer in TOKENIZERS.values():
+        terms.update(dict.fromkeys(tokenizer.tokenize(text)))
+    return list(terms)
@@ -0,0 +1,167 @@
+"""
+Лёгкая трассировка этапов обработки запросов и задач.
+
+Включается переменной TRACING_ENABLED=1. Каждый HTTP-запрос (и каждая задача обработки загрузки)
+получает трассу, этапы внутри неё отмечаются через span():
+
+    with tracing.span("ingest.idf", words=len(words)):
+        ...
+
+Завершённые трассы дописываются в TRACE_FILE в формате JSON Lines: одна строка — один span
+с полями OTLP (traceId, spanId, parentSpanId, name, startTimeUnixNano, endTimeUnixNano, attributes).
+Запросы дольше SLOW_REQUEST_MS пишутся в лог с разбивкой времени по этапам.
+
+Когда трассировка выключена, span() возвращает общий пустой контекст-менеджер
+и не создаёт объектов, а middleware не подключается.
+"""
+import json
+import logging
+import os
+import secrets
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Optional
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+# === Константы конфигурации ===
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "0") == "1"
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+
+_NOOP = nullcontext()
+
+
+class Trace:
+    """Спаны одной трассы: корневой запрос или задача и все вложенные этапы."""
+    def __init__(self, name: str):
+        self.trace_id = secrets.token_hex(16)
+        self.spans: list[Span] = []
+        self.root = Span(self, name, None, {})
+
+
+class Span:
+    def __init__(self, trace: Trace, name: str, parent: Optional["Span"], attributes: dict):
+        self.trace = trace
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        trace.spans.append(self)
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def to_otlp(self) -> dict:
+        return {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in self.attributes.items()],
+        }
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+@contextmanager
+def _open_span(span: Span):
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.attributes["error"] = type(e).__name__
+        raise
+    finally:
+        span.end_ns = time.time_ns()
+        _current_span.reset(token)
+
+
+def span(name: str, **attributes):
+    """Этап внутри текущей трассы. Вне трассы или при выключенной трассировке ничего не делает."""
+    if not TRACING_ENABLED:
+        return _NOOP
+    parent = _current_span.get()
+    if parent is None:
+        return _NOOP
+    return _open_span(Span(parent.trace, name, parent, attributes))
+
+
+@contextmanager
+def trace(name: str, **attributes):
+    """Корневая трасса для запроса или фоновой задачи. По завершении выгружается и проверяется на медленность."""
+    if not TRACING_ENABLED:
+        yield None
+        return
+    current = Trace(name)
+    current.root.attributes.update(attributes)
+    try:
+        with _open_span(current.root) as root:
+            yield root
+    finally:
+        _finish(current)
+
+
+def _finish(current: Trace) -> None:
+    try:
+        with open(TRACE_FILE, "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(span.to_otlp(), ensure_ascii=False) + "\n" for span in current.spans)
+    except OSError as e:
+        logger.warning(f"Не удалось записать трассу в {TRACE_FILE}: {e}")
+
+    root = current.root
+    if root.duration_ms >= SLOW_REQUEST_MS:
+        stages = ", ".join(
+            f"{span.name} {span.duration_ms:.0f} мс"
+            for span in current.spans
+            if span.parent_id == root.span_id
+        )
+        logger.warning(
+            f"Медленный запрос {root.name}: {root.duration_ms:.0f} мс "
+            f"(trace {current.trace_id}){': ' + stages if stages else ''}"
+        )
+
+
+class TracingMiddleware:
+    """ASGI-middleware: открывает трассу на каждый HTTP-запрос."""
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                root.set(status=message["status"])
+            await send(message)
+
+        with trace(f"{scope['method']} {scope['path']}", method=scope["method"], path=scope["path"]) as root:
+            await self.app(scope, receive, send_wrapper)
+            # Шаблон маршрута известен только после того, как роутер нашёл обработчик
+            route = scope.get("route")
+            if route is not None:
+                root.name = f"{scope['method']} {route.path}"
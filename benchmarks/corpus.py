@@ -0,0 +1,87 @@
+"""
+Генератор синтетических корпусов для замеров.
+
+Тексты собираются из псевдослов со скошенным (примерно ципфовским) распределением частот,
+поэтому в них, как в настоящих текстах, есть и частые, и редкие слова.
+Генерация детерминирована: одинаковые параметры дают одинаковый текст.
+"""
+import random
+
+RU_SYLLABLES = (
+    "ка", "ло", "ми", "на", "ра", "сто", "по", "ве", "до", "же", "зи", "лю", "мо", "не", "при",
+    "то", "ус", "ше", "щи", "эр", "юн", "ял", "ов", "ен", "ий", "ть", "ся", "про", "вы", "гра"
+)
+EN_SYLLABLES = (
+    "the", "ing", "er", "an", "re", "on", "at", "en", "nd", "ti", "es", "or", "te", "of", "ed",
+    "is", "it", "al", "ar", "st", "to", "nt", "ng", "se", "ha", "as", "ou", "io", "le", "ve"
+)
+PUNCTUATION = (" ", " ", " ", " ", " ", " ", ", ", ". ", "! ", "? ", " — ", ".\n")
+
+LANGUAGES = ("ru", "en", "mixed", "garbage")
+
+
+def vocabulary(syllables: tuple[str, ...], size: int, seed: int = 0) -> list[str]:
+    """Словарь из size различных псевдослов длиной от 1 до 4 слогов."""
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(syllables) for _ in range(rng.randint(1, 4))))
+    # Порядок слов задаёт их частоту, поэтому алфавитный порядок перемешивается
+    words = sorted(words)
+    rng.shuffle(words)
+    return words
+
+
+def _words_text(words: list[str], size: int, rng: random.Random) -> str:
+    parts = []
+    length = 0
+    capitalize = True
+    while length < size:
+        # Индекс ~ N^u даёт убывающую частоту слов: первые слова словаря встречаются чаще всего
+        word = words[int(len(words) ** rng.random()) - 1]
+        if capitalize:
+            word = word.capitalize()
+        separator = rng.choice(PUNCTUATION)
+        capitalize = separator.strip() in (".", "!", "?", ".\n")
+        parts.append(word)
+        parts.append(separator)
+        length += len(word) + len(separator)
+    return "".join(parts)[:size]
+
+
+def synthetic_text(language: str, size: int, vocabulary_size: int = 5000, seed: int = 0) -> str:
+    """
+    Текст длиной size символов:
+    - ru / en: псевдослова из русских или английских слогов
+    - mixed: русские и английские предложения вперемешку, с числами
+    - garbage: случайные байты, прочитанные как latin-1 (имитация двоичного файла)
+    """
+    rng = random.Random(f"{language}:{size}:{seed}")
+    if language == "ru":
+        return _words_text(vocabulary(RU_SYLLABLES, vocabulary_size, seed), size, rng)
+    if language == "en":
+        return _words_text(vocabulary(EN_SYLLABLES, vocabulary_size, seed), size, rng)
+    if language == "mixed":
+        ru = vocabulary(RU_SYLLABLES, vocabulary_size // 2, seed)
+        en = vocabulary(EN_SYLLABLES, vocabulary_size // 2, seed)
+        numbers = [str(rng.randint(0, 10_000)) for _ in range(100)]
+        return _words_text(ru + en + numbers, size, rng)
+    if language == "garbage":
+        return rng.randbytes(size).decode("latin-1")
+    raise ValueError(f"Неизвестный язык корпуса: {language}")
+
+
+def synthetic_document(language: str, size: int, seed: int = 0, encoding: str = "utf-8") -> bytes:
+    """Документ размером около size байт в заданной кодировке."""
+    if language == "garbage":
+        return random.Random(f"{language}:{size}:{seed}").randbytes(size)
+    # Кириллица в UTF-8 занимает 2 байта на символ
+    chars = size // 2 if language in ("ru", "mixed") and encoding == "utf-8" else size
+    return synthetic_text(language, chars, seed=seed).encode(encoding)
+
+
+def parse_size(value: str) -> int:
+    """Размер в виде 500, 10k или 2m."""
+    value = value.strip().lower()
+    multiplier = {"k": 1024, "m": 1024 * 1024}.get(value[-1:], 1)
+    return int(float(value.rstrip("km")) * multiplier)
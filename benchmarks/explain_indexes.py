@@ -0,0 +1,177 @@
+"""
+Планы горячих запросов до и после индексов из app/migrations.py.
+
+Скрипт создаёт отдельную схему index_bench с копиями таблиц word_stat, fileuploads,
+collections и collection_documents (структура берётся из public, поэтому сначала
+нужно выполнить init_db.py), заполняет их синтетическими данными через generate_series,
+снимает EXPLAIN (ANALYZE, BUFFERS) без индексов, строит индексы теми же IndexSpec,
+что и миграции, и снимает планы повторно. Рабочие таблицы не затрагиваются.
+
+    python -m benchmarks.explain_indexes --rows 1000000 --output explain.json
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.database import engine
+from app.migrations import MIGRATIONS
+
+SCHEMA = "index_bench"
+TABLES = ("fileuploads", "word_stat", "collections", "collection_documents")
+WORDS_PER_DOCUMENT = 50
+COLLECTIONS_PER_USER = 5
+
+# Запросы приложения, которые фильтруют по неиндексированным колонкам
+QUERIES = {
+    "idf_lookup": (
+        "SELECT count(DISTINCT file_id) FROM word_stat WHERE user_id = :user_id AND word = :word"
+    ),
+    "output_latest_words": (
+        "SELECT ws.* FROM word_stat ws JOIN fileuploads f ON ws.file_id = f.id "
+        "WHERE f.user_id = :user_id ORDER BY ws.id DESC LIMIT 50"
+    ),
+    "document_statistics": (
+        "SELECT word, tf, idf FROM word_stat WHERE file_id = :file_id"
+    ),
+    "collection_statistics": (
+        "SELECT ws.word, sum(ws.tf) FROM collection_documents cd "
+        "JOIN word_stat ws ON ws.file_id = cd.document_id "
+        "WHERE cd.collection_id = :collection_id GROUP BY ws.word"
+    ),
+    "default_collection": (
+        "SELECT id FROM collections WHERE name = 'default' AND user_id = :user_id"
+    ),
+    "collection_membership": (
+        "SELECT 1 FROM collection_documents WHERE collection_id = :collection_id AND document_id = :file_id"
+    ),
+}
+
+
+async def prepare_schema(conn: AsyncConnection, rows: int, users: int, vocabulary: int) -> dict:
+    """Создаёт схему с копиями таблиц и заполняет её. Возвращает параметры для запросов."""
+    documents = max(rows // WORDS_PER_DOCUMENT, 1)
+    await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+    await conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+    for table in TABLES:
+        await conn.execute(text(f"CREATE TABLE {SCHEMA}.{table} (LIKE public.{table} INCLUDING DEFAULTS)"))
+        await conn.execute(text(f"ALTER TABLE {SCHEMA}.{table} ADD PRIMARY KEY (id)"))
+    await conn.execute(text(f"SET search_path TO {SCHEMA}, public"))
+
+    await conn.execute(text(
+        "INSERT INTO fileuploads (id, filename, content, user_id, unique_words) "
+        "SELECT d, 'doc_' || d || '.txt', '', (d - 1) % :users + 1, :per_doc "
+        "FROM generate_series(1, :documents) AS d"
+    ), {"users": users, "documents": documents, "per_doc": WORDS_PER_DOCUMENT})
+    await conn.execute(text(
+        "INSERT INTO word_stat (id, file_id, user_id, word, tf, idf) "
+        "SELECT g, f, (f - 1) % :users + 1, 'w' || ((g::bigint * 7919) % :vocabulary), random(), random() * 5 "
+        "FROM generate_series(1, :rows) AS g, LATERAL (SELECT (g - 1) / :per_doc + 1 AS f) AS file"
+    ), {"users": users, "rows": rows, "vocabulary": vocabulary, "per_doc": WORDS_PER_DOCUMENT})
+    await conn.execute(text(
+        "INSERT INTO collections (id, name, user_id) "
+        "SELECT c, CASE WHEN (c - 1) % :per_user = 0 THEN 'default' ELSE 'collection_' || c END, "
+        "(c - 1) / :per_user + 1 "
+        "FROM generate_series(1, :users * :per_user) AS c"
+    ), {"users": users, "per_user": COLLECTIONS_PER_USER})
+    # Каждый документ в коллекции по умолчанию своего пользователя
+    await conn.execute(text(
+        "INSERT INTO collection_documents (id, collection_id, document_id) "
+        "SELECT d, ((d - 1) % :users) * :per_user + 1, d FROM generate_series(1, :documents) AS d"
+    ), {"users": users, "per_user": COLLECTIONS_PER_USER, "documents": documents})
+    for table in TABLES:
+        await conn.execute(text(f"ANALYZE {table}"))
+
+    return {
+        "user_id": users // 2 + 1,
+        "word": f"w{vocabulary // 3}",
+        "file_id": documents // 2 + 1,
+        "collection_id": ((documents // 2) % users) * COLLECTIONS_PER_USER + 1,
+    }
+
+
+def _node_types(plan: dict) -> list[str]:
+    """Типы узлов плана в порядке обхода, например ['Limit', 'Index Scan']."""
+    nodes = [plan["Node Type"] + (f" on {plan['Relation Name']}" if "Relation Name" in plan else "")]
+    for child in plan.get("Plans", ()):
+        nodes.extend(_node_types(child))
+    return nodes
+
+
+async def explain_all(conn: AsyncConnection, params: dict) -> dict:
+    results = {}
+    for name, query in QUERIES.items():
+        explained = await conn.scalar(text(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}"), params)
+        plan = (json.loads(explained) if isinstance(explained, str) else explained)[0]
+        results[name] = {
+            "execution_ms": plan["Execution Time"],
+            "nodes": _node_types(plan["Plan"]),
+            "plan": plan["Plan"],
+        }
+    return results
+
+
+async def build_indexes(conn: AsyncConnection) -> dict:
+    """Строит индексы миграций для таблиц схемы. Возвращает время построения каждого, мс."""
+    timings = {}
+    for migration in MIGRATIONS:
+        for index in migration.indexes:
+            if index.table not in TABLES:
+                continue
+            started = time.perf_counter()
+            await conn.execute(text(index.create_sql()))
+            timings[index.name] = round((time.perf_counter() - started) * 1000, 1)
+    for table in TABLES:
+        await conn.execute(text(f"ANALYZE {table}"))
+    return timings
+
+
+async def main(rows: int, users: int, vocabulary: int, output: str | None, keep: bool) -> None:
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        started = time.perf_counter()
+        params = await prepare_schema(conn, rows, users, vocabulary)
+        print(f"Схема {SCHEMA}: {rows} строк word_stat за {time.perf_counter() - started:.1f} с")
+
+        before = await explain_all(conn, params)
+        index_timings = await build_indexes(conn)
+        after = await explain_all(conn, params)
+
+        if not keep:
+            await conn.execute(text(f"DROP SCHEMA {SCHEMA} CASCADE"))
+    await engine.dispose()
+
+    for name in QUERIES:
+        print(f"\n{name}")
+        print(f"  до:    {before[name]['execution_ms']:10.3f} мс  {' -> '.join(before[name]['nodes'])}")
+        print(f"  после: {after[name]['execution_ms']:10.3f} мс  {' -> '.join(after[name]['nodes'])}")
+    print("\nПостроение индексов, мс:")
+    for name, elapsed in index_timings.items():
+        print(f"  {name}: {elapsed}")
+
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump({
+                "rows": rows,
+                "users": users,
+                "vocabulary": vocabulary,
+                "params": params,
+                "index_build_ms": index_timings,
+                "before": before,
+                "after": after,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"\nПланы сохранены в {output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000, help="количество строк word_stat")
+    parser.add_argument("--users", type=int, default=100, help="количество пользователей")
+    parser.add_argument("--vocabulary", type=int, default=50_000, help="размер словаря")
+    parser.add_argument("--output", help="файл для сохранения планов в JSON")
+    parser.add_argument("--keep", action="store_true", help="не удалять схему после замеров")
+    args = parser.parse_args()
+    asyncio.run(main(args.rows, args.users, args.vocabulary, args.output, args.keep))
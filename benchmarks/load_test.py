@@ -0,0 +1,338 @@
+"""
+Нагрузочный тест загрузки документов и выдачи статистики.
+
+Сценарии:
+- upload: POST /uploadfile с синтетическими документами (ru, en, mixed; несколько размеров),
+  дополнительно замеряется время до завершения фоновой обработки всех загрузок
+- document_statistics: GET /api/documents/{id}/statistics
+- collection_statistics: GET /api/collections/{id}/statistics
+- huffman: GET /api/documents/{id}/huffman
+- search: GET /api/search?q= с одним-двумя словами из словаря корпуса
+- similar: GET /api/documents/{id}/similar
+
+Для каждого сценария считаются p50/p95/p99, среднее и максимум задержки, пропускная способность
+и число ошибок; для сервера, запущенного скриптом, — пиковый RSS (вместе с процессами пула анализа).
+Результаты сохраняются в JSON, чтобы сравнивать прогоны между собой.
+
+Приложение использует возможности PostgreSQL (ON CONFLICT, массивы, unnest, SKIP LOCKED),
+поэтому замеры выполняются только на PostgreSQL: переменные POSTGRES_* должны указывать
+на локальную тестовую базу (init_db.py уже выполнен).
+
+    pip install -r benchmarks/requirements.txt
+    python -m benchmarks.load_test --concurrency 20 --requests 500 --output results.json
+    python -m benchmarks.load_test --base-url http://localhost:8000   # уже запущенный сервер
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+import uuid
+from dataclasses import dataclass, field
+from itertools import cycle, islice
+from typing import Awaitable, Callable
+
+import httpx
+
+from benchmarks.corpus import RU_SYLLABLES, EN_SYLLABLES, synthetic_document, parse_size, vocabulary
+
+JOB_POLL_INTERVAL = 0.2
+SERVER_START_TIMEOUT = 30
+
+
+@dataclass
+class ScenarioResult:
+    """Задержки запросов одного сценария, секунды."""
+    name: str
+    latencies: list[float] = field(default_factory=list)
+    errors: int = 0
+    elapsed: float = 0.0
+    extra: dict = field(default_factory=dict)
+
+    def summary(self) -> dict:
+        latencies = sorted(self.latencies)
+
+        def percentile(p: float) -> float | None:
+            if not latencies:
+                return None
+            return round(latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000, 3)
+
+        return {
+            "requests": len(latencies) + self.errors,
+            "errors": self.errors,
+            "p50_ms": percentile(0.50),
+            "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99),
+            "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None,
+            "max_ms": round(latencies[-1] * 1000, 3) if latencies else None,
+            "throughput_rps": round(len(latencies) / self.elapsed, 2) if self.elapsed else None,
+            **self.extra
+        }
+
+
+async def run_scenario(
+    name: str,
+    calls: list[Callable[[], Awaitable[httpx.Response]]],
+    concurrency: int,
+    expected_status: tuple[int, ...] = (200,)
+) -> tuple[ScenarioResult, list[httpx.Response]]:
+    """Выполняет запросы с ограничением параллельности и собирает задержки."""
+    result = ScenarioResult(name)
+    responses = []
+    queue = iter(calls)
+
+    async def worker():
+        for call in queue:
+            started = time.perf_counter()
+            try:
+                response = await call()
+            except httpx.HTTPError:
+                result.errors += 1
+                continue
+            elapsed = time.perf_counter() - started
+            if response.status_code in expected_status:
+                result.latencies.append(elapsed)
+                responses.append(response)
+            else:
+                result.errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result.elapsed = time.perf_counter() - started
+    return result, responses
+
+
+def process_peak_rss_kb(pid: int) -> int | None:
+    """Пиковый RSS процесса и его дочерних процессов (Linux, /proc), КБ."""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        total += int(line.split()[1])
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pending.extend(int(child) for child in f.read().split())
+        except (FileNotFoundError, ProcessLookupError, PermissionError):
+            if current == pid:
+                return None
+    return total
+
+
+def start_server(port: int) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--limit-concurrency", "100"],
+        env=os.environ.copy()
+    )
+
+
+async def wait_for_server(client: httpx.AsyncClient) -> None:
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/status")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("Сервер не запустился")
+
+
+async def authenticate(client: httpx.AsyncClient) -> None:
+    """Регистрирует отдельного пользователя для прогона и выставляет заголовок Authorization."""
+    username = f"bench_{uuid.uuid4().hex[:12]}"
+    password = "Bench12345"
+    response = await client.post("/api/register", json={"username": username, "password": password})
+    response.raise_for_status()
+    response = await client.post("/api/login", data={"username": username, "password": password})
+    response.raise_for_status()
+    client.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+
+
+async def wait_for_jobs(client: httpx.AsyncClient, job_ids: list[int]) -> tuple[list[int], int]:
+    """Ждёт завершения задач обработки. Возвращает id созданных документов и число неудачных задач."""
+    pending = set(job_ids)
+    document_ids, failed = [], 0
+    while pending:
+        for job_id in list(pending):
+            job = (await client.get(f"/api/jobs/{job_id}")).json()
+            if job["status"] == "done":
+                document_ids.append(job["document_id"])
+                pending.discard(job_id)
+            elif job["status"] == "failed":
+                failed += 1
+                pending.discard(job_id)
+        if pending:
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+    return document_ids, failed
+
+
+async def run(args: argparse.Namespace) -> dict:
+    server = None
+    base_url = args.base_url
+    if not base_url:
+        server = start_server(args.port)
+        base_url = f"http://127.0.0.1:{args.port}"
+
+    limits = httpx.Limits(max_connections=args.concurrency)
+    scenarios = {}
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+            await wait_for_server(client)
+            await authenticate(client)
+
+            # === Загрузка ===
+            documents = [
+                (f"{language}_{size}_{i}.txt", synthetic_document(language, size, seed=i))
+                for language in args.languages
+                for size in args.sizes
+                for i in range(args.documents)
+            ]
+            uploads = [
+                lambda name=name, body=body: client.post(
+                    "/uploadfile", files={"file": (name, body, "text/plain")}, follow_redirects=False
+                )
+                for name, body in documents
+            ]
+            started = time.perf_counter()
+            upload, responses = await run_scenario("upload", uploads, args.concurrency, expected_status=(303,))
+            job_ids = [int(r.headers["location"].rsplit("job_id=", 1)[1]) for r in responses]
+            document_ids, failed = await wait_for_jobs(client, job_ids)
+            processed = time.perf_counter() - started
+            upload.extra = {
+                "bytes": sum(len(body) for _, body in documents),
+                "jobs_failed": failed,
+                "processing_total_s": round(processed, 3),
+                "processing_docs_per_sec": round(len(document_ids) / processed, 2) if processed else None,
+            }
+            scenarios["upload"] = upload.summary()
+            if not document_ids:
+                raise RuntimeError("Ни один документ не обработан")
+
+            # === Статистика документа ===
+            calls = [
+                lambda document_id=document_id: client.get(f"/api/documents/{document_id}/statistics")
+                for document_id in islice(cycle(document_ids), args.requests)
+            ]
+            result, _ = await run_scenario("document_statistics", calls, args.concurrency)
+            scenarios["document_statistics"] = result.summary()
+
+            # === Статистика коллекции по умолчанию ===
+            collections = (await client.get("/api/collections")).json()
+            collection_id = collections[0]["collection_id"]
+            calls = [
+                lambda: client.get(f"/api/collections/{collection_id}/statistics")
+                for _ in range(args.requests)
+            ]
+            result, _ = await run_scenario("collection_statistics", calls, args.concurrency)
+            scenarios["collection_statistics"] = result.summary()
+
+            # === Код Хаффмана (первый запрос к документу вычисляет код, следующие берут из кэша) ===
+            calls = [
+                lambda document_id=document_id: client.get(
+                    f"/api/documents/{document_id}/huffman", params={"format": args.huffman_format}
+                )
+                for document_id in islice(cycle(document_ids), args.requests)
+            ]
+            result, _ = await run_scenario("huffman", calls, args.concurrency)
+            scenarios["huffman"] = result.summary()
+
+            # === Поиск (слова из того же словаря, что и документы) ===
+            rng = random.Random(0)
+            words = vocabulary(RU_SYLLABLES, 5000) + vocabulary(EN_SYLLABLES, 5000)
+            calls = [
+                lambda query=" ".join(rng.sample(words, rng.randint(1, 2))): client.get(
+                    "/api/search", params={"q": query, "limit": 10}
+                )
+                for _ in range(args.requests)
+            ]
+            result, _ = await run_scenario("search", calls, args.concurrency)
+            scenarios["search"] = result.summary()
+
+            # === Похожие документы (первый запрос строит матрицу пользователя) ===
+            calls = [
+                lambda document_id=document_id: client.get(
+                    f"/api/documents/{document_id}/similar", params={"limit": 10}
+                )
+                for document_id in islice(cycle(document_ids), args.requests)
+            ]
+            result, _ = await run_scenario("similar", calls, args.concurrency)
+            scenarios["similar"] = result.summary()
+    finally:
+        server_rss = process_peak_rss_kb(server.pid) if server else None
+        if server:
+            server.terminate()
+            server.wait(timeout=10)
+
+    return {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "config": {
+            "base_url": base_url,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "documents_per_size": args.documents,
+            "languages": args.languages,
+            "sizes": args.sizes,
+            "huffman_format": args.huffman_format,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "analysis_workers": os.getenv("ANALYSIS_WORKERS"),
+            "db_pool_size": os.getenv("DB_POOL_SIZE"),
+        },
+        "scenarios": scenarios,
+        "server_peak_rss_kb": server_rss,
+        "client_peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def print_report(report: dict) -> None:
+    print(f"{'сценарий':<24}{'запросов':>10}{'ошибок':>8}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'RPS':>10}")
+    for name, summary in report["scenarios"].items():
+        print(
+            f"{name:<24}{summary['requests']:>10}{summary['errors']:>8}"
+            f"{summary['p50_ms'] or 0:>10.1f}{summary['p95_ms'] or 0:>10.1f}{summary['p99_ms'] or 0:>10.1f}"
+            f"{summary['throughput_rps'] or 0:>10.1f}"
+        )
+    upload = report["scenarios"].get("upload", {})
+    if upload:
+        print(f"\nОбработка загрузок: {upload['processing_total_s']} с, {upload['processing_docs_per_sec']} док/с")
+    if report["server_peak_rss_kb"]:
+        print(f"Пиковый RSS сервера: {report['server_peak_rss_kb'] / 1024:.1f} МБ")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", help="адрес запущенного сервера; без него сервер запускается скриптом")
+    parser.add_argument("--port", type=int, default=8765, help="порт для сервера, запускаемого скриптом")
+    parser.add_argument("--concurrency", type=int, default=10, help="количество параллельных запросов")
+    parser.add_argument("--requests", type=int, default=200, help="запросов в каждом сценарии чтения")
+    parser.add_argument("--documents", type=int, default=5, help="документов каждого языка и размера")
+    parser.add_argument(
+        "--languages", type=lambda v: v.split(","), default=["ru", "en", "mixed"],
+        help="языки корпуса через запятую: ru, en, mixed"
+    )
+    parser.add_argument(
+        "--sizes", type=lambda v: [parse_size(s) for s in v.split(",")], default=[10 * 1024, 100 * 1024, 1024 * 1024],
+        help="размеры документов через запятую, например 10k,100k,1m"
+    )
+    parser.add_argument("--huffman-format", choices=["json", "binary"], default="binary")
+    parser.add_argument("--timeout", type=float, default=120, help="таймаут одного запроса, секунды")
+    parser.add_argument("--output", help="файл для сохранения результатов в JSON")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.output}")
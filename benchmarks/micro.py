@@ -0,0 +1,191 @@
+"""
+Микробенчмарки чистых функций обработки текста из app/services.py.
+
+Каждая функция прогоняется на текстах разных алфавитов (ru, en, mixed, garbage) и размеров.
+Для каждого замера выводится медианное и лучшее время, нс на символ входа,
+а также выделения памяти по tracemalloc: пик во время вызова и объём, удерживаемый результатом.
+
+Время и память меряются в разных прогонах: tracemalloc заметно замедляет выделения.
+Входные данные готовятся заранее и в замер не входят.
+
+Импорт app.services читает настройки БД, поэтому нужен .env (подключение к БД не открывается).
+
+    python -m benchmarks.micro --sizes 1k,64k,1m --output micro.json
+    python -m benchmarks.micro --functions clean_words,huffman_encode --compare micro.json
+"""
+import argparse
+import gc
+import json
+import statistics
+import time
+import tracemalloc
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from benchmarks.corpus import LANGUAGES, synthetic_text, parse_size
+from app.services import (
+    decode_content, clean_words, word_counts, term_frequency,
+    build_huffman_tree, generate_codes, huffman_encode,
+    huffman_encode_binary, huffman_decode_binary
+)
+
+# Минимальная длительность одного повтора: число вызовов в повторе подбирается под неё
+MIN_REPEAT_SECONDS = 0.05
+
+
+@dataclass(frozen=True)
+class Case:
+    """
+    Замеряемая функция:
+    - prepare: готовит аргумент из текста и языка корпуса (не входит в замер)
+    - func: замеряемый вызов
+    """
+    name: str
+    prepare: Callable[[str, str], Any]
+    func: Callable[[Any], Any]
+
+
+def _text(text: str, language: str) -> str:
+    return text
+
+
+def _file_bytes(text: str, language: str) -> bytes:
+    # garbage — исходные случайные байты: кодировка определяется по однобайтовым эвристикам
+    return text.encode("latin-1" if language == "garbage" else "utf-8")
+
+
+def _legacy_file_bytes(text: str, language: str) -> bytes:
+    return text.encode("latin-1" if language == "garbage" else "windows-1251", errors="replace")
+
+
+CASES = (
+    Case("decode_content", _file_bytes, decode_content),
+    Case("decode_content_cp1251", _legacy_file_bytes, decode_content),
+    Case("clean_words", _text, clean_words),
+    Case("word_counts", _text, word_counts),
+    Case("term_frequency", _text, term_frequency),
+    Case("build_huffman_tree", _text, build_huffman_tree),
+    Case("generate_codes", lambda text, language: build_huffman_tree(text), generate_codes),
+    Case("huffman_encode", _text, huffman_encode),
+    Case("huffman_encode_binary", _text, huffman_encode_binary),
+    Case("huffman_decode_binary", lambda text, language: huffman_encode_binary(text), huffman_decode_binary),
+)
+
+
+def measure_time(func: Callable[[Any], Any], arg: Any, repeat: int) -> list[float]:
+    """Время одного вызова в каждом из repeat повторов, секунды."""
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            func(arg)
+        elapsed = time.perf_counter() - started
+        if elapsed >= MIN_REPEAT_SECONDS:
+            break
+        number *= 2
+
+    timings = [elapsed / number]
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat - 1):
+            started = time.perf_counter()
+            for _ in range(number):
+                func(arg)
+            timings.append((time.perf_counter() - started) / number)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return timings
+
+
+def measure_memory(func: Callable[[Any], Any], arg: Any) -> dict:
+    """Пик выделенной памяти во время вызова и память, удерживаемая результатом."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        result = func(arg)
+        current, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    retained = after.compare_to(before, "filename")
+    del result
+    return {
+        "peak_kb": round((peak - baseline) / 1024, 1),
+        "retained_kb": round((current - baseline) / 1024, 1),
+        "retained_blocks": sum(stat.count_diff for stat in retained if stat.count_diff > 0),
+    }
+
+
+def run(functions: list[str], languages: list[str], sizes: list[int], repeat: int) -> list[dict]:
+    results = []
+    cases = [case for case in CASES if case.name in functions]
+    for language in languages:
+        for size in sizes:
+            text = synthetic_text(language, size)
+            for case in cases:
+                arg = case.prepare(text, language)
+                timings = measure_time(case.func, arg, repeat)
+                median = statistics.median(timings)
+                results.append({
+                    "function": case.name,
+                    "language": language,
+                    "chars": len(text),
+                    "median_ms": round(median * 1000, 4),
+                    "best_ms": round(min(timings) * 1000, 4),
+                    "ns_per_char": round(median * 1e9 / len(text), 2),
+                    **measure_memory(case.func, arg),
+                })
+    return results
+
+
+def _key(result: dict) -> tuple:
+    return result["function"], result["language"], result["chars"]
+
+
+def print_report(results: list[dict], baseline: list[dict] | None) -> None:
+    previous = {_key(result): result for result in baseline or ()}
+    header = f"{'функция':<24}{'язык':<9}{'символов':>10}{'медиана, мс':>13}{'нс/симв':>10}{'пик, КБ':>10}{'блоков':>9}"
+    print(header + ("  изменение" if baseline else ""))
+    for result in results:
+        line = (
+            f"{result['function']:<24}{result['language']:<9}{result['chars']:>10}"
+            f"{result['median_ms']:>13.3f}{result['ns_per_char']:>10.1f}"
+            f"{result['peak_kb']:>10.1f}{result['retained_blocks']:>9}"
+        )
+        old = previous.get(_key(result))
+        if old:
+            line += f"  {(result['ns_per_char'] / old['ns_per_char'] - 1) * 100:+.1f}%"
+        print(line)
+
+
+if __name__ == "__main__":
+    names = [case.name for case in CASES]
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--functions", type=lambda v: v.split(","), default=names, help=f"через запятую: {', '.join(names)}")
+    parser.add_argument("--languages", type=lambda v: v.split(","), default=list(LANGUAGES), help="ru, en, mixed, garbage")
+    parser.add_argument(
+        "--sizes", type=lambda v: [parse_size(s) for s in v.split(",")], default=[1024, 64 * 1024, 1024 * 1024],
+        help="размеры текста в символах через запятую, например 1k,64k,1m"
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="количество повторов для медианы")
+    parser.add_argument("--output", help="файл для сохранения результатов в JSON")
+    parser.add_argument("--compare", help="JSON предыдущего прогона для сравнения нс/символ")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+
+    results = run(args.functions, args.languages, args.sizes, args.repeat)
+    print_report(results, baseline)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"repeat": args.repeat, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.output}")
@@ -0,0 +1,102 @@
+"""
+Скорость токенизаторов из app/tokenizers.py в словах в секунду.
+
+Для сравнения замеряется и прежняя реализация clean_words (re.findall с шаблоном в строке
+по text.lower()). Каждый токенизатор прогоняется в двух режимах: tokenize (список термов,
+как для запроса) и count (подсчёт термов, как при загрузке документа), и сравнивается с legacy
+в том же режиме. Отдельно показана скорость первого вызова с пустым кэшем основ.
+
+Слова в секунду считаются по числу слов во входном тексте, а не по числу термов на выходе,
+чтобы токенизаторы со стоп-словами не выглядели медленнее из-за отброшенных слов.
+
+    python -m benchmarks.tokenizers --sizes 64k,1m --output tokenizers.json
+"""
+import argparse
+import json
+import re
+import statistics
+import time
+from collections import Counter
+
+from benchmarks.corpus import LANGUAGES, synthetic_text, parse_size
+from benchmarks.micro import measure_time
+from app.tokenizers import TOKENIZERS, stem
+
+
+def legacy_clean_words(text: str) -> list[str]:
+    """clean_words до появления app/tokenizers.py."""
+    return re.findall(r'\b[^\W\d_]{2,}\b', text.lower())
+
+
+def _cases():
+    yield "legacy", "tokenize", legacy_clean_words
+    yield "legacy", "count", lambda text: Counter(legacy_clean_words(text))
+    for tokenizer in TOKENIZERS.values():
+        yield tokenizer.name, "tokenize", tokenizer.tokenize
+        yield tokenizer.name, "count", tokenizer.count
+
+
+def run(languages: list[str], sizes: list[int], repeat: int) -> list[dict]:
+    results = []
+    for language in languages:
+        for size in sizes:
+            text = synthetic_text(language, size)
+            words = len(legacy_clean_words(text))
+            if not words:
+                continue
+            for name, mode, func in _cases():
+                stem.cache_clear()
+                started = time.perf_counter()
+                terms = func(text)
+                cold = time.perf_counter() - started
+                median = statistics.median(measure_time(func, text, repeat))
+                results.append({
+                    "tokenizer": name,
+                    "mode": mode,
+                    "language": language,
+                    "chars": len(text),
+                    "words": words,
+                    "terms": len(set(terms)),
+                    "median_ms": round(median * 1000, 4),
+                    "words_per_sec": round(words / median),
+                    "cold_words_per_sec": round(words / cold),
+                })
+    return results
+
+
+def print_report(results: list[dict]) -> None:
+    legacy = {
+        (result["mode"], result["language"], result["chars"]): result["words_per_sec"]
+        for result in results
+        if result["tokenizer"] == "legacy"
+    }
+    print(
+        f"{'токенизатор':<13}{'режим':<10}{'язык':<9}{'символов':>10}{'терминов':>10}"
+        f"{'слов/с':>13}{'холодный':>13}{'к legacy':>10}"
+    )
+    for result in results:
+        baseline = legacy.get((result["mode"], result["language"], result["chars"]))
+        print(
+            f"{result['tokenizer']:<13}{result['mode']:<10}{result['language']:<9}{result['chars']:>10}"
+            f"{result['terms']:>10}{result['words_per_sec']:>13,}{result['cold_words_per_sec']:>13,}"
+            f"{result['words_per_sec'] / baseline:>9.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--languages", type=lambda v: v.split(","), default=["ru", "en", "mixed"], help=", ".join(LANGUAGES))
+    parser.add_argument(
+        "--sizes", type=lambda v: [parse_size(s) for s in v.split(",")], default=[64 * 1024, 1024 * 1024],
+        help="размеры текста в символах через запятую, например 64k,1m"
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="количество повторов для медианы")
+    parser.add_argument("--output", help="файл для сохранения результатов в JSON")
+    args = parser.parse_args()
+
+    results = run(args.languages, args.sizes, args.repeat)
+    print_report(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"repeat": args.repeat, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.output}")
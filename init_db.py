@@ -1,10 +1,15 @@
 import asyncio
 from app.database import engine, Base
+from app.migrations import run_migrations
+# Регистрация всех моделей в Base.metadata
+from app.models import user, document, collection, term_index, job  # noqa: F401
 
 async def init():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
         print("✅ Таблицы успешно созданы")
+    applied = await run_migrations(engine)
+    print(f"✅ Применено миграций: {len(applied)}")
 
 if __name__ == "__main__":
     asyncio.run(init())
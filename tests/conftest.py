@@ -0,0 +1,6 @@
+import os
+
+# app.database требует настройки подключения при импорте; сами тесты к БД не обращаются
+os.environ.setdefault("POSTGRES_USER", "test")
+os.environ.setdefault("POSTGRES_PASSWORD", "test")
+os.environ.setdefault("POSTGRES_DB", "test")
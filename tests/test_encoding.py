@@ -0,0 +1,35 @@
+import codecs
+
+import pytest
+
+from app.encoding import detect_bytes_encoding, detect_encoding
+
+RUSSIAN = "Съешь же ещё этих мягких французских булок, да выпей чаю. " * 50
+FRENCH = "Le cœur déçu mais l'âme plutôt naïve, Louÿs rêva de crapaüter. " * 50
+
+
+@pytest.mark.parametrize("data, encoding, reason", [
+    (codecs.BOM_UTF8 + RUSSIAN.encode("utf-8"), "utf-8-sig", "bom"),
+    (RUSSIAN.encode("utf-16"), "utf-16", "bom"),
+    (RUSSIAN.encode("utf-32"), "utf-32", "bom"),
+    (b"plain ascii text", "utf-8", "ascii"),
+    (RUSSIAN.encode("utf-8"), "utf-8", "utf-8"),
+    (RUSSIAN.encode("windows-1251"), "windows-1251", "cyrillic"),
+    (RUSSIAN.encode("koi8-r"), "koi8-r", "cyrillic"),
+    (RUSSIAN.encode("cp866"), "cp866", "cyrillic"),
+    (FRENCH.encode("cp1252"), "cp1252", "latin"),
+])
+def test_detect_bytes_encoding(data, encoding, reason):
+    detection = detect_bytes_encoding(data)
+    assert (detection.encoding, detection.reason) == (encoding, reason)
+
+
+def test_utf8_character_cut_between_blocks():
+    data = ("я" * 100).encode("utf-8")
+    # Блоки из середины файла могут начинаться и заканчиваться внутри символа
+    assert detect_encoding([data[:51], data[51:101], data[101:]]).encoding == "utf-8"
+
+
+def test_utf8_character_cut_at_end_of_file():
+    data = ("я" * 100).encode("utf-8")
+    assert detect_encoding([data[:100], data[100:-1]]).reason != "utf-8"
@@ -0,0 +1,54 @@
+import struct
+
+import pytest
+
+from app.services import (
+    HUFFMAN_HEADER, HUFFMAN_MAGIC, HUFFMAN_SYMBOL,
+    huffman_binary_to_text, huffman_decode_binary, huffman_encode_binary,
+)
+
+
+def header(symbols: list[tuple[str, int]], bit_length: int) -> bytes:
+    data = HUFFMAN_HEADER.pack(HUFFMAN_MAGIC, len(symbols), bit_length)
+    return data + b"".join(HUFFMAN_SYMBOL.pack(ord(char), length) for char, length in symbols)
+
+
+@pytest.mark.parametrize("text", [
+    "",
+    "a",
+    "aaaa",
+    "abracadabra",
+    "Привет, мир! Hello, world!\n" * 100,
+    "".join(chr(code) for code in range(0x20, 0x3000)),
+])
+def test_round_trip(text):
+    assert huffman_decode_binary(huffman_encode_binary(text)) == text
+
+
+def test_text_form_matches_binary():
+    encoded = huffman_encode_binary("abracadabra")
+    bits, codes = huffman_binary_to_text(encoded)
+    assert "".join(codes[char] for char in "abracadabra") == bits
+
+
+@pytest.mark.parametrize("data", [
+    b"XXXX" + HUFFMAN_HEADER.pack(HUFFMAN_MAGIC, 1, 1)[4:] + HUFFMAN_SYMBOL.pack(97, 1) + b"\x00",
+    header([], 8) + b"\x00",                                  # пустая таблица с ненулевой длиной кода
+    header([("a", 0)], 8) + b"\x00",                          # нулевая длина кода
+    header([("a", 1), ("a", 2)], 8) + b"\x00",                # повтор символа
+    header([("a", 1), ("b", 1), ("c", 1)], 8) + b"\x00",      # нарушено неравенство Крафта
+    header([("a", 1)], 80) + b"\x00",                         # бит меньше, чем заявлено
+    HUFFMAN_HEADER.pack(HUFFMAN_MAGIC, 10 ** 6, 8) + b"\x00", # таблица обрезана
+    header([("a", 1)], 8) + b"\xff",                          # код, которого нет в таблице
+    header([("a", 2), ("b", 2)], 3) + b"\x00",                # последний код обрезан
+])
+def test_malformed_input_is_rejected(data):
+    with pytest.raises((ValueError, struct.error)):
+        huffman_decode_binary(data)
+
+
+def test_unmatched_codes_fail_fast():
+    # Длинный код, не совпадающий ни с одним символом, не должен накапливаться до конца данных
+    payload = b"\xff" * 100_000
+    with pytest.raises(ValueError):
+        huffman_decode_binary(header([("a", 1), ("b", 200)], len(payload) * 8) + payload)
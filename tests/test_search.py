@@ -0,0 +1,36 @@
+from app.search import decode_block, decode_varints, encode_varints, plan_appends
+
+
+def test_varints_round_trip():
+    values = [0, 1, 127, 128, 255, 300, 16_383, 16_384, 2 ** 32 - 1]
+    assert list(decode_varints(encode_varints(values))) == values
+
+
+def test_varint_length():
+    assert encode_varints([127]) == b"\x7f"
+    assert encode_varints([128]) == b"\x80\x01"
+
+
+def decoded(row: dict) -> list[tuple[int, int, int]]:
+    block = decode_block(row["doc_ids"], row["counts"], row["norms"])
+    return list(zip(block.doc_ids, block.counts, block.norms))
+
+
+def test_plan_appends_splits_new_postings_into_blocks():
+    entries = [(doc_id, doc_id % 5 + 1, doc_id % 7) for doc_id in range(1, 11)]
+    rows = plan_appends({42: entries}, {}, block_size=4)
+    assert [(row["block"], row["doc_count"], row["last_doc_id"]) for row in rows] == [(0, 4, 4), (1, 4, 8), (2, 2, 10)]
+    assert [entry for row in rows for entry in decoded(row)] == entries
+
+
+def test_plan_appends_fills_last_block():
+    rows = plan_appends({7: [(10, 1, 0), (11, 2, 0), (12, 3, 0)]}, {7: (3, 2, 9)}, block_size=4)
+    assert [(row["block"], row["doc_count"], row["last_doc_id"]) for row in rows] == [(3, 2, 11), (4, 1, 12)]
+    # Байты дописываются в конец блока: первая разность считается от последнего документа блока
+    assert list(decode_varints(rows[0]["doc_ids"])) == [1, 1]
+
+
+def test_plan_appends_starts_new_block_for_smaller_doc_id():
+    rows = plan_appends({7: [(5, 1, 0)]}, {7: (0, 2, 9)}, block_size=4)
+    assert [(row["block"], row["doc_count"]) for row in rows] == [(1, 1)]
+    assert decoded(rows[0]) == [(5, 1, 0)]
@@ -0,0 +1,43 @@
+import pytest
+
+from app.storage import ContentStore, LocalContentStore, parse_byte_range
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("", None),
+    ("items=0-10", None),
+    ("bytes=0-10,20-30", None),
+    ("bytes=0-9", (0, 9)),
+    ("bytes=10-", (10, 99)),
+    ("bytes=90-200", (90, 99)),
+    ("bytes=-10", (90, 99)),
+    ("bytes=-500", (0, 99)),
+])
+def test_parse_byte_range(header, expected):
+    assert parse_byte_range(header, 100) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=10-5", "bytes=-0", "bytes=a-b", "bytes=-"])
+def test_parse_byte_range_unsatisfiable(header):
+    with pytest.raises(ValueError):
+        parse_byte_range(header, 100)
+
+
+def test_incomplete_backend_cannot_be_created():
+    class PutOnly(ContentStore):
+        def put(self, data: bytes) -> str:
+            return ""
+
+    with pytest.raises(TypeError):
+        PutOnly()
+
+
+@pytest.mark.parametrize("codec", ["gz", "raw"])
+def test_local_store_round_trip(tmp_path, codec):
+    store = LocalContentStore(str(tmp_path), codec)
+    data = "Привет, мир".encode("utf-8") * 1000
+    ref = store.put(data)
+    assert store.put(data) == ref
+    assert store.read(ref) == data
+    assert b"".join(store.iter_range(ref, 5, 1004, chunk_size=64)) == data[5:1005]
@@ -0,0 +1,28 @@
+import unicodedata
+
+import pytest
+
+from app.services import StreamingTokenizer, word_counts
+
+TEXT = unicodedata.normalize("NFD", "Майка, райка и чайка — slow_motion 2024 год! ") * 20
+
+
+def counts_by_chunks(text: str, size: int, tokenizer: str):
+    splitter = StreamingTokenizer()
+    parts = [splitter.feed(text[start:start + size]) for start in range(0, len(text), size)]
+    parts.append(splitter.close())
+    return sum((word_counts(part, tokenizer) for part in parts), start=word_counts("", tokenizer))
+
+
+@pytest.mark.parametrize("tokenizer", ["simple", "normalized", "stemmed"])
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64])
+def test_chunked_counts_match_whole_text(size, tokenizer):
+    assert counts_by_chunks(TEXT, size, tokenizer) == word_counts(TEXT, tokenizer)
+
+
+def test_combining_mark_stays_with_word():
+    splitter = StreamingTokenizer()
+    # «й» в NFD: «и» + U+0306; граница порции проходит сразу после знака
+    assert splitter.feed("ра" + "й") == ""
+    assert splitter.feed("ка ") == "райка "
+    assert splitter.close() == ""